@@ -110,7 +110,6 @@ static const uint8_t cdc_descriptor[] = {
 };
 
 #define WR_BUFF_SIZE       (sizeof(response_t))
-#define DATA_RPT_BUFF_SIZE (sizeof(ina229_data_report_t))
 #define RD_BUFF_SIZE       (256)
 
 USB_NOCACHE_RAM_SECTION USB_MEM_ALIGNX uint8_t read_buffer1[RD_BUFF_SIZE];
@@ -259,7 +258,7 @@ void cdc_acm_cmd_response_send(void)
 
 void cdc_acm_data_rpt_send(void)
 {
-    usbd_ep_start_write(CDC2_IN_EP, data_rpt_buffer, DATA_RPT_BUFF_SIZE);
+    usbd_ep_start_write(CDC2_IN_EP, data_rpt_buffer, ina229_get_report_len());
 }
 
 void cdc_acm_prints(char *str)
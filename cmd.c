@@ -144,7 +144,7 @@ void cmd_process(uint8_t *cmd_buff, uint32_t len)
             break;
         case CMD_START_MEASURE:
             printf("CMD start measuring\r\n");
-            ina229_start_measure();
+            ina229_start_measure(p_cmd->param_1);
             resp->result = 1;
             cdc_acm_cmd_response_send();
             break;
@@ -154,6 +154,39 @@ void cmd_process(uint8_t *cmd_buff, uint32_t len)
             resp->result = 1;
             cdc_acm_cmd_response_send();
             break;
+        case CMD_SET_REPORT_SIZE:
+            {
+                uint16_t sample_size = (uint16_t)((p_cmd->param_1 << 8) | p_cmd->param_2);
+                if(sample_size == 0)
+                {
+                    printf("CMD read report size\r\n");
+                    resp->result = 1;
+                }
+                else
+                {
+                    printf("CMD set report size\r\n");
+                    resp->result = ina229_set_report_size(sample_size) ? 1 : 0;
+                }
+                sample_size = ina229_get_report_size();
+                resp->reserve_1 = (uint8_t)(sample_size >> 8);
+                resp->reserve_2 = (uint8_t)(sample_size & 0xFF);
+                cdc_acm_cmd_response_send();
+            }
+            break;
+        case CMD_SET_CHANNELS:
+            if(p_cmd->param_1 == 0)
+            {
+                printf("CMD read channels\r\n");
+                resp->result = 1;
+            }
+            else
+            {
+                printf("CMD set channels\r\n");
+                resp->result = ina229_set_channels(p_cmd->param_1) ? 1 : 0;
+            }
+            resp->reserve_1 = ina229_get_channels();
+            cdc_acm_cmd_response_send();
+            break;
         default:
             printf("Unknown cmd type\r\n");
             resp->result = 0;
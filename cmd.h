@@ -50,13 +50,25 @@
  *  [0] 0x06      0x00       0x00        0x00         : Battery simulator volatge output disable
  *  [0] 0x06      0x0/1      0x00        0x00         : Response
  * --------------------------------------------------------------------------------------------
- *  [0] 0x07      0x00       0x00        0x00         : Start measuring
+ *  [0] 0x07      0x00       0x00        0x00         : Start measuring, scaled reports
+ *  [0] 0x07      0x01       0x00        0x00         : Start measuring, packed raw code reports
+ *  [0] 0x07      0x02       0x00        0x00         : Start measuring, channel reports (see ina229.h)
  *                                                    : No response
  * --------------------------------------------------------------------------------------------
  *  [0] 0x08      0x00       0x00        0x00         : Stop measuring
  *                                                    : No response
  * --------------------------------------------------------------------------------------------
- *  [0] sign[0]   sign[1]    sign[2]     sign[3]      : Data streaming report (LEN = 2048 bytes)
+ *  [0] 0x09      VAL_H      VAL_L       0x00         : Set the report sample count (only while stopped)
+ *  [0] 0x09      0x00       0x00        0x00         : Read the report sample count
+ *  [0] 0x09      0x0/1      VAL_H       VAL_L        : Response, active report sample count
+ * --------------------------------------------------------------------------------------------
+ *  [0] 0x0A      mask       0x00        0x00         : Select the channel stream mode channels (only while stopped)
+ *                                                    : VBUS 0x01, CURRENT 0x02, VSHUNT 0x04,
+ *                                                    : DIETEMP 0x08, POWER 0x10, DIAG_ALRT 0x20
+ *  [0] 0x0A      0x00       0x00        0x00         : Read the selected channels
+ *  [0] 0x0A      0x0/1      mask        0x00         : Response, active channels
+ * --------------------------------------------------------------------------------------------
+ *  [0] sign[0]   sign[1]    sign[2]     sign[3]      : Data streaming report (LEN = 8 + 8 x count bytes)
  *  [1] id[0]     id[1]      id[2]       id[3]        : ID low word
  *  [2] v[0]      v[1]       v[2]        v[3]         : Voltage data [V] (first half is voltage)
  *  [3] v[0]      v[1]       v[2]        v[3]         :
@@ -64,6 +76,13 @@
  *  [n] i[0]      i[1]       i[2]        i[3]         : Current [mA] (second half is current)
  *  [m] i[0]      i[1]       i[2]        i[3]         :
  * --------------------------------------------------------------------------------------------
+ *  [0] sign[0]   sign[1]    sign[2]     sign[3]      : Packed data report, sign 0x87654322 (same LEN)
+ *  [1] id[0]     id[1]      id[2]       id[3]        : ID low word
+ *  [2] ilsb[0]   ilsb[1]    ilsb[2]     ilsb[3]      : Current LSB [A] (float)
+ *  [3] vlsb[0]   vlsb[1]    vlsb[2]     vlsb[3]      : VBUS LSB [V] (float)
+ *  [4] s[0]      s[1]       s[2]        s[3]         : (LEN - 16) / 5 samples, each a 40-bit LE word
+ *  .........................................         : VBUS code [19:0], CURRENT code [39:20]
+ * --------------------------------------------------------------------------------------------
  *
  *************************************************************************************************/
 
@@ -93,7 +112,9 @@ typedef enum {
     CMD_SET_BAT_SIM_VOLT   = 0x05,
     CMD_BAT_SIM_OUTPUT     = 0x06,
     CMD_START_MEASURE      = 0x07,
-    CMD_STOP_MEASURE       = 0x08
+    CMD_STOP_MEASURE       = 0x08,
+    CMD_SET_REPORT_SIZE    = 0x09,
+    CMD_SET_CHANNELS       = 0x0A
 } cmd_code_t;
 
 void cmd_process(uint8_t *cmd_buff, uint32_t len);
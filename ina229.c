@@ -45,6 +45,116 @@ static uint8_t diag_alrt[3];
 
 static volatile uint32_t g_id = 0;
 static uint32_t g_sample_idx = 0;
+static uint8_t g_stream_mode = STREAM_MODE_SCALED;
+static uint16_t g_rpt_sample_size = DATA_RPT_SAMPLE_SIZE;
+static uint16_t g_rpt_packed_sample_size = PACKED_RPT_SAMPLE_SIZE(DATA_RPT_SAMPLE_SIZE);
+static uint8_t g_channels = CHANNEL_VBUS | CHANNEL_CURRENT;
+static uint16_t g_rpt_channel_sample_size = CHANNEL_RPT_SAMPLE_SIZE(DATA_RPT_SAMPLE_SIZE, 2);
+static volatile bool g_measuring = false;
+
+static void packed_sample_store(uint32_t vbus, uint32_t current)
+{
+    ina229_packed_report_t *p_packed_rpt = (ina229_packed_report_t *)p_data_rpt_buf;
+    uint8_t *p = &p_packed_rpt->samples[g_sample_idx * PACKED_SAMPLE_BYTES];
+
+    /* 40-bit little endian word: VBUS in bits [19:0], CURRENT in bits [39:20] */
+    p[0] = (uint8_t)vbus;
+    p[1] = (uint8_t)(vbus >> 8);
+    p[2] = (uint8_t)(((vbus >> 16) & 0x0F) | ((current & 0x0F) << 4));
+    p[3] = (uint8_t)(current >> 4);
+    p[4] = (uint8_t)(current >> 12);
+
+    g_sample_idx += 1;
+    if(g_sample_idx >= g_rpt_packed_sample_size)
+    {
+        p_packed_rpt->sign = DATA_RPT_PACKED_SIGN;
+        p_packed_rpt->id = g_id;
+        p_packed_rpt->current_lsb = ina229_lsb.current_lsb;
+        p_packed_rpt->vbus_lsb = ina229_lsb.vbus_lsb;
+        g_id += 1;
+        g_sample_idx = 0;
+        irq_flag = 1; /* flag to send out the report data */
+    }
+}
+
+static int32_t code20(uint8_t *buff)
+{
+    /* 20-bit two's complement in bits [23:4] of a 24-bit register */
+    int32_t code = (((buff[1] << 16) | (buff[2] << 8) | buff[3]) >> 4) & 0xFFFFF;
+
+    if (code & 0x80000) {
+        code |= 0xFFF00000;
+    }
+    return code;
+}
+
+static uint8_t channel_num(uint8_t channels)
+{
+    uint8_t num = 0;
+
+    for(; channels; channels >>= 1)
+    {
+        num += channels & 0x01;
+    }
+    return num;
+}
+
+static void channel_sample_store(int32_t vbus, int32_t current)
+{
+    ina229_channel_report_t *p_channel_rpt = (ina229_channel_report_t *)p_data_rpt_buf;
+    int32_t *p = &p_channel_rpt->data[g_sample_idx];
+    uint16_t n = g_rpt_channel_sample_size;
+    uint8_t buff[4];
+
+    /* One array per selected channel, in channel bit order */
+    if(g_channels & CHANNEL_VBUS)
+    {
+        *p = vbus;
+        p += n;
+    }
+    if(g_channels & CHANNEL_CURRENT)
+    {
+        *p = current;
+        p += n;
+    }
+    if(g_channels & CHANNEL_VSHUNT)
+    {
+        ina229_reg_read(VSHUNT, buff, 4);
+        *p = code20(buff);
+        p += n;
+    }
+    if(g_channels & CHANNEL_DIETEMP)
+    {
+        ina229_reg_read(DIETEMP, buff, 3);
+        *p = (int16_t)((buff[1] << 8) | buff[2]);
+        p += n;
+    }
+    if(g_channels & CHANNEL_POWER)
+    {
+        ina229_reg_read(POWER, buff, 4);
+        *p = (buff[1] << 16) | (buff[2] << 8) | buff[3];
+        p += n;
+    }
+    if(g_channels & CHANNEL_DIAG_ALRT)
+    {
+        *p = (diag_alrt[1] << 8) | diag_alrt[2];
+    }
+
+    g_sample_idx += 1;
+    if(g_sample_idx >= n)
+    {
+        p_channel_rpt->sign = DATA_RPT_CHANNEL_SIGN;
+        p_channel_rpt->id = g_id;
+        p_channel_rpt->channels = g_channels;
+        p_channel_rpt->sample_size = n;
+        p_channel_rpt->current_lsb = ina229_lsb.current_lsb;
+        p_channel_rpt->vbus_lsb = ina229_lsb.vbus_lsb;
+        p_channel_rpt->vshunt_lsb = ina229_lsb.vshunt_lsb;
+        g_id += 1;
+        g_sample_idx = 0;
+        irq_flag = 1; /* flag to send out the report data */
+    }
+}
 
 static void gpio0_isr(uint8_t pin)
 {
@@ -63,6 +173,13 @@ static void gpio0_isr(uint8_t pin)
         vbus = (vbus_raw >> 4) & 0xFFFFF; // Extract bits [23:4]
         current = (current_raw >> 4) & 0xFFFFF; // Extract bits [23:4]
 
+        if(g_stream_mode == STREAM_MODE_PACKED)
+        {
+            /* Two's complement codes are sign extended and scaled on the PC */
+            packed_sample_store(vbus, current);
+            return;
+        }
+
         // Convert the 20-bit two's complement value to a signed integer
         if (vbus & 0x80000) { // Check the sign bit (bit 19 in the 20-bit value)
             vbus |= 0xFFF00000; // If the sign bit is set, extend the sign to the 32-bit value
@@ -73,23 +190,26 @@ static void gpio0_isr(uint8_t pin)
             current |= 0xFFF00000; // If the sign bit is set, extend the sign to the 32-bit value
         }
 
-        p_data_rpt->voltage[g_sample_idx] = vbus*ina229_lsb.vbus_lsb;
-        p_data_rpt->current[g_sample_idx] = current*ina229_lsb.current_lsb*1000;
+        if(g_stream_mode == STREAM_MODE_CHANNELS)
+        {
+            channel_sample_store(vbus, current);
+            return;
+        }
+
+        p_data_rpt->data[g_sample_idx] = vbus*ina229_lsb.vbus_lsb;
+        p_data_rpt->data[g_rpt_sample_size + g_sample_idx] = current*ina229_lsb.current_lsb*1000;
 
-        // printf("Vbus[V] = %f\t current[mA] = %f\r\n",  p_data_rpt->voltage[g_sample_idx], p_data_rpt->current[g_sample_idx]);
+        // printf("Vbus[V] = %f\t current[mA] = %f\r\n",  p_data_rpt->data[g_sample_idx], p_data_rpt->data[g_rpt_sample_size + g_sample_idx]);
 
-        if(g_sample_idx >= DATA_RPT_SAMPLE_SIZE)
+        g_sample_idx += 1;
+        if(g_sample_idx >= g_rpt_sample_size)
         {
-            p_data_rpt->sign = 0x87654321;
+            p_data_rpt->sign = DATA_RPT_SIGN;
             p_data_rpt->id = g_id;
             g_id += 1;
             g_sample_idx = 0;
             irq_flag = 1; /* flag to send out the report data */
         }
-        else
-        {
-            g_sample_idx += 1;
-        }
     }
 }
 
@@ -194,7 +314,7 @@ void ina229_reset(void)
     bflb_mtimer_delay_ms(10);
 }
 
-void ina229_start_measure(void)
+void ina229_start_measure(uint8_t stream_mode)
 {
     uint8_t adc_cfg[3];
     uint16_t adc_cfg_value;
@@ -202,10 +322,21 @@ void ina229_start_measure(void)
     /* Reset data report id */
     g_id = 0;
     g_sample_idx = 0;
+    g_stream_mode = (stream_mode <= STREAM_MODE_CHANNELS) ? stream_mode : STREAM_MODE_SCALED;
+    g_measuring = true;
 
     ina229_reg_read(ADC_CONFIG, adc_cfg, 3);
     adc_cfg_value = (uint16_t)((adc_cfg[1] << 8) | (adc_cfg[2]));
-    ina229_reg_write(ADC_CONFIG, (0xB << 12) | adc_cfg_value);
+    if((g_stream_mode == STREAM_MODE_CHANNELS) && (g_channels & CHANNEL_DIETEMP))
+    {
+        /* Continuous bus voltage, shunt voltage and temperature */
+        ina229_reg_write(ADC_CONFIG, (0xF << 12) | adc_cfg_value);
+    }
+    else
+    {
+        /* Continuous shunt and bus voltage */
+        ina229_reg_write(ADC_CONFIG, (0xB << 12) | adc_cfg_value);
+    }
 }
 
 void ina229_stop_measure(void)
@@ -215,6 +346,65 @@ void ina229_stop_measure(void)
     ina229_reg_read(ADC_CONFIG, adc_cfg, 3);
     adc_cfg_value = (uint16_t)((adc_cfg[1] << 8) | (adc_cfg[2]));
     ina229_reg_write(ADC_CONFIG, adc_cfg_value & 0xFFF);
+    g_measuring = false;
+}
+
+bool ina229_set_report_size(uint16_t sample_size)
+{
+    /* The report buffer is shared with the ISR, only resize while stopped */
+    if(g_measuring)
+    {
+        printf("Can't change the report size while measuring\r\n");
+        return false;
+    }
+
+    if((sample_size < DATA_RPT_MIN_SAMPLE_SIZE) || (sample_size > DATA_RPT_MAX_SAMPLE_SIZE))
+    {
+        printf("Invalid report sample size %d\r\n", sample_size);
+        return false;
+    }
+
+    g_rpt_sample_size = sample_size;
+    g_rpt_packed_sample_size = PACKED_RPT_SAMPLE_SIZE(sample_size);
+    g_rpt_channel_sample_size = CHANNEL_RPT_SAMPLE_SIZE(sample_size, channel_num(g_channels));
+    printf("Report sample size     : %d (%d packed)\r\n", g_rpt_sample_size, g_rpt_packed_sample_size);
+    return true;
+}
+
+uint16_t ina229_get_report_size(void)
+{
+    return g_rpt_sample_size;
+}
+
+uint32_t ina229_get_report_len(void)
+{
+    /* All stream modes send the same number of bytes per report */
+    return DATA_RPT_SIZE(g_rpt_sample_size);
+}
+
+bool ina229_set_channels(uint8_t channels)
+{
+    if(g_measuring)
+    {
+        printf("Can't change the channels while measuring\r\n");
+        return false;
+    }
+
+    if((channels == 0) || (channels & ~CHANNEL_ALL))
+    {
+        printf("Invalid channels %X\r\n", channels);
+        return false;
+    }
+
+    g_channels = channels;
+    g_rpt_channel_sample_size = CHANNEL_RPT_SAMPLE_SIZE(g_rpt_sample_size, channel_num(channels));
+    printf("Channels               : %X (%d samples per report)\r\n", g_channels, g_rpt_channel_sample_size);
+    return true;
+}
+
+uint8_t ina229_get_channels(void)
+{
+    return g_channels;
 }
 
 /*
@@ -80,10 +80,53 @@
 
 /* Data report sample number */
 /*
- * sizeof(ina229_data_report_t) should be <=512 to ensure data
- * streaming won't be corrupt when the PC host is high work load
+ * A 63 samples report (512 bytes) is the default since it ensures data
+ * streaming won't be corrupt when the PC host is high work load. The host
+ * can negotiate larger reports with CMD_SET_REPORT_SIZE, up to
+ * DATA_RPT_MAX_SAMPLE_SIZE (8 KB), to cut the per report overhead at high
+ * sample rates.
  */
-#define DATA_RPT_SAMPLE_SIZE 63
+#define DATA_RPT_SAMPLE_SIZE     63
+#define DATA_RPT_MIN_SAMPLE_SIZE 8
+#define DATA_RPT_MAX_SAMPLE_SIZE 1023
+#define DATA_RPT_HEADER_SIZE     (4 + 4) /* sign + id */
+#define DATA_RPT_SIZE(n)         (DATA_RPT_HEADER_SIZE + 4 * (n) * 2)
+#define DATA_RPT_BUFF_SIZE       DATA_RPT_SIZE(DATA_RPT_MAX_SAMPLE_SIZE)
+
+/*
+ * Packed stream mode: the raw 20-bit VBUS and CURRENT codes are sent as is
+ * and scaled on the PC with the LSBs carried in the report header.
+ * Each sample is one 40-bit little endian word:
+ *     bits [19:0]  VBUS code
+ *     bits [39:20] CURRENT code
+ * A packed report has the same length as the scaled report and holds as
+ * many samples as fit after its 16 bytes header (99 instead of 63 in 512
+ * bytes, 5 instead of 8 bytes per sample), trailing bytes are padding.
+ */
+#define DATA_RPT_SIGN             (0x87654321)
+#define DATA_RPT_PACKED_SIGN      (0x87654322)
+#define PACKED_SAMPLE_BYTES       5
+#define PACKED_RPT_HEADER_SIZE    (4 + 4 + 4 + 4) /* sign + id + current_lsb + vbus_lsb */
+#define PACKED_RPT_SAMPLE_SIZE(n) ((DATA_RPT_SIZE(n) - PACKED_RPT_HEADER_SIZE) / PACKED_SAMPLE_BYTES)
+
+/*
+ * Channel stream mode: a self describing report with any set of the
+ * channels below, selected with CMD_SET_CHANNELS. The header carries the
+ * channel mask, the samples per channel and the LSBs, followed by one
+ * int32 array of raw codes per selected channel in bit order:
+ *     VBUS       20-bit two's complement, x vbus_lsb [V]
+ *     CURRENT    20-bit two's complement, x current_lsb [A]
+ *     VSHUNT     20-bit two's complement, x vshunt_lsb [V]
+ *     DIETEMP    16-bit two's complement, x 7.8125 m°C
+ *     POWER      24-bit unsigned, x 3.2 x current_lsb [W]
+ *     DIAG_ALRT  16-bit flags
+ * The report has the same length as the scaled report, the samples per
+ * channel are whatever fits after the header.
+ */
+#define DATA_RPT_CHANNEL_SIGN     (0x87654323)
+#define CHANNEL_RPT_HEADER_SIZE   (4 + 4 + 2 + 2 + 4 + 4 + 4)
+#define CHANNEL_RPT_SAMPLE_SIZE(n, channel_num) \
+    ((DATA_RPT_SIZE(n) - CHANNEL_RPT_HEADER_SIZE) / (4 * (channel_num)))
 
 typedef enum {
     CONV_TIME_280uS  = 0x3,
@@ -114,6 +157,22 @@ typedef enum {
     AVG_ALERT_YES = 0x01
 } ina229_avg_alert_t;
 
+typedef enum {
+    STREAM_MODE_SCALED   = 0x00, /* int32 voltage [V] and current [mA] */
+    STREAM_MODE_PACKED   = 0x01, /* packed 20-bit raw codes + LSBs */
+    STREAM_MODE_CHANNELS = 0x02  /* selected channels, raw codes + LSBs */
+} ina229_stream_mode_t;
+
+typedef enum {
+    CHANNEL_VBUS      = 0x01,
+    CHANNEL_CURRENT   = 0x02,
+    CHANNEL_VSHUNT    = 0x04,
+    CHANNEL_DIETEMP   = 0x08,
+    CHANNEL_POWER     = 0x10,
+    CHANNEL_DIAG_ALRT = 0x20,
+    CHANNEL_ALL       = 0x3F
+} ina229_channel_t;
+
 typedef struct {
     uint8_t cnv_time;
     uint8_t avg_num;
@@ -132,20 +191,49 @@ typedef struct {
     float vbus_lsb;
 } ina229_lsb_param_t;
 
+/*
+ * The report length is negotiated at run time, voltage and current are
+ * the two halves of data[]:
+ *    data[0 .. n-1]  : Voltage [V]
+ *    data[n .. 2n-1] : Current [mA]
+ */
 typedef struct {
    uint32_t sign;
    uint32_t id;
-   int32_t voltage[DATA_RPT_SAMPLE_SIZE]; /* Voltage [V] */
-   int32_t current[DATA_RPT_SAMPLE_SIZE]; /* Current [mA] */
+   int32_t data[];
 } ina229_data_report_t;
 
+typedef struct {
+   uint32_t sign;
+   uint32_t id;
+   float current_lsb; /* [A] */
+   float vbus_lsb;    /* [V] */
+   uint8_t samples[];
+} ina229_packed_report_t;
+
+typedef struct {
+   uint32_t sign;
+   uint32_t id;
+   uint16_t channels;    /* ina229_channel_t mask */
+   uint16_t sample_size; /* Samples per channel */
+   float current_lsb;    /* [A] */
+   float vbus_lsb;       /* [V] */
+   float vshunt_lsb;     /* [V] */
+   int32_t data[];       /* sample_size codes per channel, in channel bit order */
+} ina229_channel_report_t;
+
 void ina229_reset(void);
 void ina229_init(void);
 void ina229_interface_bus_init(void);
 void ina229_enable_alert_interrupt(void);
 void ina229_disable_alert_interrupt(void);
 void ina229_param_config(ina229_config_t *config);
-void ina229_start_measure(void);
+void ina229_start_measure(uint8_t stream_mode);
+bool ina229_set_report_size(uint16_t sample_size);
+uint16_t ina229_get_report_size(void);
+uint32_t ina229_get_report_len(void);
+bool ina229_set_channels(uint8_t channels);
+uint8_t ina229_get_channels(void);
 void ina229_stop_measure(void);
 
 #endif /* _INA229_H_ */
\ No newline at end of file
@@ -39,7 +39,7 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolb
 
 # Constants
 SIGNATURE = 0x87654321
-DATA_RPT_SAMPLE_SIZE = 63  # The size of the current and voltage arrays
+DATA_RPT_SAMPLE_SIZE = 63  # Default size of the current and voltage arrays
 MAX_DATA_SIZE = 100000     # Maximum number of samples for zoom-out
 
 conversion_times = {
@@ -81,6 +81,7 @@ class UARTApp:
         self.serial_port = None
         self.is_receiving = False
         self.is_measuring = False
+        self.sample_size = DATA_RPT_SAMPLE_SIZE  # Read from the device on configuration
         self.receive_thread = None
         self.current_data = np.array([])  # Store received current data here
         self.voltage_data = np.array([])  # Store received voltage data here
@@ -448,6 +449,14 @@ class UARTApp:
                 messagebox.showerror("Error", "Device respone error")
                 return
 
+            # Read the report size (older firmware doesn't know 0x09, keep the default)
+            cmd = bytearray([0x09, 0x00, 0x00, 0x00])
+            self.serial_port.write(cmd)
+            response = self.serial_port.read(16)
+            if len(response) >= 4 and response[0] == cmd[0] and response[1] == 0x01:
+                self.sample_size = (response[2] << 8) | response[3]
+            self.output_text.insert(tk.END, f"Report size: {self.sample_size} samples\n")
+
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
@@ -490,16 +499,17 @@ class UARTApp:
     def receive_data(self):
         while self.is_receiving:
             try:
-                if self.serial_port.in_waiting >= (4 + 4 + 4 * DATA_RPT_SAMPLE_SIZE * 2):
-                    data = self.serial_port.read(4 + 4 + 4 * DATA_RPT_SAMPLE_SIZE * 2)
+                sample_size = self.sample_size
+                if self.serial_port.in_waiting >= (4 + 4 + 4 * sample_size * 2):
+                    data = self.serial_port.read(4 + 4 + 4 * sample_size * 2)
 
                     # Unpack the received data
                     sign, package_id = struct.unpack('<II', data[:8])
 
                     # Check the signature
                     if sign == SIGNATURE:
-                        voltage_data = struct.unpack('<' + 'i' * DATA_RPT_SAMPLE_SIZE, data[8:8 + 4 * DATA_RPT_SAMPLE_SIZE])
-                        current_data = struct.unpack('<' + 'i' * DATA_RPT_SAMPLE_SIZE, data[8 + 4 * DATA_RPT_SAMPLE_SIZE:])
+                        voltage_data = struct.unpack('<' + 'i' * sample_size, data[8:8 + 4 * sample_size])
+                        current_data = struct.unpack('<' + 'i' * sample_size, data[8 + 4 * sample_size:])
 
                         # Append to existing data for a smooth waveform
                         self.current_data = np.append(self.current_data, current_data)
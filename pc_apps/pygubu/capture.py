@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Capture file: the data port reports stored back to back exactly as received
+# (ina229_data_report_t), plus a JSON sidecar "<capture>.json" with the ADC
+# configuration needed to turn sample indexes into time.
+#
+# Derived channels (e.g. a filtered current, see filters.py) are stored next
+# to it as raw float32 "<capture>.<name>.f32", described in meta["derived"]:
+#   {"current_filtered": {"source": "current", "filter": "median:5",
+#                         "decimation": 1, "unit": "mA"}}
+# A capture of channel reports stores every streamed channel that way under
+# its own name, voltage and current at their raw code resolution next to the
+# whole V / mA samples of the report layout.
+#
+# A capture continued after the USB link dropped and came back lists the
+# interruptions in meta["gaps"]: [{"sample": first sample after the gap,
+# "start_time": wall clock time the link dropped, "duration": [s]}].
+
+import os
+import json
+import time
+import numpy as np
+
+from protocol import DATA_RPT_SAMPLE_SIZE, report_dtype, report_units, sample_period
+
+META_SUFFIX = ".json"
+DERIVED_SUFFIX = ".f32"
+
+def capture_meta(conv_time_key, avg_num_key, adc_range_key, sample_size=DATA_RPT_SAMPLE_SIZE):
+    return {
+        "format": "raw",
+        "sample_size": sample_size,
+        "conversion_times": conv_time_key,
+        "average_num": avg_num_key,
+        "adc_range": adc_range_key,
+        "sample_period": sample_period(conv_time_key, avg_num_key),
+        "start_time": time.time(),
+        "units": {name: unit for name, (scale, unit) in report_units.items()},
+        "scale": {name: scale for name, (scale, unit) in report_units.items()}
+    }
+
+def to_float(meta, name, values):
+    # Stored int32 values to float in meta["units"], call it on the slice
+    # that is displayed or reported, not on whole captures
+    return values * float(meta.get("scale", {}).get(name, 1.0))
+
+def read_meta(path):
+    with open(str(path) + META_SUFFIX, "r") as file:
+        return json.load(file)
+
+def write_meta(path, meta):
+    with open(str(path) + META_SUFFIX, "w") as file:
+        json.dump(meta, file, indent=4)
+
+def add_gap(path, meta, sample, start_time, duration):
+    meta.setdefault("gaps", []).append({"sample": sample, "start_time": start_time,
+                                        "duration": duration})
+    write_meta(path, meta)
+
+class CaptureWriter:
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.sample_size = meta.get("sample_size", DATA_RPT_SAMPLE_SIZE)
+        self.size = 0          # Bytes written
+        write_meta(path, meta)
+        self.file = open(path, "wb")
+
+    def write(self, report):
+        # report: raw bytes of one (or several) data reports
+        self.file.write(report)
+        self.size += len(report)
+
+    def mark_gap(self, start_time, duration):
+        # The samples written next follow a link interruption
+        sample = self.size // report_dtype(self.sample_size).itemsize * self.sample_size
+        add_gap(self.path, self.meta, sample, start_time, duration)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def derived_path(path, name):
+    return f"{path}.{name}{DERIVED_SUFFIX}"
+
+class DerivedWriter:
+    # Appends float32 samples of one derived channel
+    def __init__(self, path, name):
+        self.file = open(derived_path(path, name), "wb")
+
+    def write(self, values):
+        np.asarray(values, dtype=np.float32).tofile(self.file)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def read_derived(path, name):
+    # float32 samples of a derived channel, memory mapped
+    derived = derived_path(path, name)
+    count = os.path.getsize(derived) // 4
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(derived, dtype=np.float32, mode="r", shape=(count,))
+
+class Capture:
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+        self.sample_size = self.meta["sample_size"]
+        self.sample_period = self.meta["sample_period"]
+        dtype = report_dtype(self.sample_size)
+        # A capture cut short by a crash may end with a partial report, ignore it
+        count = os.path.getsize(path) // dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+        self.num_reports = len(self.records)
+        self.num_samples = self.num_reports * self.sample_size
+
+    def time_to_sample(self, t):
+        if t is None:
+            return None
+        return min(max(int(t / self.sample_period), 0), self.num_samples)
+
+    def read(self, start=0, stop=None):
+        # Return (voltage, current) int32 arrays for samples [start, stop)
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        start = min(max(start, 0), stop)
+        first = start // self.sample_size
+        last = -(-stop // self.sample_size)
+        block = self.records[first:last]
+        offset = start - first * self.sample_size
+        voltage = block["voltage"].reshape(-1)[offset:offset + stop - start]
+        current = block["current"].reshape(-1)[offset:offset + stop - start]
+        return voltage, current
+
+    def package_ids(self, start=0, stop=None):
+        # Report ids covering samples [start, stop)
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        if start >= stop:
+            return np.zeros(0, dtype=np.uint32)
+        return np.asarray(self.records["id"][start // self.sample_size:-(-stop // self.sample_size)])
+
+def open_capture(path):
+    if read_meta(path).get("format") == "compressed":
+        from capture_compressed import CompressedCapture
+        return CompressedCapture(path)
+    return Capture(path)
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Post-processing of capture files without loading them into memory:
+# the selected range is cut into chunks, each chunk is summarized in a worker
+# process and the partial summaries are merged in order.
+#
+#   python capture_analytics.py capture.bin --start 60 --stop 3660 --threshold 100
+
+import sys
+import json
+import argparse
+import functools
+import concurrent.futures
+import numpy as np
+
+from capture import open_capture
+from protocol import current_full_scale
+
+CHUNK_SAMPLES = 1 << 22    # Samples per worker task (16 MiB per channel)
+HISTOGRAM_BINS = 256
+
+class Summary:
+    # Partial result over the samples [start, stop). All accumulators are
+    # exact integers so merging adjacent summaries is associative.
+    def __init__(self, start, stop, bins):
+        self.start = start
+        self.stop = stop
+        self.count = 0
+        self.current_sum = 0
+        self.current_min = None
+        self.current_max = None
+        self.voltage_sum = 0
+        self.voltage_min = None
+        self.voltage_max = None
+        self.power_sum = 0      # sum(voltage * current) [V*mA]
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.events = []        # [start, stop, peak] runs with current >= threshold
+
+    def merge(self, other):
+        # self must end where other starts
+        if other.count == 0:
+            self.stop = max(self.stop, other.stop)
+            return self
+        if self.count == 0:
+            other.start = min(self.start, other.start)
+            return other
+
+        def pick(a, b, fn):
+            return b if a is None else fn(a, b)
+
+        merged = Summary(self.start, other.stop, len(self.histogram))
+        merged.count = self.count + other.count
+        merged.current_sum = self.current_sum + other.current_sum
+        merged.current_min = pick(self.current_min, other.current_min, min)
+        merged.current_max = pick(self.current_max, other.current_max, max)
+        merged.voltage_sum = self.voltage_sum + other.voltage_sum
+        merged.voltage_min = pick(self.voltage_min, other.voltage_min, min)
+        merged.voltage_max = pick(self.voltage_max, other.voltage_max, max)
+        merged.power_sum = self.power_sum + other.power_sum
+        merged.histogram = self.histogram + other.histogram
+
+        # Stitch an event that crosses the chunk boundary
+        left, right = list(self.events), list(other.events)
+        if left and right and left[-1][1] == self.stop and right[0][0] == other.start:
+            first = right.pop(0)
+            last = left.pop()
+            left.append([last[0], first[1], max(last[2], first[2])])
+        merged.events = left + right
+        return merged
+
+    def to_dict(self, sample_period, edges):
+        duration = self.count * sample_period
+        result = {
+            "start_time": self.start * sample_period,
+            "stop_time": self.stop * sample_period,
+            "samples": self.count,
+            "duration": duration,
+            "current_mean": None,
+            "current_min": self.current_min,
+            "current_max": self.current_max,
+            "voltage_mean": None,
+            "voltage_min": self.voltage_min,
+            "voltage_max": self.voltage_max,
+            # mA*s -> C, V*mA*s -> J
+            "charge": self.current_sum * sample_period / 1000,
+            "energy": self.power_sum * sample_period / 1000,
+            "events": [
+                {"start_time": start * sample_period, "stop_time": stop * sample_period, "peak": peak}
+                for start, stop, peak in self.events
+            ],
+            "histogram": {"edges": edges.tolist(), "counts": self.histogram.tolist()}
+        }
+        if self.count:
+            result["current_mean"] = self.current_sum / self.count
+            result["voltage_mean"] = self.voltage_sum / self.count
+        return result
+
+def summarize(voltage, current, start, edges, threshold=None):
+    summary = Summary(start, start + len(current), len(edges) - 1)
+    if len(current) == 0:
+        return summary
+
+    current = current.astype(np.int64)
+    voltage = voltage.astype(np.int64)
+    summary.count = len(current)
+    summary.current_sum = int(current.sum())
+    summary.current_min = int(current.min())
+    summary.current_max = int(current.max())
+    summary.voltage_sum = int(voltage.sum())
+    summary.voltage_min = int(voltage.min())
+    summary.voltage_max = int(voltage.max())
+    summary.power_sum = int(np.dot(voltage, current))
+    summary.histogram = np.histogram(current, bins=edges)[0].astype(np.int64)
+
+    if threshold is not None:
+        above = current >= threshold
+        if above.any():
+            step = np.diff(above.astype(np.int8))
+            starts = np.flatnonzero(step == 1) + 1
+            stops = np.flatnonzero(step == -1) + 1
+            if above[0]:
+                starts = np.concatenate(([0], starts))
+            if above[-1]:
+                stops = np.concatenate((stops, [len(current)]))
+            # Samples between an event and the next start are below threshold,
+            # so the max from each start is the event peak
+            peaks = np.maximum.reduceat(current, starts)
+            summary.events = [[int(a) + start, int(b) + start, int(p)] for a, b, p in zip(starts, stops, peaks)]
+    return summary
+
+# Captures opened by this worker process, memory mapped once
+_captures = {}
+
+def _summarize_chunk(task):
+    path, start, stop, edges, threshold = task
+    if path not in _captures:
+        _captures[path] = open_capture(path)
+    voltage, current = _captures[path].read(start, stop)
+    return summarize(voltage, current, start, edges, threshold)
+
+def histogram_edges(meta, bins=HISTOGRAM_BINS, lo=None, hi=None):
+    full_scale = current_full_scale.get(meta.get("adc_range"), current_full_scale["RANGE_0"])
+    lo = -full_scale if lo is None else lo
+    hi = full_scale if hi is None else hi
+    return np.linspace(lo, hi, bins + 1)
+
+def analyze(path, t_start=None, t_stop=None, threshold=None, edges=None,
+            chunk_samples=CHUNK_SAMPLES, workers=None):
+    capture = open_capture(path)
+    start = capture.time_to_sample(t_start) or 0
+    stop = capture.time_to_sample(t_stop)
+    if stop is None:
+        stop = capture.num_samples
+    if edges is None:
+        edges = histogram_edges(capture.meta)
+
+    tasks = [(path, s, min(s + chunk_samples, stop), edges, threshold)
+             for s in range(start, stop, chunk_samples)]
+    if not tasks:
+        return Summary(start, start, len(edges) - 1).to_dict(capture.sample_period, edges)
+
+    if workers == 1 or len(tasks) == 1:
+        partials = map(_summarize_chunk, tasks)
+        summary = functools.reduce(Summary.merge, partials)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() yields in submission order, so neighbours merge correctly
+            partials = executor.map(_summarize_chunk, tasks)
+            summary = functools.reduce(Summary.merge, partials)
+    return summary.to_dict(capture.sample_period, edges)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a power monitor capture file")
+    parser.add_argument("capture", help="capture file (with its .json sidecar)")
+    parser.add_argument("--start", type=float, default=None, help="range start [s]")
+    parser.add_argument("--stop", type=float, default=None, help="range stop [s]")
+    parser.add_argument("--threshold", type=float, default=None, help="event threshold [mA]")
+    parser.add_argument("--bins", type=int, default=HISTOGRAM_BINS, help="histogram bins")
+    parser.add_argument("--hist-min", type=float, default=None, help="histogram low edge [mA]")
+    parser.add_argument("--hist-max", type=float, default=None, help="histogram high edge [mA]")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SAMPLES, help="samples per task")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    meta = open_capture(args.capture).meta
+    edges = histogram_edges(meta, args.bins, args.hist_min, args.hist_max)
+    result = analyze(args.capture, args.start, args.stop, args.threshold, edges,
+                     args.chunk, args.workers)
+    json.dump(result, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
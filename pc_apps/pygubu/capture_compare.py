@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Comparison of two captures of the same scenario (e.g. firmware A vs B):
+# B is time aligned on A by cross-correlating the current, then the
+# difference trace and the delta of the statistics over the common part are
+# computed.
+#
+#   python capture_compare.py a.bin b.bin --threshold 100
+#
+# The alignment goes coarse to fine on the overview pyramids
+# (capture_overview.py): a full FFT cross-correlation of the coarsest level
+# means (<= TOP_BINS bins), then at each finer level only WINDOW_BINS bins
+# around the most active part, searching a few bins around the previous
+# estimate, and last the raw samples of one window. The cost doesn't grow
+# with the capture length beyond reading the pyramid levels.
+#
+# offset: sample of A = sample of B + offset
+
+import sys
+import json
+import argparse
+import numpy as np
+
+from capture import open_capture
+from capture_overview import load_overview, LEVEL_FACTOR, TOP_BINS
+
+WINDOW_BINS = 4096         # Bins correlated per refinement level
+SEARCH_BINS = 2 * LEVEL_FACTOR  # Lags searched around the coarser estimate
+RAW_WINDOW = 1 << 16       # Samples correlated for the sample accurate offset
+MIN_OVERLAP = 0.25         # Coarse lags overlap at least this part of the shorter capture
+
+def correlate(a, b, lo, hi, min_overlap=1):
+    # Offset k in [lo, hi] maximizing the normalized correlation of
+    # a[i + k] and b[i], returns (k, score in [-1, 1])
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    a = a - a.mean()
+    b = b - b.mean()
+    n = 1 << int(len(a) + len(b) - 1).bit_length()
+    c = np.fft.irfft(np.fft.rfft(a, n) * np.conj(np.fft.rfft(b, n)), n)
+    lags = np.arange(lo, hi + 1)
+    overlap = np.minimum(len(b), len(a) - lags) - np.maximum(0, -lags)
+    valid = overlap >= max(min_overlap, 1)
+    if not valid.any():
+        return 0, 0.0
+    lags, overlap = lags[valid], overlap[valid]
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b)) or 1.0
+    score = c[lags % n] / norm * (min(len(a), len(b)) / overlap)
+    best = int(np.argmax(score))
+    return int(lags[best]), float(min(score[best], 1.0))
+
+def level_means(overview, k):
+    # Current mean of every bin of level k (stored units)
+    _, _, sums = overview.level("current", k)
+    size = overview.bin_size(k)
+    counts = np.minimum(size, overview.num_samples - np.arange(len(sums)) * size)
+    return sums / np.maximum(counts, 1)
+
+def resampled_means(overview, edges):
+    # Current mean between consecutive sample positions, from the finest
+    # level prefix sums (linear inside a bin), for bins that don't fall on
+    # the pyramid grid
+    _, _, sums = overview.level("current", 0)
+    positions = np.minimum(np.arange(len(sums) + 1) * overview.bin_size(0), overview.num_samples)
+    cumulative = np.concatenate(([0.0], np.cumsum(sums, dtype=np.float64)))
+    return np.diff(np.interp(edges, positions, cumulative)) / np.maximum(np.diff(edges), 1)
+
+def active_window(overview, k, start, stop, bins):
+    # [first, last) bins of level k inside [start, stop) samples, the
+    # `bins` long window with the widest current swing
+    size = overview.bin_size(k)
+    first, last = -(-start // size), stop // size
+    if last - first <= bins:
+        return first, max(last, first)
+    mins, maxs, _ = overview.level("current", k)
+    swing = np.concatenate(([0], np.cumsum(maxs[first:last].astype(np.float64) - mins[first:last])))
+    best = int(np.argmax(swing[bins:] - swing[:-bins]))
+    return first + best, first + best + bins
+
+def align(path_a, path_b, overview_a=None, overview_b=None):
+    # Returns {"offset": samples, "offset_s", "score"}
+    if overview_a is None:
+        overview_a = load_overview(path_a)
+    if overview_b is None:
+        overview_b = load_overview(path_b)
+    if overview_a.bin_size(0) != overview_b.bin_size(0):
+        raise ValueError("The overview caches don't have the same bin size")
+    capture_a, capture_b = open_capture(path_a), open_capture(path_b)
+    if capture_a.sample_period != capture_b.sample_period:
+        raise ValueError("The captures don't have the same sample period")
+    n_a, n_b = overview_a.num_samples, overview_b.num_samples
+
+    # Coarsest common level, every offset
+    top = min(overview_a.levels, overview_b.levels) - 1
+    while top > 0 and max(n_a, n_b) / overview_a.bin_size(top) < 8:
+        top -= 1
+    a, b = level_means(overview_a, top), level_means(overview_b, top)
+    lag, score = correlate(a, b, -(len(b) - 1), len(a) - 1, int(MIN_OVERLAP * min(len(a), len(b))))
+    offset = lag * overview_a.bin_size(top)
+
+    # Finer levels, a window of A against B around the estimate
+    for k in range(top - 1, -1, -1):
+        size = overview_a.bin_size(k)
+        start, stop = max(offset, 0), min(n_a, n_b + offset)
+        if stop - start < 2 * size:
+            break
+        first, last = active_window(overview_a, k, start, stop, WINDOW_BINS)
+        margin = SEARCH_BINS
+        b_first = max(first - offset // size - margin, 0)
+        b_last = min(last - offset // size + margin, -(-n_b // size))
+        a_bins = level_means(overview_a, k)[first:last]
+        b_bins = level_means(overview_b, k)[b_first:b_last]
+        base = offset // size - (first - b_first)
+        lag, score = correlate(a_bins, b_bins, base - margin, base + margin, len(a_bins) // 2)
+        offset = (lag + first - b_first) * size
+
+    # Sample accurate, on raw samples
+    start, stop = max(offset, 0), min(n_a, n_b + offset)
+    if stop > start:
+        size = overview_a.bin_size(0)
+        first, last = active_window(overview_a, 0, start, stop, max(RAW_WINDOW // size, 1))
+        a_start, a_stop = first * size, min(last * size, stop)
+        margin = 2 * size
+        b_start = max(a_start - offset - margin, 0)
+        b_stop = min(a_stop - offset + margin, n_b)
+        a_raw = capture_a.read(a_start, a_stop)[1]
+        b_raw = capture_b.read(b_start, b_stop)[1]
+        base = offset - (a_start - b_start)
+        if len(a_raw) > 1 and len(b_raw) > 1:
+            lag, score = correlate(a_raw, b_raw, base - margin, base + margin, len(a_raw) // 2)
+            offset = lag + a_start - b_start
+    return {"offset": int(offset), "offset_s": offset * capture_a.sample_period, "score": score}
+
+def common_range(n_a, n_b, offset):
+    # [start, stop) samples of A overlapped by B
+    return max(offset, 0), max(min(n_a, n_b + offset), max(offset, 0))
+
+def difference(capture_a, capture_b, overview_a, overview_b, offset, start, stop, max_bins=TOP_BINS):
+    # (x in A samples, B - A current) over [start, stop) of A: raw samples
+    # when they fit in max_bins, else max_bins means on the same sample grid
+    lo, hi = common_range(overview_a.num_samples, overview_b.num_samples, offset)
+    start, stop = min(max(int(start), lo), hi), min(max(int(stop), lo), hi)
+    scale_a = float(capture_a.meta.get("scale", {}).get("current", 1.0))
+    scale_b = float(capture_b.meta.get("scale", {}).get("current", 1.0))
+    if stop - start <= max_bins:
+        a = capture_a.read(start, stop)[1]
+        b = capture_b.read(start - offset, stop - offset)[1]
+        return np.arange(start, stop), b * scale_b - a.astype(np.float64) * scale_a
+
+    edges = np.linspace(start, stop, max_bins + 1)
+    return edges[:-1], (resampled_means(overview_b, edges - offset) * scale_b -
+                        resampled_means(overview_a, edges) * scale_a)
+
+def compare(path_a, path_b, threshold=None, workers=None, overview_a=None, overview_b=None, offset=None):
+    # Overviews and offset already at hand (the GUI) are used as they are
+    from capture_analytics import analyze
+    if overview_a is None:
+        overview_a = load_overview(path_a)
+    if overview_b is None:
+        overview_b = load_overview(path_b)
+    period = open_capture(path_a).sample_period
+    if offset is None:
+        alignment = align(path_a, path_b, overview_a, overview_b)
+    else:
+        alignment = {"offset": int(offset), "offset_s": offset * period}
+    offset = alignment["offset"]
+    start, stop = common_range(overview_a.num_samples, overview_b.num_samples, offset)
+
+    # Statistics over the common part only
+    summaries = {}
+    for name, path, shift in (("a", path_a, 0), ("b", path_b, offset)):
+        summary = analyze(path, (start - shift) * period, (stop - shift) * period, threshold,
+                          workers=workers)
+        summaries[name] = {"charge": summary["charge"], "energy": summary["energy"],
+                           "current_mean": summary["current_mean"], "current_max": summary["current_max"],
+                           "current_min": summary["current_min"], "events": len(summary["events"])}
+    delta = {key: (None if summaries["a"][key] is None or summaries["b"][key] is None
+                   else summaries["b"][key] - summaries["a"][key]) for key in summaries["a"]}
+    return dict(alignment, common_start_s=start * period, common_duration_s=(stop - start) * period,
+                a=summaries["a"], b=summaries["b"], delta=delta)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Align two captures and compare them")
+    parser.add_argument("capture_a", help="reference capture")
+    parser.add_argument("capture_b", help="capture compared to the reference")
+    parser.add_argument("--threshold", type=float, default=None, help="event threshold [mA]")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    json.dump(compare(args.capture_a, args.capture_b, args.threshold, args.workers), sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Compressed capture file. Reports are grouped in fixed size chunks, each
+# channel is delta encoded (voltage/current change slowly between samples)
+# and the chunk is compressed with zlib or lzma. A chunk index at the end of
+# the file lets a time range be decoded without touching the other chunks.
+#
+#   [chunk header][payload] ... [chunk header][payload][index][footer]
+#
+#   chunk header: magic "PMZC", payload length, number of reports
+#   payload     : compressed(delta(id) + delta(voltage) + delta(current))
+#   footer      : index offset, number of chunks, magic "PMZI"
+#
+#   python capture_compressed.py compress capture.bin capture.pmz --codec lzma
+#   python capture_compressed.py decompress capture.pmz capture.bin
+
+import os
+import sys
+import time
+import lzma
+import zlib
+import struct
+import argparse
+import concurrent.futures
+import numpy as np
+
+from capture import read_meta, write_meta, add_gap, open_capture, CaptureWriter
+from protocol import SIGNATURE, report_dtype
+
+CHUNK_MAGIC = b"PMZC"
+INDEX_MAGIC = b"PMZI"
+CHUNK_HEADER = struct.Struct("<4sII")
+FOOTER = struct.Struct("<QI4s")
+CHUNK_REPORTS = 1024        # 64512 samples per chunk with 63 samples per report
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),          # File offset of the chunk header
+    ("length", "<u4"),          # Compressed payload length
+    ("first_sample", "<u8"),
+    ("num_samples", "<u4"),
+    ("first_id", "<u4"),
+    ("last_id", "<u4"),
+    ("timestamp", "<f8"),       # Host time when the first report was written
+    ("current_min", "<i4"),
+    ("current_max", "<i4"),
+    ("current_sum", "<i8"),
+    ("voltage_min", "<i4"),
+    ("voltage_max", "<i4"),
+    ("voltage_sum", "<i8")
+])
+
+codecs = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress)
+}
+
+def _delta(values):
+    # int32 arithmetic wraps, cumsum in int32 restores the values exactly
+    values = values.astype(np.int32).reshape(-1)
+    out = np.empty_like(values)
+    if len(values):
+        out[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=out[1:])
+    return out
+
+def _undelta(deltas):
+    return np.cumsum(deltas, dtype=np.int32)
+
+def encode_chunk(records, codec):
+    payload = b"".join([
+        _delta(records["id"]).tobytes(),
+        _delta(records["voltage"]).tobytes(),
+        _delta(records["current"]).tobytes()
+    ])
+    return codecs[codec][0](payload)
+
+def decode_chunk(payload, num_reports, sample_size, codec):
+    # Return (ids, voltage, current), the channels flattened in sample order
+    data = np.frombuffer(codecs[codec][1](payload), dtype="<i4")
+    num_samples = num_reports * sample_size
+    ids = _undelta(data[:num_reports]).view(np.uint32)
+    voltage = _undelta(data[num_reports:num_reports + num_samples])
+    current = _undelta(data[num_reports + num_samples:])
+    return ids, voltage, current
+
+class CompressedCaptureWriter:
+    def __init__(self, path, meta, codec="zlib", chunk_reports=CHUNK_REPORTS):
+        meta = dict(meta, format="compressed", codec=codec, chunk_reports=chunk_reports)
+        self.path = path
+        self.meta = meta
+        self.codec = codec
+        self.chunk_reports = chunk_reports
+        self.dtype = report_dtype(meta["sample_size"])
+        self.pending = bytearray()
+        self.pending_time = None
+        self.index = []
+        self.num_samples = 0
+        write_meta(path, meta)
+        self.file = open(path, "wb")
+
+    def write(self, report):
+        if not self.pending:
+            self.pending_time = time.time()
+        self.pending += report
+        chunk_size = self.chunk_reports * self.dtype.itemsize
+        while len(self.pending) >= chunk_size:
+            self.flush_chunk(bytes(self.pending[:chunk_size]))
+            del self.pending[:chunk_size]
+            self.pending_time = time.time()
+
+    def flush_chunk(self, data):
+        records = np.frombuffer(data, dtype=self.dtype)
+        payload = encode_chunk(records, self.codec)
+        offset = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(payload), len(records)))
+        self.file.write(payload)
+        self.index.append(chunk_entry(offset, len(payload), self.num_samples,
+                                      records["id"], records["voltage"], records["current"],
+                                      self.pending_time))
+        self.num_samples += records["current"].size
+
+    def mark_gap(self, start_time, duration):
+        # The samples written next follow a link interruption
+        sample = self.num_samples + len(self.pending) // self.dtype.itemsize * self.meta["sample_size"]
+        add_gap(self.path, self.meta, sample, start_time, duration)
+
+    def close(self):
+        if self.file.closed:
+            return
+        # Only whole reports are stored
+        whole = len(self.pending) - len(self.pending) % self.dtype.itemsize
+        if whole:
+            self.flush_chunk(bytes(self.pending[:whole]))
+        self.pending.clear()
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(FOOTER.pack(offset, len(index), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def chunk_entry(offset, length, first_sample, ids, voltage, current, timestamp):
+    return (offset, length, first_sample, current.size, ids[0], ids[-1], timestamp,
+            current.min(), current.max(), current.sum(dtype=np.int64),
+            voltage.min(), voltage.max(), voltage.sum(dtype=np.int64))
+
+def read_index(file, sample_size, codec):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    if size >= FOOTER.size:
+        file.seek(size - FOOTER.size)
+        offset, count, magic = FOOTER.unpack(file.read(FOOTER.size))
+        if magic == INDEX_MAGIC:
+            file.seek(offset)
+            return np.frombuffer(file.read(count * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+
+    # No footer (the writer did not close), rebuild the index from the chunk headers
+    entries = []
+    first_sample = 0
+    offset = 0
+    while offset + CHUNK_HEADER.size <= size:
+        file.seek(offset)
+        magic, length, num_reports = CHUNK_HEADER.unpack(file.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + length > size:
+            break
+        ids, voltage, current = decode_chunk(file.read(length), num_reports, sample_size, codec)
+        entries.append(chunk_entry(offset, length, first_sample, ids, voltage, current, 0.0))
+        first_sample += current.size
+        offset += CHUNK_HEADER.size + length
+    return np.array(entries, dtype=INDEX_DTYPE)
+
+class CompressedCapture:
+    def __init__(self, path, workers=None):
+        self.path = path
+        self.meta = read_meta(path)
+        self.sample_size = self.meta["sample_size"]
+        self.sample_period = self.meta["sample_period"]
+        self.codec = self.meta["codec"]
+        self.workers = workers
+        with open(path, "rb") as file:
+            self.index = read_index(file, self.sample_size, self.codec)
+        self.num_samples = int(self.index["num_samples"].sum())
+        self.num_reports = self.num_samples // self.sample_size
+
+    def time_to_sample(self, t):
+        if t is None:
+            return None
+        return min(max(int(t / self.sample_period), 0), self.num_samples)
+
+    def chunk_range(self, start, stop):
+        first = max(np.searchsorted(self.index["first_sample"], start, side="right") - 1, 0)
+        last = np.searchsorted(self.index["first_sample"], stop, side="left")
+        return first, last
+
+    def decode(self, chunks):
+        # Each chunk is decoded independently, zlib/lzma release the GIL
+        def load(i):
+            entry = self.index[i]
+            with open(self.path, "rb") as file:
+                file.seek(int(entry["offset"]) + CHUNK_HEADER.size)
+                payload = file.read(int(entry["length"]))
+            return decode_chunk(payload, int(entry["num_samples"]) // self.sample_size,
+                                self.sample_size, self.codec)
+
+        if len(chunks) > 1 and self.workers != 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                return list(executor.map(load, chunks))
+        return [load(i) for i in chunks]
+
+    def read(self, start=0, stop=None):
+        # Return (voltage, current) int32 arrays for samples [start, stop)
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        start = min(max(start, 0), stop)
+        if start == stop:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        first, last = self.chunk_range(start, stop)
+        decoded = self.decode(range(first, last))
+        offset = start - int(self.index["first_sample"][first])
+        voltage = np.concatenate([v for _, v, _ in decoded])[offset:offset + stop - start]
+        current = np.concatenate([c for _, _, c in decoded])[offset:offset + stop - start]
+        return voltage, current
+
+    def package_ids(self, start=0, stop=None):
+        # Report ids covering samples [start, stop)
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        if start >= stop:
+            return np.zeros(0, dtype=np.uint32)
+        first, last = self.chunk_range(start, stop)
+        ids = np.concatenate([i for i, _, _ in self.decode(range(first, last))])
+        base = int(self.index["first_sample"][first]) // self.sample_size
+        return ids[start // self.sample_size - base:-(-stop // self.sample_size) - base]
+
+def compress(src, dst, codec="zlib", chunk_reports=CHUNK_REPORTS):
+    # src raw or compressed (e.g. to change the codec), read through the
+    # common read() / package_ids() so both layouts work
+    capture = open_capture(src)
+    meta = dict(capture.meta)
+    size = capture.sample_size
+    dtype = report_dtype(size)
+    with CompressedCaptureWriter(dst, meta, codec, chunk_reports) as writer:
+        for first in range(0, capture.num_samples // size, chunk_reports):
+            start, stop = first * size, min((first + chunk_reports) * size, capture.num_samples)
+            voltage, current = capture.read(start, stop)
+            block = np.zeros((stop - start) // size, dtype=dtype)
+            block["sign"] = SIGNATURE
+            block["id"] = capture.package_ids(start, stop)
+            block["voltage"] = voltage.reshape(len(block), size)
+            block["current"] = current.reshape(len(block), size)
+            writer.pending_time = meta["start_time"] + start * capture.sample_period
+            writer.flush_chunk(block.tobytes())
+
+def decompress(src, dst):
+    capture = CompressedCapture(src)
+    meta = dict(capture.meta, format="raw")
+    for key in ("codec", "chunk_reports"):
+        meta.pop(key, None)
+    dtype = report_dtype(capture.sample_size)
+    with CaptureWriter(dst, meta) as writer:
+        for i in range(len(capture.index)):
+            ids, voltage, current = capture.decode([i])[0]
+            records = np.zeros(len(ids), dtype=dtype)
+            records["sign"] = SIGNATURE
+            records["id"] = ids
+            records["voltage"] = voltage.reshape(len(ids), -1)
+            records["current"] = current.reshape(len(ids), -1)
+            writer.write(records.tobytes())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert power monitor capture files")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("compress", help="raw capture -> compressed capture")
+    p.add_argument("src")
+    p.add_argument("dst")
+    p.add_argument("--codec", choices=sorted(codecs), default="zlib")
+    p.add_argument("--chunk-reports", type=int, default=CHUNK_REPORTS)
+    p = sub.add_parser("decompress", help="compressed capture -> raw capture")
+    p.add_argument("src")
+    p.add_argument("dst")
+    args = parser.parse_args(argv)
+
+    if args.command == "compress":
+        compress(args.src, args.dst, args.codec, args.chunk_reports)
+        ratio = os.path.getsize(args.src) / max(os.path.getsize(args.dst), 1)
+        sys.stdout.write(f"{args.dst}: {ratio:.1f}x\n")
+    else:
+        decompress(args.src, args.dst)
+
+if __name__ == "__main__":
+    main()
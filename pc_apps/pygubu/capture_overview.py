@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Sidecar overview cache "<capture>.overview.npz": a min/max/sum pyramid of
+# both channels, the prefix sums of voltage x current over the finest bins
+# (segment energies) plus the capture summary (events, histogram), built once
+# with the capture_analytics process pool. The cache is rebuilt when the
+# capture size or digest changes, so reopening a capture only loads the
+# levels that are actually displayed.
+#
+#   python capture_overview.py capture.bin --threshold 100
+
+import os
+import json
+import hashlib
+import argparse
+import functools
+import concurrent.futures
+import numpy as np
+
+from capture import open_capture
+from capture_analytics import CHUNK_SAMPLES, Summary, summarize, histogram_edges
+
+OVERVIEW_SUFFIX = ".overview.npz"
+OVERVIEW_VERSION = 2
+BASE_BIN = 1024            # Samples per bin of the finest level
+LEVEL_FACTOR = 8           # Bins merged per level
+TOP_BINS = 2048            # The coarsest level has at most this many bins
+DIGEST_BLOCK = 1 << 20     # Bytes hashed at the head and the tail of the capture
+CHANNELS = ("voltage", "current")
+
+def capture_digest(path):
+    # Hashing a 20 GB capture is not instant, the size plus the head and tail
+    # blocks catch a capture that was rewritten or is still growing
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as file:
+        digest.update(file.read(DIGEST_BLOCK))
+        if size > DIGEST_BLOCK:
+            file.seek(max(size - DIGEST_BLOCK, DIGEST_BLOCK))
+            digest.update(file.read(DIGEST_BLOCK))
+    return digest.hexdigest()
+
+def bin_stats(values, bin_size):
+    starts = np.arange(0, len(values), bin_size)
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty.astype(np.int32), empty.astype(np.int32), empty
+    return (np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            np.add.reduceat(values.astype(np.int64), starts))
+
+def _overview_chunk(task):
+    path, start, stop, edges, threshold = task
+    voltage, current = open_capture(path).read(start, stop)
+    bins = {}
+    for name, values in zip(CHANNELS, (voltage, current)):
+        bins[name] = bin_stats(values, BASE_BIN)
+    power = np.multiply(voltage, current, dtype=np.float64)
+    bins["power"] = np.add.reduceat(power, np.arange(0, len(power), BASE_BIN)) if len(power) else power
+    return summarize(voltage, current, start, edges, threshold), bins
+
+def build_overview(path, threshold=None, workers=None):
+    capture = open_capture(path)
+    edges = histogram_edges(capture.meta)
+    # Chunks are a multiple of BASE_BIN, so the finest level is simply concatenated
+    tasks = [(path, s, min(s + CHUNK_SAMPLES, capture.num_samples), edges, threshold)
+             for s in range(0, capture.num_samples, CHUNK_SAMPLES)]
+
+    if workers == 1 or len(tasks) <= 1:
+        results = [_overview_chunk(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_overview_chunk, tasks))
+
+    summaries = [summary for summary, _ in results]
+    summary = functools.reduce(Summary.merge, summaries, Summary(0, 0, len(edges) - 1))
+
+    arrays = {}
+    for name in CHANNELS:
+        parts = [bins[name] for _, bins in results]
+        level = [np.concatenate([p[i] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+                 for i in range(3)]
+        k = 0
+        while True:
+            arrays[f"{name}_min_{k}"], arrays[f"{name}_max_{k}"], arrays[f"{name}_sum_{k}"] = level
+            if len(level[0]) <= TOP_BINS:
+                break
+            starts = np.arange(0, len(level[0]), LEVEL_FACTOR)
+            level = [np.minimum.reduceat(level[0], starts),
+                     np.maximum.reduceat(level[1], starts),
+                     np.add.reduceat(level[2], starts)]
+            k += 1
+    power = np.concatenate([bins["power"] for _, bins in results] or [np.zeros(0)])
+    arrays["power_prefix"] = np.concatenate(([0], np.cumsum(power)))
+
+    info = {
+        "version": OVERVIEW_VERSION,
+        "digest": capture_digest(path),
+        "threshold": threshold,
+        "num_samples": capture.num_samples,
+        "base_bin": BASE_BIN,
+        "factor": LEVEL_FACTOR,
+        "levels": k + 1,
+        "summary": summary.to_dict(capture.sample_period, edges)
+    }
+    # Write to a temporary file first, a half written cache must never look valid
+    tmp_path = str(path) + OVERVIEW_SUFFIX + ".tmp"
+    with open(tmp_path, "wb") as file:
+        np.savez(file, info=np.array(json.dumps(info)), **arrays)
+    os.replace(tmp_path, str(path) + OVERVIEW_SUFFIX)
+    return Overview(path)
+
+class Overview:
+    def __init__(self, path):
+        self.path = path
+        # np.load on a .npz is lazy, only the levels that are used get read
+        self.data = np.load(str(path) + OVERVIEW_SUFFIX)
+        self.info = json.loads(str(self.data["info"]))
+        self.num_samples = self.info["num_samples"]
+        self.levels = self.info["levels"]
+        self.summary = self.info["summary"]
+        self.cache = {}
+
+    def bin_size(self, k):
+        return self.info["base_bin"] * self.info["factor"] ** k
+
+    def level(self, name, k):
+        key = (name, k)
+        if key not in self.cache:
+            self.cache[key] = (self.data[f"{name}_min_{k}"],
+                               self.data[f"{name}_max_{k}"],
+                               self.data[f"{name}_sum_{k}"])
+        return self.cache[key]
+
+    def power_prefix(self):
+        # voltage x current sums of the finest bins 0 .. j - 1, in stored units
+        if "power_prefix" not in self.cache:
+            self.cache["power_prefix"] = self.data["power_prefix"]
+        return self.cache["power_prefix"]
+
+    def choose_level(self, start, stop, max_bins):
+        # Finest level that still fits in max_bins for the range
+        for k in range(self.levels):
+            if (stop - start) / self.bin_size(k) <= max_bins:
+                return k
+        return self.levels - 1
+
+    def window(self, name, start=0, stop=None, max_bins=TOP_BINS):
+        # Return (x, min, max, mean) for the bins covering [start, stop),
+        # x is the first sample index of each bin
+        if stop is None or stop > self.num_samples:
+            stop = self.num_samples
+        start = min(max(int(start), 0), stop)
+        k = self.choose_level(start, stop, max_bins)
+        size = self.bin_size(k)
+        first, last = start // size, -(-int(stop) // size)
+        mins, maxs, sums = (a[first:last] for a in self.level(name, k))
+        x = np.arange(first, first + len(mins)) * size
+        counts = np.minimum(size, self.num_samples - x)
+        return x, mins, maxs, sums / np.maximum(counts, 1)
+
+    def close(self):
+        self.data.close()
+
+def load_overview(path, threshold=None, workers=None):
+    # Return the cached overview, building it when missing or stale
+    try:
+        overview = Overview(path)
+        info = overview.info
+        if (info["version"] == OVERVIEW_VERSION and info["threshold"] == threshold
+                and info["digest"] == capture_digest(path)):
+            return overview
+        overview.close()
+    except (OSError, KeyError, ValueError):
+        pass
+    return build_overview(path, threshold, workers)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the overview cache of a capture file")
+    parser.add_argument("capture", help="capture file (with its .json sidecar)")
+    parser.add_argument("--threshold", type=float, default=None, help="event threshold [mA]")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the cache is valid")
+    args = parser.parse_args(argv)
+
+    if args.force:
+        overview = build_overview(args.capture, args.threshold, args.workers)
+    else:
+        overview = load_overview(args.capture, args.threshold, args.workers)
+    print(f"{args.capture}{OVERVIEW_SUFFIX}: {overview.levels} levels, "
+          f"{len(overview.summary['events'])} events")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Headless access to the power monitor, no Tk needed:
+#
+#   from device import Device
+#
+#   with Device.open("COM13", "COM14") as dev:
+#       dev.configure("280uS", "AVG_NUM_1", "RANGE_0")
+#       dev.set_report_size(1023)     # optional, fewer and larger reports
+#       dev.set_vbat(3350)
+#       dev.enable_vbat(True)
+#       with dev.capture(duration=2.0) as acq:
+#           voltage, current = acq.read()
+#
+#       # or streaming batches
+#       with dev.capture(duration=60.0) as acq:
+#           for batch in acq:
+#               print(batch["id"][-1], batch["current"].mean())
+#
+#       # packed raw codes, scaled on the host (float voltage [V], current [mA])
+#       with dev.capture(duration=2.0, stream_mode=protocol.STREAM_MODE_PACKED) as acq:
+#           voltage, current = acq.read()
+#
+#       # extra channels, {name: array} in protocol.channels units
+#       dev.set_channels("current,dietemp")
+#       with dev.capture(duration=2.0, stream_mode=protocol.STREAM_MODE_CHANNELS) as acq:
+#           data = acq.read_channels()
+#
+#   # ports found by USB VID:PID instead of their names
+#   with Device.open(*find_ports()) as dev:
+#       ...
+
+import math
+import queue
+import threading
+import numpy as np
+
+import protocol
+from protocol import (ReportDecoder, RESPONSE_SIZE, STREAM_MODE_SCALED, STREAM_MODE_PACKED,
+                      STREAM_MODE_CHANNELS, DATA_RPT_SAMPLE_SIZE, DEFAULT_CHANNELS,
+                      cmd_write_config, cmd_set_vbat, cmd_vbat_output, cmd_simple,
+                      cmd_start_measure, cmd_report_size, response_report_size, cmd_channels,
+                      response_channels, response_ok, report_size, packed_sample_size,
+                      channel_sample_size, channel_mask, channel_names, channel_arrays,
+                      sample_period)
+
+READ_REPORTS = 16          # Minimum reports per data port read
+USB_VID = 0x0815           # USBD_VID / USBD_PID in cdc_acm_template.c
+USB_PID = 0x2024
+
+class DeviceError(Exception):
+    pass
+
+def parse_usb_id(text):
+    # "0815:2024" -> (0x0815, 0x2024)
+    vid, _, pid = text.partition(":")
+    try:
+        return int(vid, 16), int(pid, 16)
+    except ValueError:
+        raise ValueError(f"Invalid USB VID:PID: {text!r}")
+
+def find_ports(vid=USB_VID, pid=USB_PID, serial_number=None):
+    # (command port, data port) of a plugged in device, None if not found.
+    # The command CDC is interface 0 and the data CDC interface 2, so they
+    # sort in that order by USB location (port names may change on replug).
+    from serial.tools import list_ports
+    ports = [port for port in list_ports.comports()
+             if port.vid == vid and port.pid == pid
+             and (serial_number is None or port.serial_number == serial_number)]
+    if len(ports) < 2:
+        return None
+    ports.sort(key=lambda port: (port.serial_number or "", port.location or "", port.device))
+    return ports[0].device, ports[1].device
+
+class Device:
+    def __init__(self, serial_port_cmd, serial_port_data):
+        self.serial_port_cmd = serial_port_cmd
+        self.serial_port_data = serial_port_data
+        self.config = None
+        self.sample_period = None
+        self.sample_size = DATA_RPT_SAMPLE_SIZE
+        self.channels = DEFAULT_CHANNELS
+        self.acquisition = None
+
+    @classmethod
+    def open(cls, cmd_port, data_port, baudrate=10000000, timeout=1):
+        import serial
+        serial_port_cmd = serial.Serial(cmd_port, baudrate=baudrate, timeout=timeout)
+        try:
+            serial_port_data = serial.Serial(data_port, baudrate=baudrate, timeout=timeout)
+        except Exception:
+            serial_port_cmd.close()
+            raise
+        return cls(serial_port_cmd, serial_port_data)
+
+    def command(self, cmd, check=True):
+        self.serial_port_cmd.write(cmd)
+        response = self.serial_port_cmd.read(RESPONSE_SIZE)
+        if check and not response_ok(cmd, response):
+            raise DeviceError(f"Device response error for command 0x{cmd[0]:02X}: {response!r}")
+        return response
+
+    def configure(self, conv_time="280uS", avg_num="AVG_NUM_1", adc_range="RANGE_0"):
+        # Same sequence as the GUI: write the config params, then configure the INA229
+        self.command(cmd_write_config(conv_time, avg_num, adc_range))
+        self.command(cmd_simple(protocol.CMD_CONFIGURE_INA229))
+        self.config = {"conversion_times": conv_time, "average_num": avg_num, "adc_range": adc_range}
+        self.sample_period = sample_period(conv_time, avg_num)
+        self.read_report_size()
+
+    def read_report_size(self):
+        # Firmware without CMD_SET_REPORT_SIZE always sends the default size
+        response = self.command(cmd_report_size(), check=False)
+        self.sample_size = response_report_size(response) or DATA_RPT_SAMPLE_SIZE
+        return self.sample_size
+
+    def set_report_size(self, sample_size):
+        # Samples per channel in each report, only while not measuring
+        if not protocol.MIN_SAMPLE_SIZE <= sample_size <= protocol.MAX_SAMPLE_SIZE:
+            raise DeviceError(f"Report size must be {protocol.MIN_SAMPLE_SIZE}..{protocol.MAX_SAMPLE_SIZE}")
+        if self.acquisition is not None:
+            raise DeviceError("Can't change the report size during a capture")
+        response = self.command(cmd_report_size(sample_size), check=False)
+        if not response_ok(cmd_report_size(sample_size), response):
+            raise DeviceError(f"Device rejected report size {sample_size}: {response!r}")
+        self.sample_size = response_report_size(response)
+
+    def set_channels(self, channels):
+        # Channels sent in STREAM_MODE_CHANNELS: names ("current,dietemp") or a mask
+        mask = channels if isinstance(channels, int) else channel_mask(channels)
+        if not mask:
+            raise DeviceError("Select at least one channel")
+        if self.acquisition is not None:
+            raise DeviceError("Can't change the channels during a capture")
+        response = self.command(cmd_channels(mask), check=False)
+        if not response_ok(cmd_channels(mask), response):
+            raise DeviceError(f"Device rejected channels {channel_names(mask)}: {response!r}")
+        self.channels = response_channels(response)
+
+    def stream_sample_period(self, stream_mode):
+        # The die temperature adds a conversion to every sample
+        if self.config is None:
+            return None
+        dietemp = stream_mode == STREAM_MODE_CHANNELS and bool(self.channels & protocol.channels["dietemp"][0])
+        return sample_period(self.config["conversion_times"], self.config["average_num"], dietemp)
+
+    def set_vbat(self, code):
+        self.command(cmd_set_vbat(int(code)))
+
+    def enable_vbat(self, enable=True):
+        self.command(cmd_vbat_output(enable))
+
+    def start(self, stream_mode=STREAM_MODE_SCALED):
+        self.command(cmd_start_measure(stream_mode))
+
+    def stop(self):
+        # We don't expect response OK after stop measure command
+        self.command(cmd_simple(protocol.CMD_STOP_MEASURE), check=False)
+
+    def capture(self, duration=None, writer=None, max_batches=0, stream_mode=STREAM_MODE_SCALED):
+        # duration in seconds of device time (None: until the block exits),
+        # writer: optional CaptureWriter receiving the raw reports
+        if self.acquisition is not None:
+            raise DeviceError("A capture is already running")
+        if writer and stream_mode != STREAM_MODE_SCALED:
+            raise DeviceError("Capture files store scaled reports, use STREAM_MODE_SCALED to record")
+        if writer and writer.meta.get("sample_size", DATA_RPT_SAMPLE_SIZE) != self.sample_size:
+            raise DeviceError(f"Capture meta sample_size doesn't match the device ({self.sample_size})")
+        return Acquisition(self, duration, writer, max_batches, stream_mode)
+
+    def close(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+        for port in (self.serial_port_cmd, self.serial_port_data):
+            if port and port.is_open:
+                port.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Acquisition:
+    def __init__(self, device, duration, writer, max_batches, stream_mode=STREAM_MODE_SCALED):
+        self.device = device
+        self.writer = writer
+        self.stream_mode = stream_mode
+        self.decoder = ReportDecoder(device.sample_size, stream_mode, device.channels)
+        if stream_mode == STREAM_MODE_PACKED:
+            self.report_samples = packed_sample_size(device.sample_size)
+        elif stream_mode == STREAM_MODE_CHANNELS:
+            self.report_samples = channel_sample_size(device.sample_size, device.channels)
+        else:
+            self.report_samples = device.sample_size
+        self.read_size = READ_REPORTS * report_size(device.sample_size)
+        # Bounded when max_batches > 0, the reader then blocks instead of growing memory
+        self.batches = queue.Queue(max_batches)
+        self.done = threading.Event()
+        self.is_receiving = False
+        self.thread = None
+        self.error = None
+        self.samples = 0
+        self.lost_reports = 0
+        self.last_id = None
+        self.max_samples = None
+        if duration is not None:
+            period = device.stream_sample_period(stream_mode)
+            if period is None:
+                raise DeviceError("configure() the device before a timed capture")
+            self.max_samples = math.ceil(duration / period)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        port = self.device.serial_port_data
+        port.reset_input_buffer()
+        self.is_receiving = True
+        self.device.acquisition = self
+        self.thread = threading.Thread(target=self.receive_data, daemon=True)
+        self.thread.start()
+        try:
+            self.device.start(self.stream_mode)
+        except Exception:
+            # __exit__ won't run, the reader and the device slot are freed here
+            self.is_receiving = False
+            self.thread.join()
+            self.thread = None
+            self.device.acquisition = None
+            raise
+
+    def stop(self):
+        if not self.is_receiving and self.thread is None:
+            return
+        try:
+            self.device.stop()
+        finally:
+            self.is_receiving = False
+            if self.thread:
+                self.thread.join()
+                self.thread = None
+            self.device.acquisition = None
+
+    def receive_data(self):
+        port = self.device.serial_port_data
+        try:
+            while self.is_receiving:
+                # One large read per wakeup, decoded with a single numpy view
+                data = port.read(max(port.in_waiting, self.read_size))
+                if not data:
+                    continue
+                records = self.decoder.feed(data)
+                if len(records) == 0:
+                    continue
+                ids = records["id"]
+                if self.last_id is not None:
+                    self.lost_reports += max(int(ids[0]) - self.last_id - 1, 0)
+                self.lost_reports += int((np.diff(ids.astype(np.int64)) - 1).clip(0).sum())
+                self.last_id = int(ids[-1])
+                if self.max_samples is not None:
+                    remaining = -(-(self.max_samples - self.samples) // self.report_samples)
+                    records = records[:remaining]
+                if self.writer:
+                    self.writer.write(records.tobytes())
+                self.samples += len(records) * self.report_samples
+                self.put(records)
+                if self.max_samples is not None and self.samples >= self.max_samples:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.is_receiving = False
+            self.done.set()
+
+    def put(self, records):
+        # Don't block forever on a full queue once the capture is stopped
+        while self.is_receiving:
+            try:
+                self.batches.put(records, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __iter__(self):
+        # Streaming batches of report records (fields id, voltage, current),
+        # packed or channel records in the other stream modes (see
+        # protocol.channel_arrays)
+        while True:
+            try:
+                yield self.batches.get(timeout=0.1)
+            except queue.Empty:
+                if self.done.is_set() and self.batches.empty():
+                    break
+        if self.error:
+            raise DeviceError(f"Data port error: {self.error}") from self.error
+
+    def read(self):
+        # Wait for the whole duration and return (voltage, current) int32 arrays,
+        # float64 [V] and [mA] in STREAM_MODE_PACKED
+        data = self.read_channels()
+        if "voltage" not in data or "current" not in data:
+            raise DeviceError("Voltage or current not selected, use read_channels()")
+        return data["voltage"], data["current"]
+
+    def read_channels(self):
+        # Wait for the whole duration and return {channel name: array}
+        if self.max_samples is None:
+            raise DeviceError("read() needs a capture duration, iterate for open ended captures")
+        blocks = list(self)
+        records = np.concatenate(blocks) if blocks else np.zeros(0, dtype=self.decoder.dtype)
+        return {name: values[:self.max_samples] for name, values in channel_arrays(records).items()}
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Capture export for pandas / MATLAB users: time, current and voltage
+# columns over the whole capture or a [start, stop) range, written chunk by
+# chunk so memory stays bounded whatever the capture length.
+#
+#   python export.py capture.bin out.csv --start 60 --stop 120
+#   python export.py capture.bin out.npz        (numpy.load)
+#   python export.py capture.bin out.h5         (needs h5py)
+#   python export.py capture.bin out.parquet    (needs pyarrow)
+#
+# CSV is formatted with NumPy, not per row: every value is turned into fixed
+# point ASCII digits in a (rows x width) byte matrix and the used bytes are
+# kept with one boolean mask. Its units and INA229 configuration go to a
+# "<out>.json" sidecar like the captures; the other formats embed them.
+
+import os
+import sys
+import json
+import zipfile
+import argparse
+import numpy as np
+
+from capture import open_capture, to_float
+
+CHUNK_SAMPLES = 1 << 18    # Samples per exported chunk (~100 MiB peak for CSV)
+TIME_DECIMALS = 6          # CSV time resolution 1 us
+VALUE_DECIMALS = 6         # CSV decimals of channels with a non integer scale
+CHANNELS = ("current", "voltage")
+
+def export_meta(capture, start, stop):
+    # Units and configuration carried along with the exported columns
+    meta = {key: capture.meta[key] for key in ("conversion_times", "average_num", "adc_range",
+                                               "sample_period", "start_time") if key in capture.meta}
+    meta.update({
+        "source": os.path.basename(str(capture.path)),
+        "first_sample": start,
+        "samples": stop - start,
+        "columns": {"time": "s", **{name: capture.meta.get("units", {}).get(name, "") for name in CHANNELS}}
+    })
+    if "gaps" in capture.meta:
+        meta["gaps"] = [dict(gap, sample=gap["sample"] - start) for gap in capture.meta["gaps"]
+                        if start <= gap["sample"] < stop]
+    return meta
+
+def column_names(meta):
+    return [f"{name}_{unit}" if unit else name for name, unit in meta["columns"].items()]
+
+def chunks(capture, start, stop, chunk_samples=CHUNK_SAMPLES):
+    # (time [s], {channel: float64 values in meta units}) per chunk
+    for first in range(start, stop, chunk_samples):
+        last = min(first + chunk_samples, stop)
+        voltage, current = capture.read(first, last)
+        time = np.arange(first - start, last - start) * capture.sample_period
+        yield time, {"current": to_float(capture.meta, "current", current.astype(np.float64)),
+                     "voltage": to_float(capture.meta, "voltage", voltage.astype(np.float64))}
+
+def format_fixed(values, decimals):
+    # (n, width) uint8 ASCII matrix, right aligned, and the used width per row
+    q = np.rint(np.asarray(values, dtype=np.float64) * 10.0 ** decimals).astype(np.int64)
+    negative = q < 0
+    q = np.abs(q)
+    digits = np.maximum(np.floor(np.log10(np.maximum(q, 1))).astype(np.int64) + 1, decimals + 1)
+    width = int(digits.max()) + (decimals > 0) + 1 if len(q) else 1
+    out = np.full((len(q), width), ord(" "), dtype=np.uint8)
+    column = width - 1
+    for i in range(int(digits.max()) if len(q) else 0):
+        if decimals and i == decimals:
+            out[:, column] = ord(".")
+            column -= 1
+        out[:, column] = ord("0") + q % 10
+        q //= 10
+        column -= 1
+    lengths = digits + (decimals > 0) + negative
+    sign_column = width - lengths
+    rows = np.flatnonzero(negative)
+    out[rows, sign_column[rows]] = ord("-")
+    return out, lengths
+
+def csv_block(columns):
+    # columns: [(values, decimals)] -> bytes of the CSV lines
+    fields = [format_fixed(values, decimals) for values, decimals in columns]
+    n = len(fields[0][1])
+    parts, masks = [], []
+    for i, (chars, lengths) in enumerate(fields):
+        width = chars.shape[1]
+        parts.append(chars)
+        masks.append(np.arange(width) >= (width - lengths)[:, None])
+        parts.append(np.full((n, 1), ord(",") if i < len(fields) - 1 else ord("\n"), dtype=np.uint8))
+        masks.append(np.ones((n, 1), dtype=bool))
+    return np.hstack(parts)[np.hstack(masks)].tobytes()
+
+def value_decimals(meta, name):
+    return 0 if float(meta.get("scale", {}).get(name, 1.0)).is_integer() else VALUE_DECIMALS
+
+def export_csv(capture, out_path, start, stop, meta, chunk_samples):
+    decimals = [value_decimals(capture.meta, name) for name in CHANNELS]
+    with open(out_path, "wb") as file:
+        file.write((",".join(column_names(meta)) + "\n").encode())
+        for time, values in chunks(capture, start, stop, chunk_samples):
+            file.write(csv_block([(time, TIME_DECIMALS)] +
+                                 [(values[name], d) for name, d in zip(CHANNELS, decimals)]))
+    with open(str(out_path) + ".json", "w") as file:
+        json.dump(meta, file, indent=4)
+
+def export_npz(capture, out_path, start, stop, meta, chunk_samples):
+    # numpy.savez layout written entry by entry: one pass over the capture
+    # per column, each .npy header written up front with the final shape
+    with zipfile.ZipFile(out_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for column, name in enumerate(["time", *CHANNELS]):
+            with archive.open(column_names(meta)[column] + ".npy", "w", force_zip64=True) as file:
+                np.lib.format.write_array_header_2_0(
+                    file, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                           "fortran_order": False, "shape": (stop - start,)})
+                for time, values in chunks(capture, start, stop, chunk_samples):
+                    file.write((time if name == "time" else values[name]).tobytes())
+        with archive.open("meta.npy", "w") as file:
+            np.lib.format.write_array(file, np.array(json.dumps(meta)))
+
+def export_hdf5(capture, out_path, start, stop, meta, chunk_samples):
+    try:
+        import h5py
+    except ImportError:
+        raise RuntimeError("HDF5 export needs h5py (pip install h5py)")
+    n = stop - start
+    with h5py.File(out_path, "w") as file:
+        datasets = {name: file.create_dataset(name, (n,), dtype="f8", chunks=(min(max(n, 1), 1 << 16),))
+                    for name in meta["columns"]}
+        for name, unit in meta["columns"].items():
+            datasets[name].attrs["unit"] = unit
+        for key, value in meta.items():
+            if key != "columns":
+                file.attrs[key] = json.dumps(value) if isinstance(value, (dict, list)) else value
+        offset = 0
+        for time, values in chunks(capture, start, stop, chunk_samples):
+            datasets["time"][offset:offset + len(time)] = time
+            for name in CHANNELS:
+                datasets[name][offset:offset + len(time)] = values[name]
+            offset += len(time)
+
+def export_parquet(capture, out_path, start, stop, meta, chunk_samples):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    names = column_names(meta)
+    schema = pa.schema([(name, pa.float64()) for name in names],
+                       metadata={"power_monitor": json.dumps(meta)})
+    # One row group per chunk
+    with pq.ParquetWriter(out_path, schema) as writer:
+        for time, values in chunks(capture, start, stop, chunk_samples):
+            writer.write_table(pa.table([time, *(values[name] for name in CHANNELS)], schema=schema))
+
+exporters = {
+    ".csv":     export_csv,
+    ".npz":     export_npz,
+    ".h5":      export_hdf5,
+    ".hdf5":    export_hdf5,
+    ".parquet": export_parquet
+}
+
+def export(path, out_path, start=None, stop=None, chunk_samples=CHUNK_SAMPLES):
+    # start, stop: sample indexes of the capture (None: its ends). The format
+    # comes from the out_path extension. Returns the number of rows.
+    exporter = exporters.get(os.path.splitext(str(out_path))[1].lower())
+    if exporter is None:
+        raise ValueError(f"Unknown export format, use {', '.join(exporters)}")
+    capture = open_capture(path)
+    start = min(max(int(start or 0), 0), capture.num_samples)
+    stop = capture.num_samples if stop is None else min(max(int(stop), start), capture.num_samples)
+    exporter(capture, out_path, start, stop, export_meta(capture, start, stop), chunk_samples)
+    return stop - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a power monitor capture")
+    parser.add_argument("capture", help="capture file (with its .json sidecar)")
+    parser.add_argument("output", help=f"output file: {', '.join(exporters)}")
+    parser.add_argument("--start", type=float, default=None, help="range start [s]")
+    parser.add_argument("--stop", type=float, default=None, help="range stop [s]")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SAMPLES, help="samples per chunk")
+    args = parser.parse_args(argv)
+
+    capture = open_capture(args.capture)
+    try:
+        rows = export(args.capture, args.output, capture.time_to_sample(args.start),
+                      capture.time_to_sample(args.stop), args.chunk)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(str(e))
+    print(f"{rows} rows -> {args.output}")
+
+if __name__ == "__main__":
+    main()
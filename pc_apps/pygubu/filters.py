@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Host side smoothing of a channel, an alternative to the device averaging
+# (average_num) that does not cost sample rate. Every filter keeps its state
+# across batches, so feeding a stream report by report gives the same output
+# as filtering it in one go, and runs vectorized over each batch: the cost is
+# linear in samples with no Python loop per sample.
+#
+# Filters are described by a string, stages applied in order:
+#
+#   "median:5,iir:0.05"     5 samples running median then single pole IIR
+#   "boxcar:16"             16 samples moving average
+#   "cic:8:2"               average and decimate by 8, 2 stages (CIC style)
+
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+IIR_CHUNK_DECAY = 30.0     # Max exp decay per vectorized IIR chunk (keeps r^-k finite)
+
+class Boxcar:
+    # Moving average over the last n samples
+    decimation = 1
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError(f"Invalid boxcar length: {n}")
+        self.n = int(n)
+        self.reset()
+
+    def reset(self):
+        self.tail = None    # Last n - 1 inputs, the first sample repeated at the start
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return values
+        if self.tail is None:
+            self.tail = np.full(self.n - 1, values[0])
+        x = np.concatenate((self.tail, values))
+        c = np.concatenate(([0.0], np.cumsum(x)))
+        self.tail = x[len(x) - self.n + 1:]
+        return (c[self.n:] - c[:-self.n]) / self.n
+
+class IIR:
+    # Single pole low pass: y[k] = alpha * x[k] + (1 - alpha) * y[k - 1]
+    decimation = 1
+
+    def __init__(self, alpha):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Invalid IIR alpha: {alpha}")
+        self.alpha = float(alpha)
+        self.reset()
+
+    def reset(self):
+        self.y = None
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0 or self.alpha == 1:
+            return values
+        if self.y is None:
+            self.y = values[0]
+
+        # Closed form per chunk: y[k] = r^(k+1) y[-1] + alpha r^k sum(x[j] r^-j),
+        # chunks short enough for r^-k to stay in range
+        r = 1 - self.alpha
+        step = max(int(IIR_CHUNK_DECAY / -math.log(r)), 1)
+        out = np.empty_like(values)
+        for i in range(0, len(values), step):
+            x = values[i:i + step]
+            p = r ** np.arange(len(x))
+            y = r * p * self.y + self.alpha * p * np.cumsum(x / p)
+            out[i:i + step] = y
+            self.y = y[-1]
+        return out
+
+class CIC:
+    # Average and decimate by r with a cascade of stages moving averages,
+    # gain normalized. One output per r inputs, aligned on the last input.
+    def __init__(self, r, stages=1):
+        if r < 1 or stages < 1:
+            raise ValueError(f"Invalid CIC decimation {r} / stages {stages}")
+        self.decimation = int(r)
+        self.stages = [Boxcar(r) for _ in range(int(stages))]
+        self.reset()
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+        self.phase = 0      # Inputs since the last output
+
+    def process(self, values):
+        for stage in self.stages:
+            values = stage.process(values)
+        first = self.decimation - 1 - self.phase
+        self.phase = (self.phase + len(values)) % self.decimation
+        return values[first::self.decimation] if first < len(values) else values[:0]
+
+class RunningMedian:
+    # Median of the last n samples, removes spikes shorter than n / 2
+    decimation = 1
+
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError(f"Invalid median length: {n}")
+        self.n = int(n)
+        self.reset()
+
+    def reset(self):
+        self.tail = None
+
+    def process(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return values
+        if self.tail is None:
+            self.tail = np.full(self.n - 1, values[0])
+        x = np.concatenate((self.tail, values))
+        self.tail = x[len(x) - self.n + 1:]
+        return np.median(sliding_window_view(x, self.n), axis=1)
+
+class FilterChain:
+    def __init__(self, filters=(), spec=""):
+        self.filters = list(filters)
+        self.spec = spec
+        self.decimation = math.prod(f.decimation for f in self.filters)
+
+    def __bool__(self):
+        return bool(self.filters)
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def process(self, values):
+        for f in self.filters:
+            values = f.process(values)
+        return values
+
+filter_types = {
+    "boxcar": lambda n: Boxcar(int(n)),
+    "iir":    lambda alpha: IIR(float(alpha)),
+    "cic":    lambda r, stages="1": CIC(int(r), int(stages)),
+    "median": lambda n: RunningMedian(int(n))
+}
+
+def parse_filters(text):
+    # "median:5,iir:0.05" -> FilterChain, "" -> empty chain (no filtering)
+    filters = []
+    for stage in (text or "").split(","):
+        if not stage.strip():
+            continue
+        name, *args = stage.strip().split(":")
+        if name not in filter_types:
+            raise ValueError(f"Unknown filter: {name}")
+        try:
+            filters.append(filter_types[name](*args))
+        except TypeError:
+            raise ValueError(f"Invalid filter parameters: {stage.strip()}")
+    return FilterChain(filters, text or "")
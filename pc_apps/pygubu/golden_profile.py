@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Firmware regression against a golden current profile: one or more
+# reference captures are recorded into a min/max envelope of bin means, then
+# new captures of the same scenario are checked against it widened by an
+# absolute and a relative tolerance. The report is JSON and the exit code is
+# 0 on pass, 1 on fail, for the headless tooling.
+#
+#   python golden_profile.py record ref1.bin ref2.bin -o boot.golden.npz --bin 64
+#   python golden_profile.py check boot.golden.npz new.bin --abs 0.5 --rel 0.05
+#
+# Captures are reduced to current means of `bin` samples chunk by chunk, so a
+# multi-hour check holds only the bin means. Recordings and checked captures
+# are aligned on the first recording by cross-correlating the bin means
+# (capture_compare.correlate) within --max-shift; bins holding a capture gap
+# (meta["gaps"]) are left out.
+#
+# Violations are the runs of consecutive bins outside the envelope, with
+# their time range on the golden and on the checked capture and the worst
+# excess over the limit; runs shorter than --min-duration are counted apart
+# and don't fail the check.
+
+import sys
+import json
+import argparse
+import numpy as np
+
+from capture import open_capture, to_float
+from capture_compare import correlate
+
+GOLDEN_BIN = 64            # Samples per bin mean
+CHUNK_SAMPLES = 1 << 20    # Samples per capture read
+MAX_SHIFT = 5.0            # Alignment search range [s]
+MAX_REPORT = 100           # Violations listed in the report
+
+def bin_means(capture, bin_samples, chunk_samples=CHUNK_SAMPLES):
+    # Current mean [mA] of every whole bin, NaN where a gap falls
+    n = capture.num_samples // bin_samples
+    means = np.empty(n)
+    step = max(chunk_samples // bin_samples, 1) * bin_samples
+    for start in range(0, n * bin_samples, step):
+        stop = min(start + step, n * bin_samples)
+        _, current = capture.read(start, stop)
+        values = to_float(capture.meta, "current", current.astype(np.float64))
+        means[start // bin_samples:stop // bin_samples] = values.reshape(-1, bin_samples).mean(axis=1)
+    gaps = np.array([gap["sample"] for gap in capture.meta.get("gaps", [])], dtype=np.int64) // bin_samples
+    means[gaps[gaps < n]] = np.nan
+    return means
+
+def bin_lag(reference, means, max_lag):
+    # Lag of means on reference (reference[i + lag] ~ means[i]) within +-max_lag bins
+    if max_lag <= 0 or len(reference) < 2 or len(means) < 2:
+        return 0
+    a = np.where(np.isnan(reference), np.nanmean(reference), reference)
+    b = np.where(np.isnan(means), np.nanmean(means), means)
+    lag, _ = correlate(a, b, -max_lag, max_lag, min(len(a), len(b)) // 2)
+    return lag
+
+def shifted(means, lag, length):
+    # means placed on the reference bins, NaN where they don't reach
+    out = np.full(length, np.nan)
+    first, last = max(lag, 0), min(length, len(means) + lag)
+    if last > first:
+        out[first:last] = means[first - lag:last - lag]
+    return out
+
+def record(paths, out_path, bin_samples=GOLDEN_BIN, max_shift=MAX_SHIFT):
+    captures = [open_capture(path) for path in paths]
+    period = captures[0].sample_period
+    if any(not np.isclose(capture.sample_period, period) for capture in captures):
+        raise ValueError("The recordings don't have the same sample period")
+    max_lag = int(max_shift / (period * bin_samples))
+
+    reference = bin_means(captures[0], bin_samples)
+    recordings, lags = [reference], [0]
+    for capture in captures[1:]:
+        means = bin_means(capture, bin_samples)
+        lags.append(bin_lag(reference, means, max_lag))
+        recordings.append(shifted(means, lags[-1], len(reference)))
+    stack = np.vstack(recordings)
+    count = np.sum(~np.isnan(stack), axis=0)
+    mean = np.where(count > 0, np.nansum(stack, axis=0) / np.maximum(count, 1), np.nan)
+
+    meta = {"sample_period": period, "bin_samples": bin_samples, "bins": len(reference),
+            "units": {"current": captures[0].meta.get("units", {}).get("current", "mA")},
+            "recordings": [{"path": str(capture.path), "offset_s": lag * bin_samples * period}
+                           for capture, lag in zip(captures, lags)]}
+    meta.update({key: captures[0].meta[key] for key in ("conversion_times", "average_num", "adc_range")
+                 if key in captures[0].meta})
+    # Bins no recording covers stay NaN and aren't checked
+    np.savez(out_path, lower=np.fmin.reduce(stack), upper=np.fmax.reduce(stack), mean=mean,
+             count=count, meta=np.array(json.dumps(meta)))
+    return meta
+
+def load_golden(path):
+    with np.load(path) as data:
+        golden = {key: data[key] for key in ("lower", "upper", "mean", "count")}
+        golden["meta"] = json.loads(str(data["meta"]))
+    return golden
+
+def violation_runs(outside, min_bins):
+    # [start, stop) of the runs of True, split into (kept, too short)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], outside.astype(np.int8), [0]))))
+    starts, stops = edges[0::2], edges[1::2]
+    kept = stops - starts >= min_bins
+    return starts[kept], stops[kept], int(np.count_nonzero(~kept))
+
+def check(golden_path, path, abs_tol=0.0, rel_tol=0.0, max_shift=MAX_SHIFT, min_duration=0.0,
+          max_report=MAX_REPORT):
+    golden = load_golden(golden_path)
+    meta = golden["meta"]
+    capture = open_capture(path)
+    period, bin_samples = meta["sample_period"], meta["bin_samples"]
+    if not np.isclose(capture.sample_period, period):
+        raise ValueError(f"Sample period {capture.sample_period} differs from the golden {period}")
+    bin_time = bin_samples * period
+    bins = meta["bins"]
+
+    means = bin_means(capture, bin_samples)
+    lag = bin_lag(golden["mean"], means, int(max_shift / bin_time))
+    value = shifted(means, lag, bins)
+
+    # Envelope widened by max(abs, rel x |bound|), NaN bins are skipped
+    lower, upper = golden["lower"], golden["upper"]
+    low = lower - np.maximum(abs_tol, rel_tol * np.abs(lower))
+    high = upper + np.maximum(abs_tol, rel_tol * np.abs(upper))
+    checked = ~np.isnan(value) & ~np.isnan(low)
+    excess = np.where(checked, np.maximum(value - high, low - value), -np.inf)
+    outside = excess > 0
+
+    starts, stops, short = violation_runs(outside, max(int(np.ceil(min_duration / bin_time)), 1))
+    violations = []
+    if len(starts):
+        # Reduced over each [start, stop) only (every other reduceat slice)
+        bounds = np.column_stack((starts, stops)).ravel()
+        worst = np.maximum.reduceat(np.append(excess, -np.inf), bounds)[0::2]
+        above = np.logical_or.reduceat(np.append(value > high, False), bounds)[0::2]
+        below = np.logical_or.reduceat(np.append(value < low, False), bounds)[0::2]
+        for i in range(min(len(starts), max_report)):
+            violations.append({
+                "start_s": float(starts[i] * bin_time),
+                "stop_s": float(stops[i] * bin_time),
+                "capture_start_s": float((starts[i] - lag) * bin_time),
+                "capture_stop_s": float((stops[i] - lag) * bin_time),
+                "kind": "both" if above[i] and below[i] else "above" if above[i] else "below",
+                "worst_excess_mA": float(worst[i])
+            })
+
+    # The capture must cover the golden, but for the bins lost to the shift and the gaps
+    uncovered = int(np.count_nonzero(~np.isnan(lower) & ~checked))
+    covered = uncovered <= abs(lag) + 1 + len(capture.meta.get("gaps", []))
+    return {
+        "pass": bool(covered and len(starts) == 0),
+        "golden": str(golden_path),
+        "capture": str(path),
+        "tolerance": {"abs_mA": abs_tol, "rel": rel_tol, "min_duration_s": min_duration},
+        "offset_s": lag * bin_time,
+        "bin_s": bin_time,
+        "checked_s": float(np.count_nonzero(checked) * bin_time),
+        "uncovered_s": float(uncovered * bin_time),
+        "covered": bool(covered),
+        "outside_s": float(np.count_nonzero(outside) * bin_time),
+        "violation_count": int(len(starts)),
+        "short_violations": short,
+        "violations": violations
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden current profile regression check")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("record", help="reference captures -> golden envelope")
+    p.add_argument("captures", nargs="+", help="reference captures, aligned on the first")
+    p.add_argument("-o", "--output", required=True, help="golden file (.npz)")
+    p.add_argument("--bin", type=int, default=GOLDEN_BIN, help="samples per bin mean")
+    p.add_argument("--max-shift", type=float, default=MAX_SHIFT, help="alignment search range [s], 0: none")
+    p = sub.add_parser("check", help="capture against a golden envelope, exit code 1 on fail")
+    p.add_argument("golden", help="golden file (.npz)")
+    p.add_argument("capture", help="capture to check")
+    p.add_argument("--abs", type=float, default=0.0, help="absolute tolerance [mA]")
+    p.add_argument("--rel", type=float, default=0.0, help="relative tolerance (0.05 = 5 %%)")
+    p.add_argument("--max-shift", type=float, default=MAX_SHIFT, help="alignment search range [s], 0: none")
+    p.add_argument("--min-duration", type=float, default=0.0, help="ignore violations shorter than this [s]")
+    p.add_argument("--max-report", type=int, default=MAX_REPORT, help="violations listed in the report")
+    p.add_argument("--report", default=None, help="write the JSON report to this file too")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "record":
+            result = record(args.captures, args.output, args.bin, args.max_shift)
+        else:
+            result = check(args.golden, args.capture, args.abs, args.rel, args.max_shift,
+                           args.min_duration, args.max_report)
+    except (ValueError, OSError) as e:
+        sys.exit(str(e))
+    json.dump(result, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+    if args.command == "check":
+        if args.report:
+            with open(args.report, "w") as file:
+                json.dump(result, file, indent=4)
+        if not result["pass"]:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
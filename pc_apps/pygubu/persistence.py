@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Digital phosphor style persistence map: a 2D histogram (position in frame x
+# value) of many fixed length frames, free running or aligned on a rising
+# trigger level. Older frames fade out with a per frame decay. Rare glitches
+# show up as faint pixels that a single trace would hide, and the image costs
+# O(pixels) whatever the number of frames accumulated.
+
+import numpy as np
+
+COLUMNS = 500          # Histogram bins along the frame
+ROWS = 200             # Histogram bins along the value axis
+DECAY = 0.98           # Weight kept per new frame
+RANGE_MARGIN = 0.1     # Head room added to an automatic value range
+
+class PersistenceMap:
+    def __init__(self, frame_len, columns=COLUMNS, rows=ROWS, y_range=None,
+                 trigger=None, decay=DECAY):
+        self.frame_len = max(int(frame_len), 2)
+        self.columns = min(columns, self.frame_len)
+        self.rows = rows
+        self.y_range = y_range      # (lo, hi) in sample units, from the first frames if None
+        self.trigger = trigger      # Rising level in sample units, None to free run
+        self.decay = decay
+        self.hist = np.zeros((rows, self.columns), dtype=np.float32)
+        self.column = np.arange(self.frame_len) * self.columns // self.frame_len
+        self.pending = np.zeros(0)
+        self.frames = 0
+
+    def reset(self):
+        self.hist[:] = 0
+        self.pending = np.zeros(0)
+        self.frames = 0
+
+    def frame_starts(self, data):
+        last = len(data) - self.frame_len
+        if last < 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.trigger is None:
+            return np.arange(0, last + 1, self.frame_len)
+
+        # Rising crossings, each frame holds off the triggers inside it
+        crossings = np.flatnonzero((data[:-1] < self.trigger) & (data[1:] >= self.trigger)) + 1
+        crossings = crossings[crossings <= last]
+        starts = []
+        i = 0
+        while i < len(crossings):
+            starts.append(crossings[i])
+            i = np.searchsorted(crossings, crossings[i] + self.frame_len)
+        return np.asarray(starts, dtype=np.int64)
+
+    def append(self, values):
+        # values: new samples of one channel, any numeric dtype
+        data = np.concatenate((self.pending, values))
+        starts = self.frame_starts(data)
+        if len(starts) == 0:
+            self.pending = data[-self.frame_len - 1:]
+            return 0
+
+        frames = data[starts[:, None] + np.arange(self.frame_len)]
+        if self.y_range is None:
+            lo, hi = float(frames.min()), float(frames.max())
+            margin = max((hi - lo) * RANGE_MARGIN, 1.0)
+            self.y_range = (lo - margin, hi + margin)
+
+        # Fade what was there, then add the new frames in one bincount.
+        # Values out of range pile up on the edge rows rather than vanish.
+        lo, hi = self.y_range
+        row = np.clip((frames - lo) * (self.rows / (hi - lo)), 0, self.rows - 1).astype(np.int64)
+        index = (row * self.columns + self.column).reshape(-1)
+        self.hist *= self.decay ** len(starts)
+        self.hist += np.bincount(index, minlength=self.rows * self.columns).reshape(self.rows, self.columns)
+
+        # Keep the tail, plus the sample before it to see a crossing at its start
+        keep = max(starts[-1] + self.frame_len, len(data) - self.frame_len)
+        self.pending = data[keep - (self.trigger is not None):]
+        self.frames += len(starts)
+        return len(starts)
+
+    def image(self):
+        # Intensity in [0, 1], log graded so single hits stay visible
+        image = np.log1p(self.hist)
+        peak = image.max()
+        return image / peak if peak > 0 else image
+
+    def extent(self, scale=1.0):
+        # imshow extent (left, right, bottom, top), values times scale
+        lo, hi = self.y_range or (0.0, 1.0)
+        return (0, self.frame_len, lo * scale, hi * scale)
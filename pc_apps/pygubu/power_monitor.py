@@ -5,94 +5,77 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import time
+STARTUP_T0 = time.perf_counter()
+
 import os
-import json
 import queue
-import time
-import serial
 import binascii
 import pathlib
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import ttk, messagebox, filedialog
 import pygubu
 import threading
-import struct
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from capture import CaptureWriter, DerivedWriter, capture_meta, open_capture
+from filters import parse_filters
+from settings import SettingsManager, file_path
+from protocol import (DATA_RPT_SAMPLE_SIZE, DAC_VCC, DATA_MAX_4P2, RESPONSE_SIZE, CMD_CONFIGURE_INA229,
+                      CMD_STOP_MEASURE, conversion_times, average_num, adc_range,
+                      cmd_report_size, response_report_size, report_size, report_units,
+                      sample_period, cmd_set_vbat, cmd_vbat_output, cmd_write_config, cmd_simple,
+                      cmd_start_measure, response_ok, ReportDecoder, STREAM_MODE_SCALED,
+                      STREAM_MODE_PACKED, STREAM_MODE_CHANNELS, stream_modes, packed_sample_size,
+                      DEFAULT_CHANNELS, channels, channel_mask, channel_names,
+                      channel_sample_size, channel_arrays, cmd_channels, response_channels,
+                      stored_values, scaled_records)
+from device import find_ports, parse_usb_id
+from ring_buffer import RingBuffer, minmax_line
+from rolling_stats import RollingStats, format_window, parse_windows
+from segments import SegmentIndex, CaptureSegments
+
+# matplotlib (~0.5 s) and serial are imported when first needed, so the window
+# shows up before the figures are built
 
 PROJECT_PATH = pathlib.Path(__file__).parent
 PROJECT_UI = PROJECT_PATH / "power_monitor.ui"
 RESOURCE_PATHS = [PROJECT_PATH]
 
 # Constants
-SIGNATURE = 0x87654321
-DATA_RPT_SAMPLE_SIZE = 63  # The size of the current and voltage arrays
 MAX_DATA_SIZE = 20000      # Maximum number of samples for zoom-out
-DAC_VCC = 4.75             # DAC VCC power supply voltage
-DATA_MAX_4P2 = 3622        # DATA_MAX_4P2 = 4096 * 4.2 / DAC_VCC
+HISTORY_SIZE = 1 << 21     # Samples kept per channel (float32)
+PLOT_BINS = 2000           # Min/max bins drawn per waveform
+CURRENT_LABELS = {"title": "Current Waveform (mA)", "xlabel": "Sample", "ylabel": "Current (mA)"}
+VOLTAGE_LABELS = {"title": "Volatge Waveform (V)", "xlabel": "Sample", "ylabel": "Volatage (V)"}
+DIFFERENCE_LABELS = {"title": "Current Difference B - A (mA)", "xlabel": "Sample", "ylabel": "Current (mA)"}
+MARKER_COLORS = ("red", "blue", "magenta", "darkcyan", "purple", "brown", "olive", "black")
+SEGMENT_COLUMNS = ("segment", "duration", "mean", "min", "max", "charge", "energy")
 DATA_3P8 = 3350            # Default VBAT output = 3.8V
 
 WAVEFORM_UPDATE_INTERVAL = 4 # In milisecon
+PROFILE_CHECK_INTERVAL = 200 # VBAT profile progress refresh [ms]
+RECONNECT_INTERVAL = 0.5     # Delay between reconnect attempts [s]
+STARTUP_TARGET_MS = 500      # Time to first paint
+
+class StartupTimer:
+    def __init__(self, t0):
+        self.t0 = t0
+        self.marks = []
 
-conversion_times = {
-    "280uS": 0x3,
-    "540uS": 0x4,
-    "1052uS": 0x5,
-    "2074uS": 0x6,
-    "4120uS": 0x7
-}
-
-average_num = {
-    "AVG_NUM_1"    : 0x00,
-    "AVG_NUM_4"    : 0x01,
-    "AVG_NUM_16"   : 0x02,
-    "AVG_NUM_64"   : 0x03,
-    "AVG_NUM_128"  : 0x04,
-    "AVG_NUM_256"  : 0x05,
-    "AVG_NUM_512"  : 0x06,
-    "AVG_NUM_1024" : 0x07
-}
-
-adc_range = {
-    "RANGE_0"  : 0x00,
-    "RANGE_1"  : 0x01
-}
-
-# File path for settings.ini
-file_path = "settings.ini"
-
-# Default settings
-default_settings = {
-    "serial_port_cmd":  "COM13",
-    "serial_port_data": "COM14",
-    "baudrate":         "10000000",
-    "conversion_times": "280uS",
-    "average_num":      "AVG_NUM_1",
-    "adc_range":        "RANGE_0",
-    "vbat":             "1927",
-    "vbat_ena":         "False"
-}
-
-# API to read and write specific key values
-class SettingsManager:
-    def __init__(self, file_path):
-        self.file_path = file_path
-
-    def read_value(self, key):
-        with open(self.file_path, "r") as file:
-            settings = json.load(file)
-        return settings.get(key)
-
-    def write_value(self, key, value):
-        with open(self.file_path, "r") as file:
-            settings = json.load(file)
-        settings[key] = value
-        with open(self.file_path, "w") as file:
-            json.dump(settings, file, indent=4)
+    def mark(self, name):
+        self.marks.append((name, (time.perf_counter() - self.t0) * 1000))
+
+    def elapsed(self, name):
+        return dict(self.marks).get(name)
+
+    def report(self):
+        return ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.marks)
 
 class Power_Monitor:
-    def __init__(self, master=None, on_first_object_cb=None):
+    def __init__(self, master=None, on_first_object_cb=None, profile=None):
+        self.startup = StartupTimer(STARTUP_T0)
+        self.startup.mark("imports")
+
         # Initialize the stack to keep track of xlim history
         self.xlim_stack = []
         # Initialize other properties
@@ -103,10 +86,67 @@ class Power_Monitor:
         self.is_receiving = False
         self.is_measuring = False
         self.receive_thread = None
-        self.current_data = np.array([])  # Store received current data here
-        self.voltage_data = np.array([])  # Store received voltage data here
+        # Received samples are kept as float32 in report_units (whole V / mA
+        # of scaled reports, the raw code resolution of channel reports)
+        self.current_history = RingBuffer(HISTORY_SIZE, np.float32)
+        self.voltage_history = RingBuffer(HISTORY_SIZE, np.float32)
+        self.current_data = self.current_history.latest(MAX_DATA_SIZE)  # Displayed window (view)
+        self.voltage_data = self.voltage_history.latest(MAX_DATA_SIZE)
         self.data_queue_voltage = queue.Queue()
         self.data_queue_current = queue.Queue()
+        # Channels streamed besides voltage and current (vshunt, dietemp,
+        # power, diag_alrt), selected with CMD_SET_CHANNELS ("channels" in
+        # settings.ini): float histories in protocol.channels units, the
+        # upper plot shows "plot_channel". They go to the capture as derived
+        # channels, voltage and current too at their full resolution.
+        self.channel_mask = DEFAULT_CHANNELS
+        # (sample_size, stream_mode, channel mask) of the reports streamed
+        # next, set on start measuring and re-read by the receive thread
+        self.stream_layout = (DATA_RPT_SAMPLE_SIZE, STREAM_MODE_SCALED, DEFAULT_CHANNELS)
+        self.channel_history = {}
+        self.data_queue_channels = queue.Queue()
+        self.channel_writers = {}
+        # Raw reports are recorded to a capture file while measuring when
+        # "capture_dir" is set in settings.ini ("capture_codec": zlib/lzma to compress)
+        self.capture_writer = None
+        self.capture_lock = threading.Lock()
+        # Samples per channel in each report, negotiated with the device
+        # ("report_size" in settings.ini)
+        self.sample_size = DATA_RPT_SAMPLE_SIZE
+        # Capture file opened for viewing and its overview cache
+        self.overview = None
+        self.overview_capture = None
+        # Capture compared to the opened one (capture_compare.py), drawn over
+        # it with B - A in place of the voltage: {"capture", "overview", "offset"}
+        self.compare = None
+        # Freeze view: the frozen (current, voltage) histories, browsed while
+        # new samples go to the spare pair, and the live marker positions
+        self.frozen_history = None
+        self.spare_history = None
+        self.live_markers = None
+        # Persistence view of the live current (persistence.PersistenceMap)
+        self.persistence = None
+        # Rolling window statistics of the live channels, reset on start
+        self.rolling = None
+        # Host side current filter ("filter" in settings.ini), applied to the
+        # displayed trace or to a derived channel of the capture ("filter_target")
+        self.display_filter = None
+        self.filtered_history = None
+        self.capture_filter = None
+        self.derived_writer = None
+        # VBAT profile playback (vbat_profile.ProfilePlayer) and the charge
+        # drawn, counted by the receive thread for charge profiles. The
+        # player thread shares the command port under cmd_lock.
+        self.vbat_player = None
+        self.charge_counter = None
+        self.cmd_lock = threading.Lock()
+        # USB link recovery: the receive thread reopens the ports (found by
+        # "usb_id" VID:PID when set) within "reconnect_timeout" seconds and
+        # sends link_config again, a snapshot taken on the Tk thread
+        self.link_ports = None
+        self.link_baudrate = None
+        self.link_config = None
+        self.status_queue = queue.Queue()
 
         self.builder = pygubu.Builder(
             on_first_object=on_first_object_cb)
@@ -116,6 +156,7 @@ class Power_Monitor:
         self.mainwindow: tk.Toplevel = self.builder.get_object(
             "toplevel", master)
         self.builder.connect_callbacks(self)
+        self.startup.mark("ui")
 
         # Collect the GUI objects here
         self.output_text = self.builder.get_object('text_status', master)
@@ -136,17 +177,20 @@ class Power_Monitor:
         self.checkbt_vbat_ena = self.builder.get_object('checkbutton_vbat_enable', master)
         self.entry_min = self.builder.get_object('entry_min', master)
         self.entry_max = self.builder.get_object('entry_max', master)
+        self.button_freeze = self.builder.get_object('button_freeze', master)
+        self.button_persistence = self.builder.get_object('button_persistence', master)
+        self.button_vbat_profile = self.builder.get_object('button_vbat_profile', master)
+        self.treeview_rolling = self.builder.get_object('treeview_rolling', master)
 
-        # Check if the settings file exists, if not, create it with default values
-        if not os.path.exists(file_path):
-            with open(file_path, "w") as file:
-                json.dump(default_settings, file, indent=4)
-
-        # Get port and baudrate from settings.ini
-        self.settings_manager = SettingsManager(file_path)
+        # Get port and baudrate from settings.ini (loaded once, defaults if missing)
+        self.settings_manager = SettingsManager(file_path, profile)
+        if profile:
+            self.mainwindow.title(f"{self.mainwindow.title()} - {profile}")
 
         # Load the settings
         self.load_settings()
+        # Rolling windows from the settings
+        self.setup_rolling_view()
 
         # Link scrollbars
         self.vscroll = self.builder.get_object('scrollbar_vertical', master)
@@ -155,32 +199,57 @@ class Power_Monitor:
         self.vscroll.config(command=self.output_text.yview)
         self.hscroll.config(command=self.output_text.xview)
 
+        # Marker positions (sorted sample indexes), the first two give the
+        # marker values and the statistics entries, every pair of neighbours
+        # a row of the segment table
+        self.markers = [200, 400]
+        # Index in markers of the marker being dragged
+        self.dragging_marker = None
+        # Prefix sums of the displayed data for the segment statistics
+        self.segment_index = None
+        self.segment_window = None
+        # The figures are created once the plot area is mapped
+        self.figure1 = None
+        self.figure2 = None
+        self.canvas1 = None
+        self.canvas2 = None
+        # What each canvas shows (render_worker scenes without the markers)
+        self.current_plot = dict(CURRENT_LABELS)
+        self.voltage_plot = dict(VOLTAGE_LABELS)
+        self.canvas_current.bind("<Map>", self.on_plot_area_mapped)
+        # Bind the close event to the custom close method
+        self.mainwindow.protocol("WM_DELETE_WINDOW", self.close)
+        self.startup.mark("init")
+
+    def on_plot_area_mapped(self, event):
+        self.canvas_current.unbind("<Map>")
+        # Idle callbacks run in order, so this one runs after the window is drawn
+        self.mainwindow.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        self.mainwindow.update_idletasks()
+        self.startup.mark("first paint")
+        self.mainwindow.after(1, self.create_figures)
+
+    def create_figures(self):
+        from matplotlib.figure import Figure
+        from render_worker import OffscreenCanvas
+
+        # The figures only hold the layout and the axes limits for the mouse
+        # events, the waveforms are rendered off the Tk thread (render_worker.py)
+
         # Matplotlib figure for plotting current waveform
-        self.figure1 = plt.Figure(figsize=(20, 3), dpi=70)
+        self.figure1 = Figure(figsize=(20, 3), dpi=70)
         self.ax1 = self.figure1.add_subplot(111)
-        self.ax1.set_title("Current Waveform (mA)")
-        self.ax1.set_xlabel("Sample")
-        self.ax1.set_ylabel("Current (mA)")
-        self.canvas1 = FigureCanvasTkAgg(self.figure1, master=self.canvas_current)
+        self.canvas1 = OffscreenCanvas(self.figure1, master=self.canvas_current)
         self.canvas1.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
         # Matplotlib figure for plotting volatge waveform
-        self.figure2 = plt.Figure(figsize=(20, 2), dpi=70)
+        self.figure2 = Figure(figsize=(20, 2), dpi=70)
         self.ax2 = self.figure2.add_subplot(111)
-        self.ax2.set_title("Volatge Waveform (V)")
-        self.ax2.set_xlabel("Sample")
-        self.ax2.set_ylabel("Volatage (V)")
-        self.canvas2 = FigureCanvasTkAgg(self.figure2, master=self.canvas_voltage)
+        self.canvas2 = OffscreenCanvas(self.figure2, master=self.canvas_voltage)
         self.canvas2.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
-        # Initialize marker positions
-        self.marker1_pos = 200
-        self.marker2_pos = 400
-        # Add default markers
-        self.marker_line1 = self.ax1.axvline(self.marker1_pos, color='red', linestyle='--')
-        self.marker_line2 = self.ax1.axvline(self.marker2_pos, color='blue', linestyle='--')
-        # Initialize dragging_marker
-        self.dragging_marker = None
         # Connect event handlers for dragging markers
         self.canvas1.mpl_connect('button_press_event', self.on_press)
         self.canvas1.mpl_connect('button_release_event', self.on_release)
@@ -190,8 +259,16 @@ class Power_Monitor:
         self.update_current_waveform(self.current_data)
         # Schedule voltage/current update waveform
         self.mainwindow.after(WAVEFORM_UPDATE_INTERVAL, self.update_waveform)
-        # Bind the close event to the custom close method
-        self.mainwindow.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.startup.mark("figures")
+        self.show_startup_report()
+
+    def show_startup_report(self):
+        first_paint = self.startup.elapsed("first paint")
+        status = "OK" if first_paint <= STARTUP_TARGET_MS else "SLOW"
+        report = f"Startup: {self.startup.report()} [first paint {status}, target {STARTUP_TARGET_MS} ms]"
+        self.output_text.insert(tk.END, report + "\n")
+        self.output_text.see(tk.END)
 
     def load_settings(self):
         # Connection settings
@@ -242,17 +319,22 @@ class Power_Monitor:
         self.check_var.trace_add("write", self.on_change_vbat_enable)
 
     def store_settings(self):
-        self.settings_manager.write_value("serial_port_cmd", self.entry_port_cmd.get())
-        self.settings_manager.write_value("serial_port_data", self.entry_port_data.get())
-        self.settings_manager.write_value("baudrate", self.baudrate_entry.get())
-        self.settings_manager.write_value("conversion_times", self.selected_convtime_key.get())
-        self.settings_manager.write_value("average_num", self.selected_avgnum_key.get())
-        self.settings_manager.write_value("adc_range", self.selected_adcrange_key.get())
-        self.settings_manager.write_value("vbat", str(int(float(self.scale_vbat.get()))))
-        if self.check_var.get():
-            self.settings_manager.write_value("vbat_ena", "True")
-        else:
-            self.settings_manager.write_value("vbat_ena", "False")
+        values = {
+            "serial_port_cmd":  self.entry_port_cmd.get(),
+            "serial_port_data": self.entry_port_data.get(),
+            "baudrate":         self.baudrate_entry.get(),
+            "conversion_times": self.selected_convtime_key.get(),
+            "average_num":      self.selected_avgnum_key.get(),
+            "adc_range":        self.selected_adcrange_key.get(),
+            "vbat":             str(int(float(self.scale_vbat.get()))),
+            "vbat_ena":         "True" if self.check_var.get() else "False"
+        }
+        try:
+            # One atomic write for all the keys
+            self.settings_manager.update(values)
+            self.settings_manager.save()
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Settings Error", str(e))
 
     def update_optionmenu_convtime_items(self):
         menu = self.optionmenu_convtime['menu']
@@ -274,12 +356,20 @@ class Power_Monitor:
 
     def update_marker_values(self):
         # Ensure marker positions are within the bounds of current_data
-        marker1_index = int(self.marker1_pos)
-        marker2_index = int(self.marker2_pos)
+        marker1_index = int(self.markers[0])
+        marker2_index = int(self.markers[1])
 
         # Get the current values at marker positions
-        marker1_value = self.current_data[marker1_index] if 0 <= marker1_index < len(self.current_data) else 'N/A'
-        marker2_value = self.current_data[marker2_index] if 0 <= marker2_index < len(self.current_data) else 'N/A'
+        scale = report_units["current"][0]
+        if self.overview:
+            # Opened capture, the samples under the markers are read from the file
+            def value_at(i):
+                current = self.overview_capture.read(i, i + 1)[1] if i >= 0 else []
+                return current[0] * scale if len(current) else 'N/A'
+            marker1_value, marker2_value = value_at(marker1_index), value_at(marker2_index)
+        else:
+            marker1_value = self.current_data[marker1_index] * scale if 0 <= marker1_index < len(self.current_data) else 'N/A'
+            marker2_value = self.current_data[marker2_index] * scale if 0 <= marker2_index < len(self.current_data) else 'N/A'
 
         # Update text boxes
         self.marker1_text.delete(0, tk.END)
@@ -297,25 +387,21 @@ class Power_Monitor:
 
     def on_change_vbat_enable(self, *args):
         # Prepare command "Battery simulator volatge output enable/disable"
-        cmd = bytearray()
-        if self.check_var.get():
-            #print("Checkbutton is checked")
-            cmd.extend([0x06, 0x01, 0x00, 0x00])
-        else:
-            cmd.extend([0x06, 0x00, 0x00, 0x00])
-            #print("Checkbutton is unchecked")
+        cmd = cmd_vbat_output(self.check_var.get())
 
         if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
             messagebox.showerror("Error", "Please connect to a UART port first.")
             return
         try:
             # Write adc config param command
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
-            if response[0] != cmd[0] or response[1] != 0x01:
+            if not response_ok(cmd, response):
                 messagebox.showerror("Error", "Device respone error")
                 return
+            self.remember_link_config()
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
@@ -332,12 +418,9 @@ class Power_Monitor:
     def on_set_vbat_value(self):
         # Get VBAT setting value
         int_value = int(float(self.scale_vbat.get()))
-        low_byte = int_value & 0xFF
-        high_byte = (int_value >> 8) & 0xFF
 
         # Prepare command "set battery simulator volatge"
-        cmd = bytearray()
-        cmd.extend([0x05, high_byte, low_byte, 0x00])
+        cmd = cmd_set_vbat(int_value)
         self.output_text.insert(tk.END, f"Command: {cmd}\n")
 
         if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
@@ -345,24 +428,116 @@ class Power_Monitor:
             return
         try:
             # Write adc config param command
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
-            if response[0] != cmd[0] or response[1] != 0x01:
+            if not response_ok(cmd, response):
                 messagebox.showerror("Error", "Device respone error")
                 return
+            self.remember_link_config()
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
         self.output_text.see(tk.END)
 
+    def send_vbat_code(self, code):
+        # CMD_SET_BAT_SIM_VOLT from the profile player thread
+        cmd = cmd_set_vbat(code)
+        with self.cmd_lock:
+            if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
+                raise IOError("Command port closed")
+            self.serial_port_cmd.write(cmd)
+            response = self.serial_port_cmd.read(RESPONSE_SIZE)
+        if not response_ok(cmd, response):
+            raise IOError(f"Device respone error: {response}")
+
+    def toggle_vbat_profile(self):
+        if self.vbat_player:
+            self.stop_vbat_profile()
+            return
+        if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
+            messagebox.showerror("Error", "Please connect to a UART port first.")
+            return
+        path = filedialog.askopenfilename(title="Play VBAT profile",
+                                          filetypes=[("VBAT profiles", "*.csv"), ("All files", "*.*")])
+        if not path:
+            return
+
+        from vbat_profile import ProfilePlayer, ChargeCounter, load_profile
+        try:
+            profile = load_profile(path)
+            counter = None
+            if profile.axis == "charge":
+                # Closed loop on the charge counted from the received current
+                if not self.is_measuring:
+                    raise ValueError("Start measuring first, a charge profile follows the measured current")
+                counter = ChargeCounter(self.live_sample_period())
+            log_path = os.path.splitext(path)[0] + time.strftime("_applied_%Y%m%d_%H%M%S.csv")
+            player = ProfilePlayer(profile, self.send_vbat_code,
+                                   float(self.settings_manager.read_value("vbat_profile_speed")),
+                                   counter and (lambda: counter.charge), log_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.charge_counter = counter
+        self.vbat_player = player
+        player.start()
+        self.button_vbat_profile.config(text="Stop")
+        self.output_text.insert(tk.END, f"VBAT profile: {path} ({profile.axis}, x{player.speed:g})\n"
+                                        f"Applied steps: {log_path}\n")
+        self.output_text.see(tk.END)
+        self.mainwindow.after(PROFILE_CHECK_INTERVAL, self.check_vbat_profile)
+
+    def check_vbat_profile(self):
+        player = self.vbat_player
+        if not player:
+            return
+        # Follow the played voltage on the VBAT scale
+        if player.code is not None and int(float(self.scale_vbat.get())) != player.code:
+            self.scale_vbat.set(player.code)
+            self.on_scale_change(player.code)
+        if player.is_running():
+            self.mainwindow.after(PROFILE_CHECK_INTERVAL, self.check_vbat_profile)
+        else:
+            self.stop_vbat_profile()
+
+    def stop_vbat_profile(self):
+        player, self.vbat_player = self.vbat_player, None
+        if not player:
+            return
+        player.stop()
+        self.charge_counter = None
+        self.button_vbat_profile.config(text="Profile")
+        if player.error:
+            self.output_text.insert(tk.END, f"VBAT profile stopped: {player.error}\n")
+        else:
+            self.output_text.insert(tk.END, f"VBAT profile: {len(player.log)} steps applied\n")
+        self.output_text.see(tk.END)
+
+    def is_view_locked(self):
+        # The mouse browses stopped, frozen or capture views, not the live
+        # traces nor the persistence map
+        if self.frozen_history:
+            return False
+        return self.is_measuring == True or self.persistence is not None
+
     def on_scroll(self, event):
-        if self.is_measuring == True:
+        if self.is_view_locked():
             return
 
         if event.inaxes != self.ax1:
             return
 
+        if event.key == 'shift':
+            # Shift + wheel pans by a tenth of the visible range
+            x_min, x_max = self.ax1.get_xlim()
+            step = (x_max - x_min) / 10 * (1 if event.button == 'up' else -1)
+            step = min(max(step, self.original_xlim[0] - x_min), self.original_xlim[1] - x_max)
+            self.ax1.set_xlim([x_min + step, x_max + step])
+            self.redraw_view()
+            return
+
         zoom_factor = 1.1
         if event.button == 'up':
             zoom_factor = 1 / zoom_factor
@@ -374,7 +549,7 @@ class Power_Monitor:
             else:
                 self.ax1.set_xlim(self.original_xlim)
 
-        x_center = (self.marker1_pos + self.marker2_pos) / 2
+        x_center = (self.markers[0] + self.markers[-1]) / 2
         x_range = self.ax1.get_xlim()[1] - self.ax1.get_xlim()[0]
         new_x_range = x_range * zoom_factor
 
@@ -388,130 +563,329 @@ class Power_Monitor:
                 min(new_xlim[1], self.original_xlim[1])
             ])
 
-        self.canvas1.draw()
+        self.redraw_view()
+
+    def redraw_view(self):
+        if self.overview:
+            # Pick the pyramid level (or raw samples) matching the new range
+            self.update_capture_view(self.ax1.get_xlim())
+        elif self.frozen_history:
+            self.update_frozen_view(self.ax1.get_xlim())
+        else:
+            self.show_current_plot()
 
     def on_press(self, event):
-        if self.is_measuring == True:
+        if self.is_view_locked():
             return
 
         if event.inaxes != self.ax1:
             return
 
-        # Check if the click is close to a marker
-        x_center = (self.marker1_pos + self.marker2_pos) / 2
-
-        if(event.xdata <= self.marker1_pos) and (abs(event.xdata - self.marker1_pos) < x_center):
-            self.dragging_marker = 'marker1'
-        elif (event.xdata >= self.marker2_pos) and (abs(event.xdata - self.marker2_pos) < x_center):
-            self.dragging_marker = 'marker2'
+        # Double click adds a marker, right click removes the nearest one
+        # (two are always kept), left click drags the nearest one
+        if event.dblclick:
+            self.add_marker(event.xdata)
+            return
+        nearest = int(np.argmin([abs(event.xdata - marker) for marker in self.markers]))
+        if event.button == 3:
+            self.remove_marker(nearest)
+        else:
+            self.dragging_marker = nearest
 
     def on_release(self, event):
-        if self.is_measuring == True:
+        if self.is_view_locked():
             return
 
         self.dragging_marker = None
 
     def on_motion(self, event):
-        if self.is_measuring == True:
+        if self.is_view_locked():
             return
 
-        if not hasattr(self, 'dragging_marker'):
+        if self.dragging_marker is None:
             return
 
         if event.inaxes != self.ax1:
             return
 
-        # Update marker position based on mouse movement
-        if self.dragging_marker == 'marker1':
-            self.marker1_pos = min(max(event.xdata, 0), self.marker2_pos)
-            self.marker_line1.set_xdata([self.marker1_pos, self.marker1_pos])
-        elif self.dragging_marker == 'marker2':
-            self.marker2_pos = max(min(event.xdata, len(self.current_data)), self.marker1_pos)
-            self.marker_line2.set_xdata([self.marker2_pos, self.marker2_pos])
+        # Update marker position based on mouse movement, between its neighbours
+        i = self.dragging_marker
+        lo = self.markers[i - 1] if i > 0 else 0
+        hi = self.markers[i + 1] if i + 1 < len(self.markers) else self.marker_limit()
+        self.markers[i] = min(max(event.xdata, lo), hi)
 
         # Update marker values in text boxes based on current data
         self.update_marker_values()
 
         # Recalculate the average current and update the display
-        self.calculate_and_update_average()
+        if i <= 1:
+            self.calculate_and_update_average()
+        # Only the segments on both sides of the marker change
+        self.update_segment_rows((i - 1, i))
 
         # Redraw the canvas
-        self.canvas1.draw()
+        self.show_current_plot()
 
     def update_current_waveform(self, current_data):
-        # Clear the axis without removing the markers
-        self.ax1.clear()
-
-        # Plot only the last MAX_DATA_SIZE samples if the data size exceeds it
-        if len(current_data) > MAX_DATA_SIZE:
-            self.ax1.plot(current_data[-MAX_DATA_SIZE:], color = "green")
-            self.original_xlim = [0, MAX_DATA_SIZE]
-        else:
-            self.ax1.plot(current_data, color = "green")
-            self.original_xlim = [0, len(current_data)]
+        if self.canvas1 is None:
+            return
 
-        # Re-add the markers after plotting the waveform
-        self.marker_line1 = self.ax1.axvline(self.marker1_pos, color='red', linestyle='--')
-        self.marker_line2 = self.ax1.axvline(self.marker2_pos, color='blue', linestyle='--')
+        if self.persistence:
+            self.update_persistence_view()
+            return
 
-        # Set axis labels and title
-        self.ax1.set_title("Current Waveform (mA)")
-        self.ax1.set_xlabel("Sample")
-        self.ax1.set_ylabel("Current (mA)")
+        # Plot only the last MAX_DATA_SIZE samples if the data size exceeds it
+        current_data = current_data[-MAX_DATA_SIZE:]
+        x, y = minmax_line(current_data, PLOT_BINS)
+        self.current_plot = dict(CURRENT_LABELS, lines=[(x, y * report_units["current"][0], "green")])
+        if self.display_filter:
+            # Filtered trace instead, a decimated output is drawn at the raw
+            # sample it ends on (to within the decimation)
+            r = self.display_filter.decimation
+            filtered = self.filtered_history.latest(len(current_data) // r)
+            x, y = minmax_line(filtered, PLOT_BINS)
+            x = len(current_data) - 1 - r * (len(filtered) - 1 - x)
+            self.current_plot = dict(CURRENT_LABELS, title=f"{CURRENT_LABELS['title']} - {self.display_filter.spec}",
+                                     lines=[(x, y * report_units["current"][0], "green")])
+        self.original_xlim = [0, len(current_data)]
 
         # Update average current display
         self.calculate_and_update_average()
-
-        # Check and set initial x-limits
-        current_xlim = self.ax1.get_xlim()
-        if current_xlim[0] == current_xlim[1]:  # Check if x-limits are identical
-            # Increase the range slightly to avoid identical limits
-            delta = 1
-            new_xlim = [current_xlim[0] - delta, current_xlim[1] + delta]
-        else:
-            new_xlim = self.original_xlim
+        self.update_segment_rows()
 
         # Ensure new_xlim is valid and has distinct bounds
+        new_xlim = list(self.original_xlim)
         if new_xlim[0] == new_xlim[1]:
             new_xlim[0] -= 1
             new_xlim[1] += 1
 
         self.ax1.set_xlim(new_xlim)
-        self.canvas1.draw()
+        self.show_current_plot()
+
+    def toggle_persistence(self):
+        if self.persistence:
+            self.persistence = None
+            self.button_persistence.config(text="Persistence")
+            self.update_current_waveform(self.current_data)
+            return
+        if self.overview:
+            return
+
+        from persistence import PersistenceMap
+        scale = report_units["current"][0]
+        trigger = self.settings_manager.read_value("persistence_trigger")
+        self.persistence = PersistenceMap(int(self.settings_manager.read_value("persistence_frame")),
+                                          trigger=float(trigger) / scale if trigger else None)
+        # Start from the live window, update_waveform feeds the new batches
+        self.persistence.append(self.current_history.latest(MAX_DATA_SIZE))
+        self.button_persistence.config(text="Traces")
+        self.update_current_waveform(self.current_data)
+
+    def update_persistence_view(self):
+        scale = report_units["current"][0]
+        self.current_plot = dict(CURRENT_LABELS, title=f"Current persistence ({self.persistence.frames} frames)",
+                                 xlabel="Sample in frame",
+                                 image=(self.persistence.image(), self.persistence.extent(scale), "inferno"))
+        self.ax1.set_xlim(0, self.persistence.frame_len)
+        self.canvas1.show(dict(self.current_plot, xlim=self.ax1.get_xlim()))
+
+    def show_current_plot(self):
+        # Queued for the render worker, markers and limits are cheap to change
+        self.canvas1.show(dict(self.current_plot, xlim=self.ax1.get_xlim(),
+                               markers=[(marker, MARKER_COLORS[i % len(MARKER_COLORS)])
+                                        for i, marker in enumerate(self.markers)]))
+
+    def marker_limit(self):
+        # Markers stay on the opened capture or on the live buffer
+        return self.overview.num_samples if self.overview else len(self.current_data)
+
+    def add_marker(self, x):
+        self.markers.append(min(max(x, 0), self.marker_limit()))
+        self.markers.sort()
+        self.dragging_marker = None
+        self.show_segment_table()
+        self.redraw_view()
+
+    def remove_marker(self, i):
+        if len(self.markers) <= 2:
+            return
+        del self.markers[i]
+        self.dragging_marker = None
+        self.update_marker_values()
+        self.calculate_and_update_average()
+        self.update_segment_rows()
+        self.redraw_view()
+
+    def segments(self):
+        if self.overview:
+            # Opened capture, from its overview and the file
+            if not isinstance(self.segment_index, CaptureSegments) or \
+                    self.segment_index.capture is not self.overview_capture:
+                self.segment_index = CaptureSegments(self.overview_capture, self.overview)
+            return self.segment_index
+        # Rebuilt when the displayed data changes (a new view per batch),
+        # kept while browsing a frozen or stopped view
+        if not isinstance(self.segment_index, SegmentIndex) or self.segment_index.values is not self.current_data:
+            self.segment_index = SegmentIndex(self.current_data, self.voltage_data)
+        return self.segment_index
+
+    def show_segment_table(self):
+        if self.segment_window is None or not self.segment_window.winfo_exists():
+            self.segment_window = tk.Toplevel(self.mainwindow)
+            self.segment_window.title("Marker segments")
+            self.segment_tree = ttk.Treeview(self.segment_window, columns=SEGMENT_COLUMNS,
+                                             show="headings", selectmode="none")
+            headings = ("Segment", "Duration (s)", "Mean (mA)", "Min (mA)", "Max (mA)",
+                        "Charge (C)", "Energy (J)")
+            for name, text in zip(SEGMENT_COLUMNS, headings):
+                self.segment_tree.heading(name, text=text)
+                self.segment_tree.column(name, width=90, anchor=tk.E)
+            ttk.Button(self.segment_window, text="Export range...",
+                       command=self.export_marker_range).pack(side=tk.BOTTOM, anchor=tk.E)
+            self.segment_tree.pack(fill=tk.BOTH, expand=True)
+        self.update_segment_rows()
+
+    def export_marker_range(self):
+        # Samples of the opened capture between the first and the last
+        # marker, written by export.py on a worker thread
+        capture = self.overview_capture
+        if capture is None:
+            messagebox.showerror("Error", "Open a capture file first.", parent=self.segment_window)
+            return
+        start = min(max(int(self.markers[0]), 0), capture.num_samples)
+        stop = min(max(int(self.markers[-1]), 0), capture.num_samples)
+        if stop <= start:
+            messagebox.showerror("Error", "The marker range is empty.", parent=self.segment_window)
+            return
+        path = filedialog.asksaveasfilename(parent=self.segment_window, title="Export range",
+                                            defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("NumPy", "*.npz"),
+                                                       ("HDF5", "*.h5"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+        from export import export
+
+        def run():
+            try:
+                rows = export(capture.path, path, start, stop)
+                self.status_queue.put(f"Exported {rows} samples to {path}")
+            except Exception as e:
+                self.status_queue.put(f"Export failed: {e}")
+
+        self.output_text.insert(tk.END, f"Exporting samples {start}..{stop} to {path}\n")
+        self.output_text.see(tk.END)
+        threading.Thread(target=run, daemon=True).start()
+
+    def update_segment_rows(self, rows=None):
+        # rows: segment indexes to refresh, None to rebuild the whole table
+        if self.segment_window is None or not self.segment_window.winfo_exists():
+            return
+        tree = self.segment_tree
+        if rows is None:
+            tree.delete(*tree.get_children())
+            rows = range(len(self.markers) - 1)
+            for i in rows:
+                tree.insert("", tk.END, iid=str(i))
+
+        if self.overview:
+            period = self.overview_capture.sample_period
+        else:
+            period = self.live_sample_period()
+        i_scale = report_units["current"][0]
+        v_scale = report_units["voltage"][0]
+        index = self.segments()
+        for i in rows:
+            if not 0 <= i < len(self.markers) - 1:
+                continue
+            values = [f"M{i + 1}-M{i + 2}"]
+            stats = index.stats(self.markers[i], self.markers[i + 1])
+            if stats:
+                values += [f"{stats['samples'] * period:.6f}",
+                           f"{stats['mean'] * i_scale:.3f}",
+                           f"{stats['min'] * i_scale:.3f}",
+                           f"{stats['max'] * i_scale:.3f}",
+                           # mA.s to C, V.mA.s to J
+                           f"{stats['sum'] * i_scale * period / 1000:.4e}",
+                           "" if stats["power_sum"] is None else
+                           f"{stats['power_sum'] * i_scale * v_scale * period / 1000:.4e}"]
+            tree.item(str(i), values=values)
 
     def update_voltage_waveform(self, voltage_data):
-        self.ax2.clear()
-        self.ax2.plot(voltage_data, color = "orange")
-        self.ax1.set_title("Volatge Waveform (V)")
-        self.ax1.set_xlabel("Sample")
-        self.ax1.set_ylabel("Voltage (mA)")
-        self.canvas2.draw()
+        if self.canvas2 is None:
+            return
 
-    def calculate_and_update_average(self):
-        if not hasattr(self, 'avg_current_entry'):
-            return  # Exit if avg_current_entry is not available
+        x, y = minmax_line(voltage_data[-MAX_DATA_SIZE:], PLOT_BINS)
+        self.voltage_plot = dict(VOLTAGE_LABELS, lines=[(x, y * report_units["voltage"][0], "orange")])
+        self.canvas2.show(self.voltage_plot)
 
-        x_min, x_max = int(self.marker1_pos), int(self.marker2_pos)
+    def update_channel_plot(self):
+        # Upper plot: the voltage or the extra channel chosen in the Channels window
+        name = self.settings_manager.read_value("plot_channel")
+        if name == "voltage":
+            self.update_voltage_waveform(self.voltage_data)
+            return
+        if self.canvas2 is None:
+            return
 
-        if x_min < 0:
-            x_min = 0
-        if x_max > len(self.current_data):
-            x_max = len(self.current_data)
+        history = self.channel_history.get(name)
+        data = history.latest(MAX_DATA_SIZE) if history else np.zeros(0, dtype=np.float32)
+        x, y = minmax_line(data, PLOT_BINS)
+        unit = channels[name][1]
+        self.voltage_plot = {"title": f"{name} waveform ({unit})" if unit else f"{name} waveform",
+                             "xlabel": "Sample", "ylabel": f"{name} ({unit})" if unit else name,
+                             "lines": [(x, y, "orange")]}
+        self.canvas2.show(self.voltage_plot)
+
+    def setup_rolling_view(self):
+        tree = self.treeview_rolling
+        columns = ("mean", "min", "max", "rms", "charge")
+        tree.config(columns=columns, show="tree headings")
+        tree.heading("#0", text="Window")
+        tree.column("#0", width=70, stretch=False)
+        for name in columns:
+            tree.heading(name, text=name.capitalize() + (" (C)" if name == "charge" else ""))
+            tree.column(name, width=60, anchor=tk.E, stretch=False)
+        tree.delete(*tree.get_children())
+        windows = self.rolling.windows if self.rolling else parse_windows(
+            self.settings_manager.read_value("rolling_windows"))
+        for name, symbol in (("current", "I"), ("voltage", "V")):
+            for seconds in windows:
+                tree.insert("", tk.END, iid=f"{name} {seconds}", text=f"{symbol} {format_window(seconds)}")
+
+    def update_rolling_view(self):
+        if self.rolling is None:
+            return
+        for name in ("current", "voltage"):
+            scale = report_units[name][0]
+            for seconds in self.rolling.windows:
+                stats = self.rolling.stats(name, seconds)
+                if stats is None:
+                    continue
+                values = [f"{stats[key] * scale:.3f}" for key in ("mean", "min", "max", "rms")]
+                # mA.s to C, no charge for the voltage
+                values.append(f"{stats['charge'] * scale / 1000:.3e}" if name == "current" else "")
+                self.treeview_rolling.item(f"{name} {seconds}", values=values)
 
-        selected_data = self.current_data[x_min:x_max]
+    def calculate_and_update_average(self):
+        if not hasattr(self, 'avg_current_entry'):
+            return  # Exit if avg_current_entry is not available
 
-        # Remove invalid values
-        selected_data = selected_data[np.isfinite(selected_data)]
+        # O(1) whatever the marker distance, from the segment index
+        stats = self.segments().stats(self.markers[0], self.markers[1])
 
-        if len(selected_data) > 0:
-            avg_current = np.mean(selected_data)
-            min_current = np.min(selected_data)
-            max_current = np.max(selected_data)
+        if stats:
+            scale = report_units["current"][0]
+            avg_current = stats["mean"] * scale
+            min_current = stats["min"] * scale
+            max_current = stats["max"] * scale
         else:
             avg_current = 0  # Or another appropriate value
             min_current = 0
             max_current = 0
 
+        self.show_statistics(avg_current, min_current, max_current)
+
+    def show_statistics(self, avg_current, min_current, max_current):
         self.avg_current_entry.config(state=tk.NORMAL)
         self.avg_current_entry.delete(0, tk.END)
         self.avg_current_entry.insert(0, f"{avg_current:.2f}")
@@ -527,24 +901,220 @@ class Power_Monitor:
         self.entry_max.insert(0, f"{max_current:.2f}")
         self.entry_max.config(state="readonly")
 
-    def execute_stop_measuring(self):
-        cmd = bytearray()
+    def open_capture_file(self):
+        if self.is_measuring == True:
+            return
+        self.jump_to_live()
+        if self.persistence:
+            self.toggle_persistence()
+
+        path = filedialog.askopenfilename(filetypes=[("Capture", "*.bin *.pmz"), ("All files", "*")])
+        if not path:
+            return
+        if self.overview_capture is not None and messagebox.askyesno(
+                "Compare", "Compare with the open capture?"):
+            self.open_compare_capture(path)
+            return
+
+        from capture_overview import load_overview
+        try:
+            # Built once (in parallel) then reloaded from the sidecar cache
+            self.overview = load_overview(path, self.event_threshold())
+            self.overview_capture = open_capture(path)
+        except Exception as e:
+            self.overview = None
+            messagebox.showerror("Error", str(e))
+            return
+
+        self.output_text.insert(tk.END, f"Open capture: {path}\n")
+        self.output_text.see(tk.END)
+
+        summary = self.overview.summary
+        if self.overview.info["threshold"] is not None:
+            self.output_text.insert(tk.END, f"Events >= {self.overview.info['threshold']:g} mA: "
+                                            f"{len(summary['events'])}\n")
+            self.output_text.see(tk.END)
+        if summary["samples"]:
+            self.show_statistics(summary["current_mean"], summary["current_min"], summary["current_max"])
+        self.xlim_stack = []
+        self.original_xlim = [0, max(self.overview.num_samples, 1)]
+        self.update_capture_view(self.original_xlim)
+
+    def event_threshold(self):
+        threshold = self.settings_manager.read_value("event_threshold")
+        return float(threshold) if threshold else None
+
+    def update_capture_view(self, xlim):
+        if self.canvas1 is None:
+            return
+
+        start = int(max(xlim[0], 0))
+        stop = int(min(xlim[1], self.overview.num_samples))
+
+        if stop - start <= MAX_DATA_SIZE:
+            # Zoomed in enough to plot the samples themselves
+            voltage_data, current_data = self.overview_capture.read(start, stop)
+            x = np.arange(start, start + len(current_data))
+            current = {"lines": [(x, current_data, "green")]}
+            voltage = {"lines": [(x, voltage_data, "orange")]}
+        else:
+            # Min/max envelope from the cached pyramid
+            from capture_overview import TOP_BINS
+            current, voltage = (
+                {"fills": [self.overview.window(name, start, stop, TOP_BINS)[:3] + (color,)]}
+                for name, color in (("current", "green"), ("voltage", "orange")))
+
+        if self.compare:
+            current, voltage = self.compare_scenes(current, start, stop)
+        self.current_plot = dict(CURRENT_LABELS, **current)
+        self.voltage_plot = dict(DIFFERENCE_LABELS if self.compare else VOLTAGE_LABELS, xlim=xlim, **voltage)
+        self.ax1.set_xlim(xlim)
+        self.show_current_plot()
+        self.canvas2.show(self.voltage_plot)
+
+    def open_compare_capture(self, path):
+        from capture_compare import align, compare
+        from capture_overview import load_overview
+        path_a = self.overview_capture.path
+        try:
+            overview = load_overview(path, self.event_threshold())
+            alignment = align(path_a, path, self.overview, overview)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.compare = {"capture": open_capture(path), "overview": overview, "offset": alignment["offset"]}
+        self.output_text.insert(tk.END, f"Compare: {path}, offset {alignment['offset']} samples "
+                                        f"({alignment['offset_s']:.6f} s), score {alignment['score']:.3f}\n")
+        self.output_text.see(tk.END)
+
+        overview_a, offset = self.overview, alignment["offset"]
+
+        def run():
+            # Statistics over the common part, reported when done
+            try:
+                result = compare(path_a, path, overview_a=overview_a, overview_b=overview, offset=offset)
+                self.status_queue.put("Compare B - A: " + ", ".join(
+                    f"{key} {value:.6g}" for key, value in result["delta"].items() if value is not None))
+            except Exception as e:
+                self.status_queue.put(f"Compare failed: {e}")
+        threading.Thread(target=run, daemon=True).start()
+        self.update_capture_view(self.ax1.get_xlim())
+
+    def compare_scenes(self, current, start, stop):
+        # B shifted onto the samples of A over the current, B - A below
+        from capture_compare import difference
+        from capture_overview import TOP_BINS
+        capture, overview, offset = self.compare["capture"], self.compare["overview"], self.compare["offset"]
+        first, last = max(start - offset, 0), max(stop - offset, 0)
+        if stop - start <= MAX_DATA_SIZE:
+            _, b = capture.read(first, last)
+            current["lines"].append((np.arange(first, first + len(b)) + offset, b, "blue"))
+            max_bins = MAX_DATA_SIZE
+        else:
+            x, mins, maxs, _ = overview.window("current", first, last, TOP_BINS)
+            current["fills"].append((x + offset, mins, maxs, "blue"))
+            max_bins = TOP_BINS
+        x, diff = difference(self.overview_capture, capture, self.overview, overview, offset,
+                             start, stop, max_bins)
+        return current, {"lines": [(x, diff, "red")]}
+
+    def close_capture_view(self):
+        self.overview = None
+        self.overview_capture = None
+        self.compare = None
+
+    def toggle_freeze(self):
+        if self.frozen_history:
+            self.jump_to_live()
+        else:
+            self.freeze_view()
+
+    def freeze_view(self):
+        if self.overview or len(self.current_history) == 0:
+            return
+
+        # The histories as they are become the frozen view (no copy), the
+        # acquisition carries on in the spare pair, seeded with the live window
+        if self.spare_history is None:
+            self.spare_history = (RingBuffer(HISTORY_SIZE, np.float32), RingBuffer(HISTORY_SIZE, np.float32))
+        self.frozen_history = (self.current_history, self.voltage_history)
+        self.current_history, self.voltage_history = self.spare_history
+        self.spare_history = None
+        for live, frozen in zip((self.current_history, self.voltage_history), self.frozen_history):
+            live.clear()
+            live.append(frozen.latest(MAX_DATA_SIZE))
+
+        self.current_data = self.frozen_history[0].snapshot()
+        self.voltage_data = self.frozen_history[1].snapshot()
+
+        # Keep the markers on the same samples, now indexed in the full history
+        offset = len(self.current_data) - len(self.current_history)
+        self.live_markers = list(self.markers)
+        self.markers = [marker + offset for marker in self.markers]
+        self.xlim_stack = []
+        self.original_xlim = [0, len(self.current_data)]
+        self.button_freeze.config(text="Jump to live")
+        self.output_text.insert(tk.END, f"View frozen at {len(self.current_data)} samples\n")
+        self.output_text.see(tk.END)
+        self.update_frozen_view([offset, len(self.current_data)])
+
+    def jump_to_live(self):
+        if not self.frozen_history:
+            return
+
+        self.spare_history = self.frozen_history
+        self.frozen_history = None
+        self.markers = self.live_markers
+        self.xlim_stack = []
+        self.button_freeze.config(text="Freeze")
+        self.current_data = self.current_history.latest(MAX_DATA_SIZE)
+        self.voltage_data = self.voltage_history.latest(MAX_DATA_SIZE)
+        self.update_voltage_waveform(self.voltage_data)
+        self.update_current_waveform(self.current_data)
+
+    def update_frozen_view(self, xlim):
+        if self.canvas1 is None:
+            return
+
+        start = int(max(xlim[0], 0))
+        stop = int(min(xlim[1], len(self.current_data)))
+
+        plots = []
+        for data, name, color in ((self.current_data, "current", "green"),
+                                  (self.voltage_data, "voltage", "orange")):
+            x, y = minmax_line(data[start:stop], PLOT_BINS)
+            plots.append({"lines": [(x + start, y * report_units[name][0], color)]})
 
+        self.current_plot = dict(CURRENT_LABELS, title=CURRENT_LABELS["title"] + " - frozen", **plots[0])
+        self.voltage_plot = dict(VOLTAGE_LABELS, title=VOLTAGE_LABELS["title"] + " - frozen",
+                                 xlim=xlim, **plots[1])
+        self.ax1.set_xlim(xlim)
+        self.update_marker_values()
+        self.calculate_and_update_average()
+        self.update_segment_rows()
+        self.show_current_plot()
+        self.canvas2.show(self.voltage_plot)
+
+    def execute_stop_measuring(self):
         if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
             messagebox.showerror("Error", "Please connect to a UART port first.")
             return
 
         try:
-            # Run command start measuring
-            cmd = bytearray([0x08, 0x00, 0x00, 0x00])
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            # Run command stop measuring
+            cmd = cmd_simple(CMD_STOP_MEASURE)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
             # We don't expect response OK after stop measure command
             # if response[0] != cmd[0] or response[1] != 0x01:
                 # messagebox.showerror("Error", "Device respone error")
                 # return
 
+            self.is_measuring = False
+            self.remember_link_config()
+
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
@@ -552,49 +1122,124 @@ class Power_Monitor:
 
         # Update the display to show markers even without current data
         self.is_measuring = False
-        self.update_current_waveform(self.current_data)
+        self.stop_capture()
+        if not self.frozen_history:
+            self.update_current_waveform(self.current_data)
 
     def execute_start_measuring(self):
-        cmd = bytearray()
-
         if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
             messagebox.showerror("Error", "Please connect to a UART port first.")
             return
 
         try:
-            # Run command start measuring
-            cmd = bytearray([0x07, 0x00, 0x00, 0x00])
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            # Run command start measuring, the receive thread decodes the new
+            # layout from the first read on
+            self.stream_layout = (self.sample_size, self.stream_mode(), self.channel_mask)
+            cmd = cmd_start_measure(self.stream_layout[1])
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
-            if response[0] != cmd[0] or response[1] != 0x01:
+            if not response_ok(cmd, response):
                 messagebox.showerror("Error", "Device respone error")
                 return
 
+            self.is_measuring = True
+            self.remember_link_config()
+
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
         self.is_measuring = True
+        self.close_capture_view()
+        self.rolling = RollingStats(self.live_sample_period(),
+                                    parse_windows(self.settings_manager.read_value("rolling_windows")))
+        self.setup_rolling_view()
+        self.setup_display_filter()
+        self.start_capture()
         self.output_text.see(tk.END)
 
+    def setup_display_filter(self):
+        self.display_filter = None
+        self.filtered_history = None
+        if self.settings_manager.read_value("filter_target") != "display":
+            return
+        chain = parse_filters(self.settings_manager.read_value("filter"))
+        if chain:
+            self.display_filter = chain
+            self.filtered_history = RingBuffer(HISTORY_SIZE, np.float32)
+
+    def start_capture(self):
+        capture_dir = self.settings_manager.read_value("capture_dir")
+        if not capture_dir:
+            return
+        os.makedirs(capture_dir, exist_ok=True)
+        codec = self.settings_manager.read_value("capture_codec")
+        name = time.strftime("capture_%Y%m%d_%H%M%S") + (".pmz" if codec else ".bin")
+        path = os.path.join(capture_dir, name)
+        names = channel_names(self.channel_mask)
+        if "voltage" not in names or "current" not in names:
+            self.output_text.insert(tk.END, "No capture, it needs the voltage and current channels\n")
+            return
+        meta = capture_meta(self.selected_convtime_key.get(),
+                            self.selected_avgnum_key.get(),
+                            self.selected_adcrange_key.get(),
+                            self.live_sample_size())
+        meta["sample_period"] = self.live_sample_period()
+        # Every streamed channel at full resolution, voltage and current too
+        extra = names if self.stream_mode() != STREAM_MODE_SCALED else []
+        for name in extra:
+            meta.setdefault("derived", {})[name] = {"source": name, "decimation": 1,
+                                                    "unit": channels[name][1]}
+        chain = None
+        if self.settings_manager.read_value("filter_target") == "capture":
+            chain = parse_filters(self.settings_manager.read_value("filter"))
+            if chain:
+                meta.setdefault("derived", {})["current_filtered"] = {
+                    "source": "current", "filter": chain.spec, "decimation": chain.decimation,
+                    "unit": report_units["current"][1]}
+        with self.capture_lock:
+            if codec:
+                from capture_compressed import CompressedCaptureWriter
+                self.capture_writer = CompressedCaptureWriter(path, meta, codec)
+            else:
+                self.capture_writer = CaptureWriter(path, meta)
+            if chain:
+                self.capture_filter = chain
+                self.derived_writer = DerivedWriter(path, "current_filtered")
+            self.channel_writers = {name: DerivedWriter(path, name) for name in extra}
+        self.output_text.insert(tk.END, f"Capture: {path}\n")
+
+    def stop_capture(self):
+        with self.capture_lock:
+            if self.capture_writer:
+                self.capture_writer.close()
+                self.capture_writer = None
+            if self.derived_writer:
+                self.derived_writer.close()
+                self.derived_writer = None
+                self.capture_filter = None
+            for writer in self.channel_writers.values():
+                writer.close()
+            self.channel_writers = {}
+
     def execute_adc_configuration(self):
-        cmd = bytearray()
+        if self.is_measuring:
+            # The receive thread decodes the report size of the running
+            # measurement, it takes a new one on the next start
+            messagebox.showerror("Error", "Stop measuring to change the configuration.")
+            return
         selected_conv_time = self.selected_convtime_key.get()
-        hex_value = conversion_times[selected_conv_time]
-        cmd.extend([0x02, 0x00, 0x00, 0x00]) # Command write config
-        cmd.append(hex_value) # added cnv_time
-        self.output_text.insert(tk.END, f"Selected Conversion Time: {selected_conv_time} (0x{hex_value:X})\n")
-
         selected_avg_num = self.selected_avgnum_key.get()
-        hex_value = average_num[selected_avg_num]
-        cmd.append(hex_value) # added avg_num
-        self.output_text.insert(tk.END, f"Selected Average Num: {selected_avg_num} (0x{hex_value:X})\n")
-
         selected_adc_range = self.selected_adcrange_key.get()
-        hex_value = adc_range[selected_adc_range]
-        cmd.append(hex_value) # added adc_range
-        cmd.append(0x01)      # added avg_alert
-        self.output_text.insert(tk.END, f"Selected Adc Range: {selected_adc_range} (0x{hex_value:X})\n")
+        # Command write config
+        cmd = cmd_write_config(selected_conv_time, selected_avg_num, selected_adc_range)
+        self.output_text.insert(tk.END, f"Selected Conversion Time: {selected_conv_time} "
+                                        f"(0x{conversion_times[selected_conv_time]:X})\n")
+        self.output_text.insert(tk.END, f"Selected Average Num: {selected_avg_num} "
+                                        f"(0x{average_num[selected_avg_num]:X})\n")
+        self.output_text.insert(tk.END, f"Selected Adc Range: {selected_adc_range} "
+                                        f"(0x{adc_range[selected_adc_range]:X})\n")
         self.output_text.insert(tk.END, f"Command: {cmd}\n")
 
         if not self.serial_port_cmd or not self.serial_port_cmd.is_open:
@@ -603,43 +1248,162 @@ class Power_Monitor:
 
         try:
             # Write adc config param command
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
-            if response[0] != cmd[0] or response[1] != 0x01:
+            if not response_ok(cmd, response):
                 messagebox.showerror("Error", "Device respone error")
                 return
 
             # Run command configure INA229
-            cmd = bytearray([0x04, 0x00, 0x00, 0x00])
-            self.serial_port_cmd.write(cmd)
-            response = self.serial_port_cmd.read(16)
+            cmd = cmd_simple(CMD_CONFIGURE_INA229)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
             self.output_text.insert(tk.END, f"Response: {response}\n")
-            if response[0] != cmd[0] or response[1] != 0x01:
+            if not response_ok(cmd, response):
                 messagebox.showerror("Error", "Device respone error")
                 return
 
+            # Request the report size, the device answers with the active one
+            # (older firmware doesn't know the command and keeps the default)
+            cmd = cmd_report_size(int(self.settings_manager.read_value("report_size")))
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                response = self.serial_port_cmd.read(RESPONSE_SIZE)
+            self.sample_size = response_report_size(response) or DATA_RPT_SAMPLE_SIZE
+            self.output_text.insert(tk.END, f"Report size: {self.sample_size} samples\n")
+
+            self.send_channels()
+            self.remember_link_config()
+
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
         self.output_text.see(tk.END)
 
+    def stream_mode(self):
+        # Voltage + current stream the "stream_mode" setting, scaled reports
+        # (all firmware) or packed raw codes scaled here
+        if self.channel_mask != DEFAULT_CHANNELS:
+            return STREAM_MODE_CHANNELS
+        return stream_modes[self.settings_manager.read_value("stream_mode")]
+
+    def live_sample_size(self):
+        # Samples per channel in each report
+        if self.stream_mode() == STREAM_MODE_CHANNELS:
+            return channel_sample_size(self.sample_size, self.channel_mask)
+        if self.stream_mode() == STREAM_MODE_PACKED:
+            return packed_sample_size(self.sample_size)
+        return self.sample_size
+
+    def live_sample_period(self):
+        # The die temperature adds a conversion to every sample
+        return sample_period(self.selected_convtime_key.get(), self.selected_avgnum_key.get(),
+                             bool(self.channel_mask & channels["dietemp"][0]))
+
+    def send_channels(self):
+        mask = channel_mask(self.settings_manager.read_value("channels"))
+        if mask == self.channel_mask == DEFAULT_CHANNELS:
+            return      # Firmware without CMD_SET_CHANNELS stays usable
+        cmd = cmd_channels(mask)
+        with self.cmd_lock:
+            self.serial_port_cmd.write(cmd)
+            response = self.serial_port_cmd.read(RESPONSE_SIZE)
+        if not response_ok(cmd, response):
+            raise IOError(f"Device rejected channels {', '.join(channel_names(mask))}")
+        self.channel_mask = response_channels(response) or mask
+        self.output_text.insert(tk.END, f"Channels: {', '.join(channel_names(self.channel_mask))}\n")
+
+    def select_channels(self):
+        if self.is_measuring:
+            messagebox.showerror("Error", "Stop measuring to change the channels.")
+            return
+        window = tk.Toplevel(self.mainwindow)
+        window.title("Channels")
+        selected = channel_names(channel_mask(self.settings_manager.read_value("channels")))
+        checks = {name: tk.BooleanVar(value=name in selected) for name in channels}
+        plot = tk.StringVar(value=self.settings_manager.read_value("plot_channel"))
+        for row, (name, (bit, unit)) in enumerate(channels.items()):
+            ttk.Checkbutton(window, text=f"{name} ({unit})" if unit else name,
+                            variable=checks[name]).grid(row=row, column=0, sticky=tk.W, padx=5)
+            # The current has the lower plot, any other channel can go on the upper one
+            if name != "current":
+                ttk.Radiobutton(window, text="Upper plot", value=name,
+                                variable=plot).grid(row=row, column=1, sticky=tk.W, padx=5)
+
+        def apply():
+            names = [name for name in channels if checks[name].get()]
+            if not names:
+                messagebox.showerror("Error", "Select at least one channel.", parent=window)
+                return
+            if plot.get() not in names:
+                messagebox.showerror("Error", f"{plot.get()} is plotted but not selected.", parent=window)
+                return
+            self.settings_manager.update({"channels": ",".join(names), "plot_channel": plot.get()})
+            window.destroy()
+            if self.serial_port_cmd and self.serial_port_cmd.is_open:
+                try:
+                    self.send_channels()
+                    self.remember_link_config()
+                except Exception as e:
+                    messagebox.showerror("Error", str(e))
+            self.output_text.see(tk.END)
+            self.update_channel_plot()
+
+        ttk.Button(window, text="Apply", command=apply).grid(row=len(channels), column=1, sticky=tk.E,
+                                                             padx=5, pady=5)
+
     def execute_settings_configuration(self):
         self.execute_adc_configuration()
         self.on_set_vbat_value()
         self.on_change_vbat_enable()
 
+    def find_link_ports(self):
+        # (cmd, data) port names, looked up by VID:PID as names change on replug
+        usb_id = self.settings_manager.read_value("usb_id")
+        if usb_id:
+            ports = find_ports(*parse_usb_id(usb_id))
+            if ports:
+                return ports
+        return self.link_ports
+
+    def open_ports(self, port_cmd, port_data):
+        import serial
+        with self.cmd_lock:
+            self.serial_port_cmd = serial.Serial(port_cmd, baudrate=self.link_baudrate, timeout=1)
+            self.serial_port_data = serial.Serial(port_data, baudrate=self.link_baudrate, timeout=1)
+
+    def close_ports(self):
+        with self.cmd_lock:
+            for port in (self.serial_port_cmd, self.serial_port_data):
+                if port and port.is_open:
+                    try:
+                        port.flushInput()
+                        port.flushOutput()
+                    except Exception:
+                        pass    # The device may be gone already
+                    port.close()
+
     def connect(self):
-        port_cmd = self.entry_port_cmd.get()
-        port_data = self.entry_port_data.get()
-        baudrate = self.baudrate_entry.get()
+        self.link_ports = (self.entry_port_cmd.get(), self.entry_port_data.get())
         try:
-            self.serial_port_cmd = serial.Serial(port_cmd, baudrate=int(baudrate), timeout=1)
-            self.serial_port_data = serial.Serial(port_data, baudrate=int(baudrate), timeout=1)
+            self.link_baudrate = int(self.baudrate_entry.get())
+            port_cmd, port_data = self.find_link_ports()
+            if (port_cmd, port_data) != self.link_ports:
+                self.output_text.insert(tk.END, f"Found device on {port_cmd} / {port_data}\n")
+                self.entry_port_cmd.delete(0, tk.END)
+                self.entry_port_cmd.insert(0, port_cmd)
+                self.entry_port_data.delete(0, tk.END)
+                self.entry_port_data.insert(0, port_data)
+                self.link_ports = (port_cmd, port_data)
+            self.open_ports(port_cmd, port_data)
             # Configure ADC/VBAT following the previous settings
             self.execute_settings_configuration()
 
             # messagebox.showinfo("Connection", f"Connected to {port_cmd} at {baudrate} baud")
+            self.stream_layout = (self.sample_size, self.stream_mode(), self.channel_mask)
             self.is_receiving = True
             self.receive_thread = threading.Thread(target=self.receive_data)
             self.receive_thread.start()
@@ -647,35 +1411,43 @@ class Power_Monitor:
             messagebox.showerror("Connection Error", str(e))
 
     def disconnect(self):
+        self.stop_vbat_profile()
         self.is_receiving = False
         if self.receive_thread:
             self.receive_thread.join()
-        if self.serial_port_cmd and self.serial_port_cmd.is_open:
-            self.serial_port_cmd.flushInput()
-            self.serial_port_cmd.flushOutput()
-            self.serial_port_cmd.close()
-            # messagebox.showinfo("Disconnection", "Disconnected from the UART cmd port")
-        if self.serial_port_data and self.serial_port_data.is_open:
-            self.serial_port_data.flushInput()
-            self.serial_port_data.flushOutput()
-            self.serial_port_data.close()
-            # messagebox.showinfo("Disconnection", "Disconnected from the UART data port")
+        self.close_ports()
 
     def clear_output(self):
         self.output_text.delete('1.0', tk.END)
 
     def clear_waveform(self):
         if self.is_measuring == False:
-            self.current_data = np.array([])
-            self.voltage_data = np.array([])
+            self.close_capture_view()
+            self.jump_to_live()
+            if self.persistence:
+                self.persistence.reset()
+            if self.display_filter:
+                self.display_filter.reset()
+                self.filtered_history.clear()
+            self.current_history.clear()
+            self.voltage_history.clear()
+            self.current_data = self.current_history.latest(MAX_DATA_SIZE)
+            self.voltage_data = self.voltage_history.latest(MAX_DATA_SIZE)
+            for history in self.channel_history.values():
+                history.clear()
             self.data_queue_voltage.queue.clear()
             self.data_queue_current.queue.clear()
+            self.data_queue_channels.queue.clear()
             self.update_current_waveform(self.current_data)
-            self.update_voltage_waveform(self.voltage_data)
+            self.update_channel_plot()
 
     def close(self):
         self.store_settings()
         self.disconnect()
+        self.stop_capture()
+        for canvas in (self.canvas1, self.canvas2):
+            if canvas:
+                canvas.stop()
         self.mainwindow.destroy()
 
     def send_data(self):
@@ -688,53 +1460,197 @@ class Power_Monitor:
         try:
             # Convert space-separated hex input to bytes
             data = binascii.unhexlify(hex_input.replace(" ", ""))
-            self.serial_port_cmd.write(data)
+            with self.cmd_lock:
+                self.serial_port_cmd.write(data)
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
     def receive_data(self):
+        # Reports decoded with signature resync, a stray byte only drops the
+        # report it falls in. The decoder follows self.stream_layout, the
+        # channels and report size change between measurements.
+        layout = None
         while self.is_receiving:
             try:
-                if self.serial_port_data.in_waiting >= (4 + 4 + 4 * DATA_RPT_SAMPLE_SIZE * 2):
-                    data = self.serial_port_data.read(4 + 4 + 4 * DATA_RPT_SAMPLE_SIZE * 2)
-
-                    # Unpack the received data
-                    sign, package_id = struct.unpack('<II', data[:8])
-
-                    # Check the signature
-                    if sign == SIGNATURE:
-                        voltage_data = struct.unpack('<' + 'i' * DATA_RPT_SAMPLE_SIZE, data[8:8 + 4 * DATA_RPT_SAMPLE_SIZE])
-                        current_data = struct.unpack('<' + 'i' * DATA_RPT_SAMPLE_SIZE, data[8 + 4 * DATA_RPT_SAMPLE_SIZE:])
-                        #print(f"Voltage: {voltage}\nCurrent: {current}")  # Debug output
-                        self.data_queue_voltage.put(voltage_data)
-                        self.data_queue_current.put(current_data)
+                if layout != self.stream_layout:
+                    layout = self.stream_layout
+                    decoder = ReportDecoder(*layout)
+                sample_size, stream_mode, _ = layout
+                # Blocks until at least one report (or the port timeout), then
+                # takes everything waiting at once
+                port = self.serial_port_data
+                data = port.read(max(port.in_waiting, report_size(sample_size)))
+                if not data:
+                    continue
+                records = decoder.feed(data)
+                if len(records) == 0:
+                    continue
+                extra = {}
+                if stream_mode == STREAM_MODE_SCALED:
+                    voltage, current = records["voltage"].reshape(-1), records["current"].reshape(-1)
+                else:
+                    # Packed or channel codes scaled at full resolution, the
+                    # capture file keeps the scaled report layout the analysis
+                    # tools read
+                    extra = channel_arrays(records)
+                    voltage, current = extra.get("voltage"), extra.get("current")
+                    if voltage is not None and current is not None:
+                        records = scaled_records(records["id"], stored_values("voltage", voltage),
+                                                 stored_values("current", current))
+                if voltage is not None:
+                    self.data_queue_voltage.put(voltage)
+                if current is not None:
+                    self.data_queue_current.put(current)
+                    counter = self.charge_counter
+                    if counter:
+                        counter.append(current)
+                others = {name: values for name, values in extra.items() if name not in ("voltage", "current")}
+                if others:
+                    self.data_queue_channels.put(others)
+                with self.capture_lock:
+                    if self.capture_writer:
+                        self.capture_writer.write(records.tobytes())
+                    if self.derived_writer:
+                        filtered = self.capture_filter.process(current)
+                        self.derived_writer.write(filtered * report_units["current"][0])
+                    for name, writer in self.channel_writers.items():
+                        writer.write(extra[name])
             except Exception as e:
-                self.is_receiving = False
-                break
-
-            time.sleep(0.1)
+                if not self.is_receiving or not self.recover_link(e):
+                    self.is_receiving = False
+                    break
+                # Bytes buffered before the drop don't continue on the new link
+                layout = None
+
+    def recover_link(self, error):
+        # Receive thread: wait for the device to come back, send the last
+        # configuration again and go on streaming into the same capture,
+        # the interruption is recorded in its meta["gaps"]
+        timeout = float(self.settings_manager.read_value("reconnect_timeout"))
+        config = self.link_config
+        if timeout <= 0 or config is None:
+            self.status_queue.put(f"Link lost: {error}")
+            return False
+        lost = time.time()
+        deadline = time.monotonic() + timeout
+        self.status_queue.put(f"Link lost ({error}), reconnecting...")
+        self.close_ports()
+        while self.is_receiving and time.monotonic() < deadline:
+            time.sleep(RECONNECT_INTERVAL)
+            try:
+                self.open_ports(*self.find_link_ports())
+                self.restore_device(config)
+            except Exception:
+                self.close_ports()
+                continue
+            with self.capture_lock:
+                if self.capture_writer:
+                    self.capture_writer.mark_gap(lost, time.time() - lost)
+            self.status_queue.put(f"Link restored after {time.time() - lost:.1f} s")
+            return True
+        self.status_queue.put(f"Link lost, no device after {timeout:g} s")
+        return False
+
+    def restore_device(self, config):
+        def command(cmd):
+            with self.cmd_lock:
+                self.serial_port_cmd.write(cmd)
+                return self.serial_port_cmd.read(RESPONSE_SIZE)
+
+        for cmd in (cmd_write_config(config["conv_time"], config["avg_num"], config["adc_range"]),
+                    cmd_simple(CMD_CONFIGURE_INA229),
+                    cmd_set_vbat(config["vbat"]),
+                    cmd_vbat_output(config["vbat_ena"])):
+            if not response_ok(cmd, command(cmd)):
+                raise IOError(f"Device respone error to 0x{cmd[0]:02X}")
+        # The capture goes on with the same report layout
+        sample_size = response_report_size(command(cmd_report_size(config["report_size"])))
+        if (sample_size or DATA_RPT_SAMPLE_SIZE) != self.sample_size:
+            raise IOError(f"Device report size {sample_size} != {self.sample_size}")
+        if config["channels"] != DEFAULT_CHANNELS:
+            cmd = cmd_channels(config["channels"])
+            response = command(cmd)
+            if (not response_ok(cmd, response) or
+                    (response_channels(response) or config["channels"]) != config["channels"]):
+                raise IOError("Device respone error to the channel selection")
+        if config["measuring"]:
+            self.serial_port_data.reset_input_buffer()
+            cmd = cmd_start_measure(self.stream_layout[1])
+            if not response_ok(cmd, command(cmd)):
+                raise IOError("Device respone error to start measure")
+
+    def remember_link_config(self):
+        # What recover_link sends again, saved on the Tk thread once the device
+        # took it; the report size is the one the device answered with
+        self.link_config = {
+            "conv_time":   self.selected_convtime_key.get(),
+            "avg_num":     self.selected_avgnum_key.get(),
+            "adc_range":   self.selected_adcrange_key.get(),
+            "report_size": self.sample_size,
+            "vbat":        int(float(self.scale_vbat.get())),
+            "vbat_ena":    bool(self.check_var.get()),
+            "channels":    self.channel_mask,
+            "measuring":   self.is_measuring
+        }
 
     def update_waveform(self):
-        # Voltage data dequeue processing
+        # Messages of the receive thread
+        try:
+            while True:
+                self.output_text.insert(tk.END, self.status_queue.get_nowait() + "\n")
+                self.output_text.see(tk.END)
+        except queue.Empty:
+            pass
+
+        # Voltage data dequeue processing, redraw once per batch
+        received = False
         try:
             while True:
-                voltage_data = self.data_queue_voltage.get_nowait()
-                self.voltage_data = np.append(self.voltage_data, voltage_data)
-                if len(self.voltage_data) > MAX_DATA_SIZE:
-                    self.voltage_data = self.voltage_data[-MAX_DATA_SIZE:]
+                batch = self.data_queue_voltage.get_nowait()
+                self.voltage_history.append(batch)
+                if self.rolling:
+                    self.rolling.append("voltage", batch)
+                received = True
+        except queue.Empty:
+            pass
+        # Keep appending while the view is frozen, but leave the display alone
+        if received and not self.frozen_history:
+            self.voltage_data = self.voltage_history.latest(MAX_DATA_SIZE)
+            if self.settings_manager.read_value("plot_channel") == "voltage":
                 self.update_voltage_waveform(self.voltage_data)
+        # Extra channels
+        received = False
+        try:
+            while True:
+                for name, batch in self.data_queue_channels.get_nowait().items():
+                    if name not in self.channel_history:
+                        self.channel_history[name] = RingBuffer(HISTORY_SIZE, np.float32)
+                    self.channel_history[name].append(batch)
+                received = True
         except queue.Empty:
             pass
+        if received and not self.frozen_history and self.settings_manager.read_value("plot_channel") != "voltage":
+            self.update_channel_plot()
         # Current data dequeue processing
+        received = False
         try:
             while True:
-                current_data = self.data_queue_current.get_nowait()
-                self.current_data = np.append(self.current_data, current_data)
-                if len(self.current_data) > MAX_DATA_SIZE:
-                    self.current_data = self.current_data[-MAX_DATA_SIZE:]
-                self.update_current_waveform(self.current_data)
+                batch = self.data_queue_current.get_nowait()
+                self.current_history.append(batch)
+                if self.persistence:
+                    self.persistence.append(batch)
+                if self.rolling:
+                    self.rolling.append("current", batch)
+                if self.display_filter:
+                    self.filtered_history.append(self.display_filter.process(batch))
+                received = True
         except queue.Empty:
             pass
+        if received:
+            self.update_rolling_view()
+        if received and not self.frozen_history:
+            self.current_data = self.current_history.latest(MAX_DATA_SIZE)
+            self.update_current_waveform(self.current_data)
 
         self.mainwindow.after(WAVEFORM_UPDATE_INTERVAL, self.update_waveform)
 
@@ -742,5 +1658,9 @@ class Power_Monitor:
         self.mainwindow.mainloop()
 
 if __name__ == "__main__":
-    app = Power_Monitor()
+    import argparse
+    parser = argparse.ArgumentParser(description="Power monitor")
+    parser.add_argument("--profile", default=None, help="settings.ini profile (device / test setup)")
+    args = parser.parse_args()
+    app = Power_Monitor(profile=args.profile)
     app.run()
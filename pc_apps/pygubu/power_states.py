@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Power state segmentation: every current sample is classified into a
+# discrete state (sleep, idle, active, tx, ...) by ascending thresholds, given
+# or fitted with a 1-D k-means on a log histogram of the stream, and the
+# time, charge and transitions per state are accumulated. Only the histogram
+# and the counters are kept, so it runs live on the stream broker or over a
+# multi-hour capture read chunk by chunk.
+#
+#   python power_states.py capture.bin --thresholds 0.05,1,20
+#   python power_states.py --stream 127.0.0.1:5025 --states 4 --interval 5
+#
+# With k-means the first REFIT_SAMPLES samples are held back until the first
+# fit, then the thresholds are refitted every REFIT_SAMPLES samples; the
+# samples already counted keep the state they were given.
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from filters import parse_filters
+
+DEFAULT_NAMES = ("sleep", "idle", "active", "tx")
+HIST_BINS = 512
+HIST_MIN = 1e-4            # |current| histogram range [mA], log spaced
+HIST_MAX = 1e4
+REFIT_SAMPLES = 1 << 16
+KMEANS_ITERATIONS = 50
+SEED_QUANTILE = 0.001      # k-means seeds span the histogram without its outliers
+CHUNK_SAMPLES = 1 << 20    # Samples per capture read
+
+def state_names(count, names=None):
+    if names:
+        if len(names) != count:
+            raise ValueError(f"{count} states need {count} names")
+        return list(names)
+    return list(DEFAULT_NAMES) if count == len(DEFAULT_NAMES) else [f"state{i}" for i in range(count)]
+
+class StateClassifier:
+    def __init__(self, period, thresholds=None, states=4, names=None, prefilter=None):
+        # thresholds: ascending bounds between states [mA], None to fit
+        # `states` states with k-means. prefilter: filters.FilterChain
+        # applied before classifying (e.g. a median against noise).
+        self.period = period
+        self.fixed = thresholds is not None
+        self.thresholds = np.asarray(sorted(thresholds), dtype=np.float64) if self.fixed else None
+        count = len(self.thresholds) + 1 if self.fixed else states
+        if count < 2:
+            raise ValueError("At least two power states are needed")
+        self.names = state_names(count, names)
+        self.centers = None
+        self.prefilter = prefilter
+        self.log_lo = np.log10(HIST_MIN)
+        self.log_width = (np.log10(HIST_MAX) - self.log_lo) / HIST_BINS
+        self.histogram = np.zeros(HIST_BINS, dtype=np.int64)
+        self.samples = 0
+        self.unfitted = 0            # Samples since the last fit
+        self.time = np.zeros(count, dtype=np.int64)        # Samples per state
+        self.charge = np.zeros(count)                      # sum(current) per state [mA]
+        self.transitions = np.zeros((count, count), dtype=np.int64)
+        self.last_state = None
+        self.warmup = []             # Samples held back until the first k-means fit
+
+    def fit(self):
+        # Weighted Lloyd's iterations on the log histogram, seeded evenly over
+        # the occupied range: quantile seeds would all land in the dominant
+        # (usually sleep) state and never leave it
+        weights = self.histogram.astype(np.float64)
+        if weights.sum() == 0:
+            return
+        count = len(self.names)
+        x = self.log_lo + (np.arange(HIST_BINS) + 0.5) * self.log_width
+        cdf = np.cumsum(weights) / weights.sum()
+        lo, hi = x[np.minimum(np.searchsorted(cdf, [SEED_QUANTILE, 1 - SEED_QUANTILE]), HIST_BINS - 1)]
+        centers = np.linspace(lo, hi, count)
+        for _ in range(KMEANS_ITERATIONS):
+            label = np.searchsorted((centers[:-1] + centers[1:]) / 2, x)
+            total = np.bincount(label, weights, minlength=count)
+            moments = np.bincount(label, weights * x, minlength=count)
+            fitted = np.sort(np.where(total > 0, moments / np.maximum(total, 1e-300), centers))
+            if np.allclose(fitted, centers):
+                break
+            centers = fitted
+        self.centers = 10 ** centers
+        self.thresholds = 10 ** ((centers[:-1] + centers[1:]) / 2)
+        self.unfitted = 0
+
+    def append(self, current):
+        # current: new samples [mA], any length
+        current = np.asarray(current, dtype=np.float64)
+        if self.prefilter:
+            current = self.prefilter.process(current)
+        if len(current) == 0:
+            return
+
+        level = (np.log10(np.maximum(np.abs(current), HIST_MIN)) - self.log_lo) / self.log_width
+        self.histogram += np.bincount(np.clip(level.astype(np.int64), 0, HIST_BINS - 1), minlength=HIST_BINS)
+        self.samples += len(current)
+        self.unfitted += len(current)
+        if self.thresholds is None:
+            self.warmup.append(current)
+            if self.unfitted >= REFIT_SAMPLES:
+                self.flush()
+            return
+        if not self.fixed and self.unfitted >= REFIT_SAMPLES:
+            self.fit()
+        self.classify(current)
+
+    def flush(self):
+        # Fit on the samples held back so far and classify them
+        if self.warmup:
+            self.fit()
+            warmup, self.warmup = self.warmup, []
+            for current in warmup:
+                self.classify(current)
+
+    def classify(self, current):
+        count = len(self.names)
+        states = np.searchsorted(self.thresholds, current, side="right")
+        self.time += np.bincount(states, minlength=count)
+        self.charge += np.bincount(states, current, minlength=count)
+
+        # Transitions, including the one across the batch boundary
+        if self.last_state is not None:
+            states = np.concatenate(([self.last_state], states))
+        changed = np.flatnonzero(states[1:] != states[:-1])
+        pairs = states[changed] * count + states[changed + 1]
+        self.transitions += np.bincount(pairs, minlength=count * count).reshape(count, count)
+        self.last_state = states[-1]
+
+    def report(self):
+        self.flush()
+        duration = self.samples * self.period
+        bounds = [None] + ([] if self.thresholds is None else list(self.thresholds)) + [None]
+        states = []
+        for i, name in enumerate(self.names):
+            seconds = self.time[i] * self.period
+            states.append({
+                "name": name,
+                "low_mA": None if bounds[i] is None else float(bounds[i]),
+                "high_mA": None if bounds[i + 1] is None else float(bounds[i + 1]),
+                "center_mA": None if self.centers is None else float(self.centers[i]),
+                "time_s": float(seconds),
+                "fraction": seconds / duration if duration else 0.0,
+                "mean_mA": float(self.charge[i] / self.time[i]) if self.time[i] else 0.0,
+                "charge_C": float(self.charge[i]) * self.period / 1000
+            })
+        total = int(self.transitions.sum())
+        return {
+            "duration_s": duration,
+            "samples": self.samples,
+            "thresholds_mA": None if self.thresholds is None else [float(t) for t in self.thresholds],
+            "states": states,
+            "transitions": total,
+            "transitions_per_s": total / duration if duration else 0.0,
+            "transition_counts": {a: {b: int(self.transitions[i, j])
+                                      for j, b in enumerate(self.names) if i != j}
+                                  for i, a in enumerate(self.names)}
+        }
+
+def classify_capture(path, classifier, chunk_samples=CHUNK_SAMPLES):
+    from capture import open_capture, to_float
+    capture = open_capture(path)
+    for start in range(0, capture.num_samples, chunk_samples):
+        _, current = capture.read(start, start + chunk_samples)
+        classifier.append(to_float(capture.meta, "current", current))
+    return classifier.report()
+
+def classify_stream(address, classifier, interval, out=sys.stdout):
+    from protocol import channel_arrays
+    from stream_server import StreamClient
+    client = StreamClient(tcp=address)
+    next_report = time.monotonic() + interval
+    for header, records in client:
+        current = channel_arrays(records).get("current")
+        if current is not None:
+            classifier.append(current)
+        if time.monotonic() >= next_report:
+            next_report += interval
+            json.dump(classifier.report(), out)
+            out.write("\n")
+            out.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time, charge and transitions per power state")
+    parser.add_argument("capture", nargs="?", help="capture file (with its .json sidecar)")
+    parser.add_argument("--stream", default=None, help="stream_server.py TCP address, instead of a capture")
+    parser.add_argument("--thresholds", default=None, help="ascending state bounds [mA], e.g. 0.05,1,20")
+    parser.add_argument("--states", type=int, default=4, help="states fitted by k-means without --thresholds")
+    parser.add_argument("--names", default=None, help="state names, e.g. sleep,idle,active,tx")
+    parser.add_argument("--filter", default="", help="filters.py chain applied first, e.g. median:5")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between live reports")
+    parser.add_argument("--conv-time", default="280uS")
+    parser.add_argument("--avg-num", default="AVG_NUM_1")
+    parser.add_argument("--dietemp", action="store_true",
+                        help="the stream includes the die temperature channel")
+    args = parser.parse_args(argv)
+
+    thresholds = [float(t) for t in args.thresholds.split(",")] if args.thresholds else None
+    names = args.names.split(",") if args.names else None
+    prefilter = parse_filters(args.filter)
+    if prefilter.decimation != 1:
+        parser.error("decimating filters change the sample period, use boxcar/iir/median")
+
+    if args.stream:
+        from protocol import sample_period
+        from stream_server import parse_address
+        classifier = StateClassifier(sample_period(args.conv_time, args.avg_num, args.dietemp), thresholds,
+                                     args.states, names, prefilter)
+        try:
+            classify_stream(parse_address(args.stream), classifier, args.interval)
+        except KeyboardInterrupt:
+            pass
+        result = classifier.report()
+    elif args.capture:
+        from capture import read_meta
+        classifier = StateClassifier(read_meta(args.capture)["sample_period"], thresholds,
+                                     args.states, names, prefilter)
+        result = classify_capture(args.capture, classifier)
+    else:
+        parser.error("a capture file or --stream is needed")
+    json.dump(result, sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
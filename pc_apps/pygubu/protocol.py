@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Wire format shared by the PC tools (see cmd.h and ina229.h in the firmware)
+
+import numpy as np
+
+SIGNATURE = 0x87654321
+DATA_RPT_SAMPLE_SIZE = 63  # Default size of the current and voltage arrays
+MIN_SAMPLE_SIZE = 8        # Report sizes accepted by CMD_SET_REPORT_SIZE
+MAX_SAMPLE_SIZE = 1023
+REPORT_HEADER_SIZE = 4 + 4 # sign + id
+
+# Packed stream mode (ina229_packed_report_t): raw 20-bit codes, scaled on the PC
+PACKED_SIGNATURE = 0x87654322
+PACKED_HEADER_SIZE = 4 + 4 + 4 + 4 # sign + id + current_lsb + vbus_lsb
+PACKED_SAMPLE_BYTES = 5    # One 40-bit word: VBUS code [19:0], CURRENT code [39:20]
+
+# Channel stream mode (ina229_channel_report_t): selected channels, raw codes
+CHANNEL_SIGNATURE = 0x87654323
+CHANNEL_HEADER_SIZE = 4 + 4 + 2 + 2 + 4 + 4 + 4 # sign + id + channels + samples + 3 LSBs
+
+STREAM_MODE_SCALED   = 0x00
+STREAM_MODE_PACKED   = 0x01
+STREAM_MODE_CHANNELS = 0x02
+
+stream_modes = {
+    "scaled"   : STREAM_MODE_SCALED,
+    "packed"   : STREAM_MODE_PACKED,
+    "channels" : STREAM_MODE_CHANNELS
+}
+
+# ina229_channel_t, in report order: name -> (mask bit, unit)
+channels = {
+    "voltage"   : (0x01, "V"),
+    "current"   : (0x02, "mA"),
+    "vshunt"    : (0x04, "mV"),
+    "dietemp"   : (0x08, "degC"),
+    "power"     : (0x10, "mW"),
+    "diag_alrt" : (0x20, "")
+}
+DEFAULT_CHANNELS = 0x03    # voltage + current
+DIETEMP_LSB = 7.8125e-3    # [degC]
+
+conversion_times = {
+    "280uS": 0x3,
+    "540uS": 0x4,
+    "1052uS": 0x5,
+    "2074uS": 0x6,
+    "4120uS": 0x7
+}
+
+average_num = {
+    "AVG_NUM_1"    : 0x00,
+    "AVG_NUM_4"    : 0x01,
+    "AVG_NUM_16"   : 0x02,
+    "AVG_NUM_64"   : 0x03,
+    "AVG_NUM_128"  : 0x04,
+    "AVG_NUM_256"  : 0x05,
+    "AVG_NUM_512"  : 0x06,
+    "AVG_NUM_1024" : 0x07
+}
+
+adc_range = {
+    "RANGE_0"  : 0x00,
+    "RANGE_1"  : 0x01
+}
+
+# Current full scale [mA] per adc range (163.84mV or 40.96mV over 50mOhm)
+current_full_scale = {
+    "RANGE_0"  : 3276.8,
+    "RANGE_1"  : 819.2
+}
+
+# Scale and unit of the int32 values of scaled reports (and of raw captures):
+# value * scale = quantity in unit. Everything is stored as int32 and only
+# converted to float when displayed.
+report_units = {
+    "voltage" : (1.0, "V"),
+    "current" : (1.0, "mA")
+}
+
+def report_size(sample_size=DATA_RPT_SAMPLE_SIZE):
+    return REPORT_HEADER_SIZE + 4 * sample_size * 2
+
+def report_dtype(sample_size=DATA_RPT_SAMPLE_SIZE):
+    # ina229_data_report_t
+    return np.dtype([
+        ("sign", "<u4"),
+        ("id", "<u4"),
+        ("voltage", "<i4", (sample_size,)),
+        ("current", "<i4", (sample_size,))
+    ])
+
+def packed_sample_size(sample_size=DATA_RPT_SAMPLE_SIZE):
+    # A packed report is as long as the scaled one, 99 samples for the default 63
+    return (report_size(sample_size) - PACKED_HEADER_SIZE) // PACKED_SAMPLE_BYTES
+
+def packed_report_dtype(sample_size=DATA_RPT_SAMPLE_SIZE):
+    # ina229_packed_report_t, trailing padding included in the itemsize
+    return np.dtype({
+        "names": ["sign", "id", "current_lsb", "vbus_lsb", "samples"],
+        "formats": ["<u4", "<u4", "<f4", "<f4",
+                    ("u1", (packed_sample_size(sample_size) * PACKED_SAMPLE_BYTES,))],
+        "offsets": [0, 4, 8, 12, PACKED_HEADER_SIZE],
+        "itemsize": report_size(sample_size)
+    })
+
+def unpack_codes(records):
+    # (vbus, current) int32 raw codes of shape (reports, samples per report)
+    b = records["samples"].reshape(len(records), -1 if len(records) else 0, PACKED_SAMPLE_BYTES)
+    word = b[..., 0].astype(np.int64)
+    for i in range(1, PACKED_SAMPLE_BYTES):
+        word |= b[..., i].astype(np.int64) << (8 * i)
+    vbus = (word & 0xFFFFF).astype(np.int32)
+    current = (word >> 20).astype(np.int32)
+    # Sign extend the 20-bit two's complement codes
+    vbus = (vbus ^ 0x80000) - 0x80000
+    current = (current ^ 0x80000) - 0x80000
+    return vbus, current
+
+def unpack_report(records):
+    # Packed records to flat (voltage [V], current [mA]) float64 arrays,
+    # scaled with the LSBs the device reported for each report
+    vbus, current = unpack_codes(records)
+    voltage = vbus * records["vbus_lsb"].astype(np.float64)[:, None]
+    current = current * (records["current_lsb"].astype(np.float64) * 1000)[:, None]
+    return voltage.reshape(-1), current.reshape(-1)
+
+def channel_mask(names):
+    # "voltage,dietemp" or ["voltage", "dietemp"] -> ina229_channel_t mask
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    mask = 0
+    for name in names:
+        if name not in channels:
+            raise ValueError(f"Unknown channel {name!r}, expected one of {', '.join(channels)}")
+        mask |= channels[name][0]
+    return mask
+
+def channel_names(mask):
+    return [name for name, (bit, unit) in channels.items() if mask & bit]
+
+def channel_sample_size(sample_size, mask):
+    # Samples per channel in a channel report as long as the scaled one
+    return (report_size(sample_size) - CHANNEL_HEADER_SIZE) // (4 * len(channel_names(mask)))
+
+def channel_report_dtype(mask, sample_size=DATA_RPT_SAMPLE_SIZE):
+    # ina229_channel_report_t, one int32 code array per selected channel
+    n = channel_sample_size(sample_size, mask)
+    names = channel_names(mask)
+    return np.dtype({
+        "names": ["sign", "id", "channels", "sample_size", "current_lsb", "vbus_lsb", "vshunt_lsb"] + names,
+        "formats": ["<u4", "<u4", "<u2", "<u2", "<f4", "<f4", "<f4"] + [("<i4", (n,))] * len(names),
+        "offsets": [0, 4, 8, 10, 12, 16, 20] + [CHANNEL_HEADER_SIZE + 4 * n * i for i in range(len(names))],
+        "itemsize": report_size(sample_size)
+    })
+
+def scale_channels(records):
+    # Channel records to {name: flat array} in the units of `channels`,
+    # diag_alrt stays int32 flags
+    current_lsb = records["current_lsb"].astype(np.float64)[:, None]
+    scales = {
+        "voltage": records["vbus_lsb"].astype(np.float64)[:, None],
+        "current": current_lsb * 1000,
+        "vshunt": records["vshunt_lsb"].astype(np.float64)[:, None] * 1000,
+        "dietemp": DIETEMP_LSB,
+        "power": current_lsb * 3.2 * 1000
+    }
+    out = {}
+    for name in channel_names(records_layout(records.dtype)[2]):
+        codes = records[name]
+        out[name] = (codes * scales[name]).reshape(-1) if name in scales else codes.reshape(-1)
+    return out
+
+def records_layout(dtype):
+    # (stream_mode, sample_size, channel mask) of a record dtype built above
+    sample_size = (dtype.itemsize - REPORT_HEADER_SIZE) // 8
+    if "samples" in dtype.names:
+        return STREAM_MODE_PACKED, sample_size, DEFAULT_CHANNELS
+    if "channels" in dtype.names:
+        return STREAM_MODE_CHANNELS, sample_size, channel_mask(
+            name for name in dtype.names if name in channels)
+    return STREAM_MODE_SCALED, sample_size, DEFAULT_CHANNELS
+
+def layout_dtype(stream_mode, sample_size=DATA_RPT_SAMPLE_SIZE, mask=DEFAULT_CHANNELS):
+    if stream_mode == STREAM_MODE_PACKED:
+        return packed_report_dtype(sample_size)
+    if stream_mode == STREAM_MODE_CHANNELS:
+        return channel_report_dtype(mask, sample_size)
+    return report_dtype(sample_size)
+
+def channel_arrays(records):
+    # {name: flat array} for records of any stream mode
+    stream_mode = records_layout(records.dtype)[0]
+    if stream_mode == STREAM_MODE_CHANNELS:
+        return scale_channels(records)
+    if stream_mode == STREAM_MODE_PACKED:
+        voltage, current = unpack_report(records)
+    else:
+        voltage, current = records["voltage"].reshape(-1), records["current"].reshape(-1)
+    return {"voltage": voltage, "current": current}
+
+def stored_values(name, values):
+    # Voltage / current in their units to the int32 values of scaled reports
+    return np.rint(np.asarray(values) / report_units[name][0]).astype(np.int32)
+
+def scaled_records(ids, voltage, current):
+    # Scaled report records (the raw capture layout) from the stored voltage
+    # and current of channel reports
+    n = len(current) // max(len(ids), 1)
+    records = np.zeros(len(ids), dtype=report_dtype(n))
+    records["sign"] = SIGNATURE
+    records["id"] = ids
+    records["voltage"] = voltage.reshape(-1, n)
+    records["current"] = current.reshape(-1, n)
+    return records
+
+def sample_period(conv_time_key, avg_num_key, dietemp=False):
+    # Continuous shunt and bus voltage mode: VBUSCT = VSHCT = cnv_time,
+    # the alert fires once per averaged shunt+bus conversion pair. The die
+    # temperature adds a VTCT = 50uS conversion.
+    conv_time = int(conv_time_key[:-2]) * 1e-6
+    avg = int(avg_num_key.split("_")[-1])
+    return (2 * conv_time + (50e-6 if dietemp else 0)) * avg
+
+# Command codes (cmd_code_t), every command is [cmd, param 0, param 1, param 2]
+CMD_NOP                = 0x00
+CMD_RESET_INA229       = 0x01
+CMD_WRITE_CONFIG_PARAM = 0x02
+CMD_READ_CONFIG_PARAM  = 0x03
+CMD_CONFIGURE_INA229   = 0x04
+CMD_SET_BAT_SIM_VOLT   = 0x05
+CMD_BAT_SIM_OUTPUT     = 0x06
+CMD_START_MEASURE      = 0x07
+CMD_STOP_MEASURE       = 0x08
+CMD_SET_REPORT_SIZE    = 0x09
+CMD_SET_CHANNELS       = 0x0A
+
+RESPONSE_SIZE = 16         # sizeof(response_t)
+AVG_ALERT_YES = 0x01
+
+def cmd_write_config(conv_time_key, avg_num_key, adc_range_key, avg_alert=AVG_ALERT_YES):
+    return bytes([CMD_WRITE_CONFIG_PARAM, 0x00, 0x00, 0x00,
+                  conversion_times[conv_time_key],
+                  average_num[avg_num_key],
+                  adc_range[adc_range_key],
+                  avg_alert])
+
+def cmd_set_vbat(code):
+    return bytes([CMD_SET_BAT_SIM_VOLT, (code >> 8) & 0xFF, code & 0xFF, 0x00])
+
+# Battery simulator DAC: VBAT = code * DAC_VCC / 4096
+DAC_VCC = 4.75             # DAC VCC power supply voltage
+DATA_MAX_4P2 = 3622        # DATA_MAX_4P2 = 4096 * 4.2 / DAC_VCC
+
+def vbat_code(voltage):
+    return min(max(int(round(voltage * 4096 / DAC_VCC)), 0), DATA_MAX_4P2)
+
+def vbat_voltage(code):
+    return code * DAC_VCC / 4096
+
+def cmd_vbat_output(enable):
+    return bytes([CMD_BAT_SIM_OUTPUT, 0x01 if enable else 0x00, 0x00, 0x00])
+
+def cmd_start_measure(stream_mode=STREAM_MODE_SCALED):
+    return bytes([CMD_START_MEASURE, stream_mode, 0x00, 0x00])
+
+def cmd_report_size(sample_size=0):
+    # 0 only reads the active report size
+    return bytes([CMD_SET_REPORT_SIZE, (sample_size >> 8) & 0xFF, sample_size & 0xFF, 0x00])
+
+def response_report_size(response):
+    # Active report sample count from a CMD_SET_REPORT_SIZE response, None
+    # for firmware without the command
+    if len(response) < 4 or response[0] != CMD_SET_REPORT_SIZE:
+        return None
+    sample_size = (response[2] << 8) | response[3]
+    return sample_size or None
+
+def cmd_channels(mask=0):
+    # 0 only reads the selected channels
+    return bytes([CMD_SET_CHANNELS, mask & 0xFF, 0x00, 0x00])
+
+def response_channels(response):
+    # Active channel mask from a CMD_SET_CHANNELS response, None for
+    # firmware without the command
+    if len(response) < 3 or response[0] != CMD_SET_CHANNELS:
+        return None
+    return response[2] or None
+
+def cmd_simple(code):
+    return bytes([code, 0x00, 0x00, 0x00])
+
+def response_ok(cmd, response):
+    return len(response) >= 2 and response[0] == cmd[0] and response[1] == 0x01
+
+class ReportDecoder:
+    # Turns the data port byte stream into report records, a whole read at
+    # a time. Garbage between reports is skipped by searching the signature.
+    def __init__(self, sample_size=DATA_RPT_SAMPLE_SIZE, stream_mode=STREAM_MODE_SCALED,
+                 mask=DEFAULT_CHANNELS):
+        self.dtype = layout_dtype(stream_mode, sample_size, mask)
+        self.signature = {STREAM_MODE_PACKED: PACKED_SIGNATURE,
+                          STREAM_MODE_CHANNELS: CHANNEL_SIGNATURE}.get(stream_mode, SIGNATURE)
+        self.sign_bytes = self.signature.to_bytes(4, "little")
+        self.buffer = bytearray()
+        self.dropped_bytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+        size = self.dtype.itemsize
+        out = []
+        while True:
+            start = self.buffer.find(self.sign_bytes)
+            if start < 0:
+                # Keep a possibly split signature
+                keep = len(self.sign_bytes) - 1
+                self.dropped_bytes += max(len(self.buffer) - keep, 0)
+                del self.buffer[:max(len(self.buffer) - keep, 0)]
+                break
+            if start:
+                self.dropped_bytes += start
+                del self.buffer[:start]
+            count = len(self.buffer) // size
+            if count == 0:
+                break
+            records = np.frombuffer(bytes(self.buffer[:count * size]), dtype=self.dtype)
+            bad = np.flatnonzero(records["sign"] != self.signature)
+            if len(bad):
+                records = records[:bad[0]]
+            out.append(records)
+            del self.buffer[:len(records) * size]
+            if not len(bad):
+                break
+        if len(out) == 1:
+            return out[0]
+        return np.concatenate(out) if out else np.zeros(0, dtype=self.dtype)
@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Off-thread plot rendering. The Tk thread describes what to draw as a scene
+# (a dict of plain arrays and labels) and a worker thread rasterizes it with
+# Agg on a private figure into a reusable RGBA buffer. The Tk thread only
+# blits finished images into the canvas, so rendering never delays marker
+# drags or button clicks.
+#
+# Scene keys (all optional):
+#   "title", "xlabel", "ylabel": axis labels
+#   "xlim": (x_min, x_max)
+#   "lines": [(x, y, color), ...]
+#   "fills": [(x, lo, hi, color), ...]    min/max envelopes, step="post"
+#   "markers": [(x, color), ...]          dashed vertical lines
+#   "image": (image, extent, cmap)        e.g. a persistence.PersistenceMap
+
+import threading
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends import _backend_tk
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+POLL_INTERVAL = 15   # ms between checks for a finished image on the Tk thread
+
+def draw_scene(ax, scene):
+    ax.clear()
+    for x, y, color in scene.get("lines", ()):
+        ax.plot(x, y, color = color)
+    for x, lo, hi, color in scene.get("fills", ()):
+        ax.fill_between(x, lo, hi, step="post", color = color)
+    if "image" in scene:
+        image, extent, cmap = scene["image"]
+        ax.imshow(image, extent=extent, origin="lower", aspect="auto", cmap=cmap,
+                  interpolation="nearest", vmin=0.0, vmax=1.0)
+    for x, color in scene.get("markers", ()):
+        ax.axvline(x, color = color, linestyle='--')
+    ax.set_title(scene.get("title", ""))
+    ax.set_xlabel(scene.get("xlabel", ""))
+    ax.set_ylabel(scene.get("ylabel", ""))
+    if "xlim" in scene:
+        ax.set_xlim(scene["xlim"])
+
+class RenderWorker:
+    def __init__(self, subplotpars=None):
+        # Private figure, only ever touched by the worker thread
+        self.figure = Figure(subplotpars=subplotpars)
+        self.ax = self.figure.add_subplot(111)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.condition = threading.Condition()
+        self.request = None     # (scene, size_inches, dpi), the latest one wins
+        self.ready = None       # Finished image not taken by the Tk thread yet
+        self.free = []          # RGBA buffers available for rendering
+        self.frames = 0
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, scene, size_inches, dpi):
+        with self.condition:
+            self.request = (scene, tuple(size_inches), dpi)
+            self.condition.notify()
+
+    def take(self):
+        # Finished image or None, hand it back with release() once shown
+        with self.condition:
+            image, self.ready = self.ready, None
+            return image
+
+    def release(self, image):
+        with self.condition:
+            self.free.append(image)
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+
+    def buffer(self, shape):
+        # Buffers go round between the worker and the Tk thread, at most
+        # three exist: the one shown, the one ready and the one rendered
+        with self.condition:
+            while self.free:
+                image = self.free.pop()
+                if image.shape == shape:
+                    return image
+        return np.empty(shape, dtype=np.uint8)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.is_running and self.request is None:
+                    self.condition.wait()
+                if not self.is_running:
+                    return
+                (scene, size_inches, dpi), self.request = self.request, None
+
+            self.figure.set_dpi(dpi)
+            self.figure.set_size_inches(size_inches, forward=False)
+            draw_scene(self.ax, scene)
+            self.canvas.draw()
+            rgba = np.asarray(self.canvas.buffer_rgba())
+            image = self.buffer(rgba.shape)
+            np.copyto(image, rgba)
+
+            with self.condition:
+                if self.ready is not None:
+                    self.free.append(self.ready)
+                self.ready = image
+                self.frames += 1
+
+class OffscreenCanvas(FigureCanvasTkAgg):
+    # A FigureCanvasTkAgg whose figure is only used for the layout and the
+    # mouse event coordinates (keep its axes xlim in sync), the pixels come
+    # from the scene rendered by a RenderWorker
+    def __init__(self, figure, master=None):
+        super().__init__(figure, master=master)
+        self.scene = {}
+        self.worker = RenderWorker(figure.subplotpars)
+        self._tkcanvas.after(POLL_INTERVAL, self.poll)
+
+    def show(self, scene):
+        self.scene = scene
+        self.draw()
+
+    def draw(self):
+        # Also called by Tk on resize, never rasterizes on the Tk thread
+        self.worker.submit(self.scene, self.figure.get_size_inches(), self.figure.dpi)
+
+    def poll(self):
+        image = self.worker.take()
+        if image is not None:
+            # Skip a stale size, the render for the new one is queued
+            if image.shape[:2] == (self._tkphoto.height(), self._tkphoto.width()):
+                _backend_tk.blit(self._tkphoto, image, (0, 1, 2, 3))
+            self.worker.release(image)
+        if self.worker.is_running:
+            self._tkcanvas.after(POLL_INTERVAL, self.poll)
+
+    def stop(self):
+        self.worker.stop()
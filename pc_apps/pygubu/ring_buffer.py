@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Fixed size sample history. Every sample is stored twice (at i and
+# i + capacity) so the latest n samples are always one contiguous slice,
+# which can be handed out as a view without copying.
+
+import numpy as np
+
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.int32):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.total = 0          # Samples appended since the start (absolute index)
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, values):
+        values = np.asarray(values).reshape(-1)
+        if len(values) > self.capacity:
+            self.total += len(values) - self.capacity
+            values = values[-self.capacity:]
+        n = len(values)
+        i = self.total % self.capacity
+        first = min(n, self.capacity - i)
+        for offset in (0, self.capacity):
+            self.data[offset + i:offset + i + first] = values[:first]
+            self.data[offset:offset + n - first] = values[first:]
+        self.total += n
+
+    def latest(self, n=None):
+        # View of the last n samples, oldest first
+        n = len(self) if n is None else min(n, len(self))
+        end = self.total % self.capacity + self.capacity
+        return self.data[end - n:end]
+
+    def snapshot(self):
+        # Read-only view of every sample held. It only stays immutable while
+        # nothing else is appended, so the owner swaps in another buffer for
+        # new samples (see Power_Monitor.toggle_freeze)
+        view = self.latest()
+        view.flags.writeable = False
+        return view
+
+    def clear(self):
+        self.total = 0
+
+class ChannelBuffers:
+    # One RingBuffer per channel name, created on first append with the
+    # dtype of the incoming samples
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffers = {}
+
+    def __len__(self):
+        return min((len(buffer) for buffer in self.buffers.values()), default=0)
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def __contains__(self, name):
+        return name in self.buffers
+
+    def names(self):
+        return list(self.buffers)
+
+    def append(self, arrays):
+        # arrays: {name: samples}, e.g. protocol.channel_arrays(records)
+        for name, values in arrays.items():
+            buffer = self.buffers.get(name)
+            if buffer is None or buffer.data.dtype != values.dtype:
+                buffer = self.buffers[name] = RingBuffer(self.capacity, values.dtype)
+            buffer.append(values)
+
+    def latest(self, n=None):
+        return {name: buffer.latest(n) for name, buffer in self.buffers.items()}
+
+    def clear(self):
+        self.buffers.clear()
+
+def minmax_decimate(values, bins):
+    # (mins, maxs) per bin, a min/max envelope keeps the glitches that
+    # plain subsampling would hide
+    if len(values) <= bins:
+        return values, values
+    starts = np.linspace(0, len(values), bins, endpoint=False).astype(np.int64)
+    return np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts)
+
+def minmax_line(values, bins):
+    # (x, y) polyline visiting each bin min then max, for line plots of
+    # decimated data with the sample index as x
+    if len(values) <= bins:
+        return np.arange(len(values)), values
+    starts = np.linspace(0, len(values), bins, endpoint=False).astype(np.int64)
+    mins, maxs = minmax_decimate(values, bins)
+    y = np.empty(2 * bins, dtype=values.dtype)
+    y[0::2] = mins
+    y[1::2] = maxs
+    return np.repeat(starts, 2), y
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Rolling mean / min / max / RMS / charge over fixed time windows, updated
+# incrementally from the decoded batches instead of recomputed from the
+# history on every display tick.
+#
+# A window is split into BLOCKS blocks. Each batch is reduced per block with
+# NumPy, complete blocks go through running sums and monotonic deques (block
+# min / max), so the cost is O(1) per sample and a query is O(1). The window
+# slides one block at a time: it covers the last BLOCKS complete blocks plus
+# the block being filled, i.e. it is exact to 1/BLOCKS of its length.
+
+import math
+from collections import deque
+import numpy as np
+
+BLOCKS = 64
+DEFAULT_WINDOWS = (0.01, 1.0, 10.0, 60.0)   # [s]
+
+class RollingWindow:
+    def __init__(self, length):
+        # length: window length in samples
+        self.length = max(int(length), 1)
+        self.block_size = max(math.ceil(self.length / BLOCKS), 1)
+        self.num_blocks = math.ceil(self.length / self.block_size)
+        self.reset()
+
+    def reset(self):
+        self.blocks = deque()       # (sum, sum of squares, count) per complete block
+        self.mins = deque()         # (block index, min), increasing mins
+        self.maxs = deque()         # (block index, max), decreasing maxs
+        self.index = 0              # Index of the next complete block
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        self.count = 0
+        self.partial = np.zeros(0)  # Samples of the block being filled
+
+    def push_block(self, v_min, v_max, v_sum, v_sum_sq, n):
+        self.blocks.append((v_sum, v_sum_sq, n))
+        self.sum += v_sum
+        self.sum_sq += v_sum_sq
+        self.count += n
+        while self.mins and self.mins[-1][1] >= v_min:
+            self.mins.pop()
+        self.mins.append((self.index, v_min))
+        while self.maxs and self.maxs[-1][1] <= v_max:
+            self.maxs.pop()
+        self.maxs.append((self.index, v_max))
+        self.index += 1
+
+        if len(self.blocks) > self.num_blocks:
+            old_sum, old_sum_sq, old_n = self.blocks.popleft()
+            self.sum -= old_sum
+            self.sum_sq -= old_sum_sq
+            self.count -= old_n
+            first = self.index - self.num_blocks
+            if self.mins[0][0] < first:
+                self.mins.popleft()
+            if self.maxs[0][0] < first:
+                self.maxs.popleft()
+
+    def append(self, values):
+        values = np.concatenate((self.partial, np.asarray(values, dtype=np.float64)))
+        n = len(values) // self.block_size * self.block_size
+        # Older blocks would leave the window within this batch anyway
+        start = max(n - self.num_blocks * self.block_size, 0)
+        if start:
+            self.reset()
+        blocks = values[start:n].reshape(-1, self.block_size)
+        if len(blocks):
+            for block in zip(blocks.min(axis=1), blocks.max(axis=1), blocks.sum(axis=1),
+                             np.square(blocks).sum(axis=1)):
+                self.push_block(*block, self.block_size)
+        self.partial = values[n:]
+
+    def stats(self):
+        # {"mean", "min", "max", "rms", "sum", "samples"} or None when empty
+        p = self.partial
+        count = self.count + len(p)
+        if count == 0:
+            return None
+        v_sum = float(self.sum) + float(p.sum())
+        mins = [self.mins[0][1]] if self.mins else []
+        maxs = [self.maxs[0][1]] if self.maxs else []
+        if len(p):
+            mins.append(p.min())
+            maxs.append(p.max())
+        return {
+            "mean": v_sum / count,
+            "min": float(min(mins)),
+            "max": float(max(maxs)),
+            "rms": math.sqrt(max(float(self.sum_sq) + float(np.square(p).sum()), 0.0) / count),
+            "sum": v_sum,
+            "samples": count
+        }
+
+class RollingStats:
+    # One RollingWindow per (channel, window length in seconds)
+    def __init__(self, period, windows=DEFAULT_WINDOWS, channels=("current", "voltage")):
+        self.period = period
+        self.windows = tuple(windows)
+        self.rolling = {(name, seconds): RollingWindow(seconds / period)
+                        for name in channels for seconds in self.windows}
+
+    def append(self, name, values):
+        for (channel, _), window in self.rolling.items():
+            if channel == name:
+                window.append(values)
+
+    def reset(self):
+        for window in self.rolling.values():
+            window.reset()
+
+    def stats(self, name, seconds):
+        # Window statistics plus "charge" (sum x period, in unit.s)
+        stats = self.rolling[(name, seconds)].stats()
+        if stats is not None:
+            stats["charge"] = stats["sum"] * self.period
+        return stats
+
+def format_window(seconds):
+    return f"{seconds * 1000:g} ms" if seconds < 1 else f"{seconds:g} s"
+
+def parse_windows(text):
+    # "0.01,1,10,60" -> (0.01, 1.0, 10.0, 60.0)
+    windows = tuple(float(value) for value in text.split(",") if value.strip())
+    if not windows or min(windows) <= 0:
+        raise ValueError(f"Invalid rolling windows: {text!r}")
+    return windows
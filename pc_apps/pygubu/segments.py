@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Statistics of any [start, stop) segment of a trace in O(1), for N markers
+# over a multi-million samples history: moving one marker only recomputes the
+# two segments next to it.
+#
+# Sums (mean, charge) and the voltage x current sums (energy) come from prefix
+# sums, min / max from a sparse table over BLOCK samples blocks plus at most
+# two partial blocks scanned with NumPy.
+#
+# CaptureSegments gives the same statistics over an opened capture file
+# without loading it: the whole bins from the finest level of its overview
+# (capture_overview, the power prefix sums included, min / max from a sparse
+# table over the bins) and the partial bins at both ends read from the file.
+
+import numpy as np
+
+BLOCK = 1024
+BIN_BLOCK = 64             # Overview bins per sparse table block
+
+class BlockExtrema:
+    # min / max of lows / highs (the same array for raw samples) over any
+    # [start, stop): levels[k][j] covers blocks j .. j + 2^k - 1
+    def __init__(self, lows, highs, block=BLOCK):
+        self.lows = lows
+        self.highs = highs
+        self.block = block
+        n = len(lows) // block
+        self.mins = [np.asarray(lows[:n * block]).reshape(n, block).min(axis=1)] if n else []
+        self.maxs = [np.asarray(highs[:n * block]).reshape(n, block).max(axis=1)] if n else []
+        width = 1
+        while 2 * width <= n:
+            self.mins.append(np.minimum(self.mins[-1][:-width], self.mins[-1][width:]))
+            self.maxs.append(np.maximum(self.maxs[-1][:-width], self.maxs[-1][width:]))
+            width *= 2
+
+    def __call__(self, start, stop):
+        first = -(-start // self.block)
+        last = stop // self.block
+        if last - first < 1:
+            return self.lows[start:stop].min(), self.highs[start:stop].max()
+
+        k = (last - first).bit_length() - 1
+        v_min = min(self.mins[k][first], self.mins[k][last - (1 << k)])
+        v_max = max(self.maxs[k][first], self.maxs[k][last - (1 << k)])
+        for lo, hi in ((start, first * self.block), (last * self.block, stop)):
+            if hi > lo:
+                v_min = min(v_min, self.lows[lo:hi].min())
+                v_max = max(v_max, self.highs[lo:hi].max())
+        return v_min, v_max
+
+def _stats(samples, v_sum, v_min, v_max, power_sum):
+    return {
+        "samples": samples,
+        "sum": v_sum,
+        "mean": v_sum / samples,
+        "min": float(v_min),
+        "max": float(v_max),
+        "power_sum": power_sum
+    }
+
+class SegmentIndex:
+    def __init__(self, current, voltage=None, block=BLOCK):
+        # current, voltage: stored sample arrays (see protocol.report_units),
+        # the energy is only available when voltage has the same length
+        self.values = current
+        self.csum = np.concatenate(([0], np.cumsum(current, dtype=np.float64)))
+        self.psum = None
+        if voltage is not None and len(voltage) == len(current):
+            self.psum = np.concatenate(([0], np.cumsum(np.multiply(current, voltage, dtype=np.float64))))
+        self.extrema = BlockExtrema(current, current, block)
+
+    def __len__(self):
+        return len(self.values)
+
+    def stats(self, start, stop):
+        # {"samples", "sum", "mean", "min", "max", "power_sum"} in stored
+        # units over [start, stop), None when empty
+        start = min(max(int(start), 0), len(self.values))
+        stop = min(max(int(stop), start), len(self.values))
+        if stop == start:
+            return None
+        v_min, v_max = self.extrema(start, stop)
+        return _stats(stop - start, float(self.csum[stop] - self.csum[start]), v_min, v_max,
+                      None if self.psum is None else float(self.psum[stop] - self.psum[start]))
+
+class CaptureSegments:
+    def __init__(self, capture, overview, block=BIN_BLOCK):
+        self.capture = capture
+        self.overview = overview
+        self.size = overview.bin_size(0)
+        mins, maxs, sums = overview.level("current", 0)
+        self.csum = np.concatenate(([0], np.cumsum(sums, dtype=np.float64)))
+        self.psum = overview.power_prefix()
+        self.extrema = BlockExtrema(mins, maxs, block)
+
+    def __len__(self):
+        return self.overview.num_samples
+
+    def stats(self, start, stop):
+        # As SegmentIndex.stats
+        start = min(max(int(start), 0), len(self))
+        stop = min(max(int(stop), start), len(self))
+        if stop == start:
+            return None
+        first, last = -(-start // self.size), stop // self.size
+        if last <= first:
+            voltage, current = self.capture.read(start, stop)
+            return SegmentIndex(current, voltage).stats(0, len(current))
+
+        v_sum = float(self.csum[last] - self.csum[first])
+        p_sum = float(self.psum[last] - self.psum[first])
+        v_min, v_max = self.extrema(first, last)
+        for lo, hi in ((start, first * self.size), (last * self.size, stop)):
+            if hi > lo:
+                voltage, current = self.capture.read(lo, hi)
+                v_sum += float(np.sum(current, dtype=np.float64))
+                p_sum += float(np.dot(current.astype(np.float64), voltage))
+                v_min, v_max = min(v_min, current.min()), max(v_max, current.max())
+        return _stats(stop - start, v_sum, v_min, v_max, p_sum)
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Unattended measurement campaigns: a JSON plan lists the steps (ADC config,
+# VBAT, duration) to run on one or several devices, headless:
+#
+#   {
+#       "output": "runs/nightly",
+#       "devices": {
+#           "rig1": {"cmd": "COM13", "data": "COM14"},
+#           "rig2": {"cmd": "COM21", "data": "COM22"}
+#       },
+#       "defaults": {"conv_time": "280uS", "avg_num": "AVG_NUM_1", "vbat": 3.8},
+#       "steps": [
+#           {"name": "boot", "duration": 30},
+#           {"name": "low_batt", "vbat": 3.4, "settle": 1, "duration": 600, "repeat": 3},
+#           {"name": "fast", "avg_num": "AVG_NUM_4", "duration": 60, "devices": ["rig2"]}
+#       ]
+#   }
+#
+#   python sequencer.py plan.json
+#
+# Each device runs its steps in its own thread, so devices don't wait for each
+# other. A step writes output/<device>/<index>_<name>.bin (+ .json meta) and,
+# once summarized by capture_analytics, <index>_<name>.summary.json. The
+# summaries are computed on a separate thread while the device already
+# measures the next step, and the ADC / VBAT commands are only sent when the
+# step changes them. A step is done when its summary exists: running the plan
+# again after an interruption resumes with the first step without one.
+#
+# A step with "golden" is also checked against that golden_profile.py
+# envelope; the check goes in the summary and a failed one fails the run.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import concurrent.futures
+
+from protocol import conversion_times, average_num, adc_range, vbat_code, MIN_SAMPLE_SIZE, MAX_SAMPLE_SIZE
+
+SUMMARY_SUFFIX = ".summary.json"
+
+# Step parameters and their defaults, "defaults" in the plan overrides them
+step_defaults = {
+    "conv_time":   "280uS",
+    "avg_num":     "AVG_NUM_1",
+    "adc_range":   "RANGE_0",
+    "report_size": None,       # Samples per report, None keeps the device's
+    "vbat":        None,       # VBAT simulator output [V], None leaves it alone
+    "vbat_enable": True,
+    "settle":      0.0,        # Wait after the VBAT change before measuring [s]
+    "duration":    10.0,       # Capture length [s]
+    "codec":       "",         # "", "zlib" or "lzma" (capture_compressed)
+    "golden":      None,       # golden_profile.py envelope the capture is checked against
+    "golden_abs":  0.0,        # Its absolute [mA] and relative tolerances
+    "golden_rel":  0.0
+}
+
+step_schema = {
+    "conv_time":   lambda value: value in conversion_times,
+    "avg_num":     lambda value: value in average_num,
+    "adc_range":   lambda value: value in adc_range,
+    "report_size": lambda value: value is None or MIN_SAMPLE_SIZE <= int(value) <= MAX_SAMPLE_SIZE,
+    "vbat":        lambda value: value is None or float(value) >= 0,
+    "vbat_enable": lambda value: isinstance(value, bool),
+    "settle":      lambda value: float(value) >= 0,
+    "duration":    lambda value: float(value) > 0,
+    "codec":       lambda value: value in ("", "zlib", "lzma"),
+    "golden":      lambda value: value is None or isinstance(value, str),
+    "golden_abs":  lambda value: float(value) >= 0,
+    "golden_rel":  lambda value: float(value) >= 0
+}
+
+def load_plan(path):
+    with open(path, "r") as file:
+        plan = json.load(file)
+    if not plan.get("devices"):
+        raise ValueError("The plan has no devices")
+    for name, ports in plan["devices"].items():
+        if "cmd" not in ports or "data" not in ports:
+            raise ValueError(f"Device {name} needs cmd and data ports")
+    plan.setdefault("output", os.path.splitext(path)[0])
+    defaults = dict(step_defaults, **plan.get("defaults", {}))
+
+    steps = []
+    for i, step in enumerate(plan.get("steps", [])):
+        step = dict(defaults, **step)
+        name = step.setdefault("name", f"step{i}")
+        for key in step:
+            if key not in step_schema and key not in ("name", "devices", "repeat"):
+                raise ValueError(f"Step {name}: unknown parameter {key}")
+        for key, valid in step_schema.items():
+            try:
+                ok = valid(step[key])
+            except (TypeError, ValueError):
+                ok = False
+            if not ok:
+                raise ValueError(f"Step {name}: invalid {key} {step[key]!r}")
+        unknown = set(step.get("devices", [])) - set(plan["devices"])
+        if unknown:
+            raise ValueError(f"Step {name}: unknown devices {', '.join(sorted(unknown))}")
+        repeat = int(step.pop("repeat", 1))
+        for k in range(repeat):
+            steps.append(dict(step, name=f"{name}_{k}" if repeat > 1 else name))
+    plan["steps"] = steps
+    return plan
+
+def device_steps(plan, device):
+    # [(index, step)] run by one device, indexes are the plan positions so
+    # the files of all devices line up
+    return [(i, step) for i, step in enumerate(plan["steps"])
+            if device in step.get("devices", plan["devices"])]
+
+def step_path(output, device, index, step):
+    return os.path.join(output, device, f"{index:03d}_{step['name']}" + (".pmz" if step["codec"] else ".bin"))
+
+def summary_path(path):
+    return os.path.splitext(path)[0] + SUMMARY_SUFFIX
+
+def write_json(path, data):
+    # Atomic, a summary file only exists once complete
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp, path)
+
+class Sequencer:
+    def __init__(self, plan, log=print):
+        self.plan = plan
+        self.output = plan["output"]
+        self.log_func = log
+        self.log_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.summarizer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.errors = {}
+        self.failures = []         # Captures outside their golden envelope
+
+    def log(self, device, text):
+        with self.log_lock:
+            self.log_func(f"{time.strftime('%H:%M:%S')} [{device}] {text}")
+
+    def run(self, devices=None):
+        threads = [threading.Thread(target=self.run_device, args=(name,), daemon=True)
+                   for name in (devices or self.plan["devices"])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # Captures in progress are dropped, they run again on resume
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        self.summarizer.shutdown(wait=True)
+        for future in self.pending:
+            future.result()
+        return not self.errors and not self.failures and not self.stop_event.is_set()
+
+    def run_device(self, name):
+        from device import Device
+        steps = [(i, step) for i, step in device_steps(self.plan, name)
+                 if not os.path.exists(summary_path(step_path(self.output, name, i, step)))]
+        if not steps:
+            self.log(name, "all steps done")
+            return
+        os.makedirs(os.path.join(self.output, name), exist_ok=True)
+        ports = self.plan["devices"][name]
+        try:
+            with Device.open(ports["cmd"], ports["data"], int(ports.get("baudrate", 10000000))) as dev:
+                state = {}
+                for index, step in steps:
+                    if self.stop_event.is_set():
+                        break
+                    self.run_step(dev, name, index, step, state)
+        except Exception as e:
+            self.errors[name] = e
+            self.log(name, f"stopped: {e}")
+
+    def run_step(self, dev, name, index, step, state):
+        from capture import CaptureWriter, capture_meta
+
+        # Only what changes since the previous step is sent
+        config = (step["conv_time"], step["avg_num"], step["adc_range"], step["report_size"])
+        if state.get("config") != config:
+            dev.configure(step["conv_time"], step["avg_num"], step["adc_range"])
+            if step["report_size"]:
+                dev.set_report_size(int(step["report_size"]))
+            state["config"] = config
+        settle = False
+        if step["vbat"] is not None and state.get("vbat") != step["vbat"]:
+            dev.set_vbat(vbat_code(float(step["vbat"])))
+            state["vbat"] = step["vbat"]
+            settle = True
+        if state.get("vbat_enable") != step["vbat_enable"]:
+            dev.enable_vbat(step["vbat_enable"])
+            state["vbat_enable"] = step["vbat_enable"]
+            settle = True
+        if settle and self.stop_event.wait(float(step["settle"])):
+            return
+
+        path = step_path(self.output, name, index, step)
+        meta = capture_meta(step["conv_time"], step["avg_num"], step["adc_range"], dev.sample_size)
+        meta["step"] = dict(step, device=name, index=index)
+        if step["codec"]:
+            from capture_compressed import CompressedCaptureWriter
+            writer = CompressedCaptureWriter(path, meta, step["codec"])
+        else:
+            writer = CaptureWriter(path, meta)
+        self.log(name, f"step {index} {step['name']}: {step['duration']} s -> {path}")
+        started = time.time()
+        with writer:
+            with dev.capture(duration=float(step["duration"]), writer=writer) as acq:
+                for _ in acq:
+                    if self.stop_event.is_set():
+                        return
+        result = {"device": name, "index": index, "step": step, "started": started,
+                  "finished": time.time(), "samples": acq.samples, "lost_reports": acq.lost_reports}
+        # Summarized while the device goes on with the next step
+        self.pending.append(self.summarizer.submit(self.finish_step, path, result))
+
+    def finish_step(self, path, result):
+        from capture_analytics import analyze
+        try:
+            result["summary"] = analyze(path, workers=1)
+            step = result["step"]
+            if step["golden"]:
+                from golden_profile import check
+                result["golden"] = check(step["golden"], path, float(step["golden_abs"]),
+                                         float(step["golden_rel"]))
+                if not result["golden"]["pass"]:
+                    self.failures.append(path)
+            write_json(summary_path(path), result)
+            self.log(result["device"], f"step {result['index']} {step['name']} done, "
+                                       f"lost reports {result['lost_reports']}" +
+                     (f", golden {'pass' if result['golden']['pass'] else 'FAIL'}" if step["golden"] else ""))
+        except Exception as e:
+            self.errors.setdefault(result["device"], e)
+            self.log(result["device"], f"step {result['index']} summary failed: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a measurement campaign plan")
+    parser.add_argument("plan", help="JSON plan (devices, defaults, steps)")
+    parser.add_argument("--output", default=None, help="output directory, overrides the plan")
+    parser.add_argument("--devices", default=None, help="comma separated devices to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="print the steps and their state, run nothing")
+    args = parser.parse_args(argv)
+
+    plan = load_plan(args.plan)
+    if args.output:
+        plan["output"] = args.output
+    devices = args.devices.split(",") if args.devices else list(plan["devices"])
+    unknown = set(devices) - set(plan["devices"])
+    if unknown:
+        parser.error(f"unknown devices: {', '.join(sorted(unknown))}")
+
+    if args.list:
+        for name in devices:
+            for index, step in device_steps(plan, name):
+                path = step_path(plan["output"], name, index, step)
+                state = "todo"
+                if os.path.exists(summary_path(path)):
+                    with open(summary_path(path), "r") as file:
+                        golden = json.load(file).get("golden")
+                    state = "FAIL" if golden and not golden["pass"] else "done"
+                print(f"{name:10s} {index:3d} {step['name']:20s} {step['duration']:>8} s  {state}")
+        return
+
+    sequencer = Sequencer(plan, lambda text: print(text, flush=True))
+    if not sequencer.run(devices):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
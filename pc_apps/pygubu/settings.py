@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# settings.ini store: the JSON file is loaded once, values are read and
+# written in memory and save() writes the whole file atomically.
+#
+# Named profiles (one per device or test setup) override the top level values:
+#
+#   {
+#       "serial_port_cmd": "COM13",
+#       ...
+#       "profiles": {
+#           "rig2": {"serial_port_cmd": "COM21", "serial_port_data": "COM22"}
+#       }
+#   }
+
+import os
+import sys
+import json
+import tempfile
+
+from protocol import (conversion_times, average_num, adc_range, channels, channel_mask,
+                      MIN_SAMPLE_SIZE, MAX_SAMPLE_SIZE)
+from rolling_stats import parse_windows
+from filters import parse_filters
+from device import parse_usb_id
+
+# File path for settings.ini
+file_path = "settings.ini"
+
+# Default settings
+default_settings = {
+    "serial_port_cmd":  "COM13",
+    "serial_port_data": "COM14",
+    "baudrate":         "10000000",
+    "conversion_times": "280uS",
+    "average_num":      "AVG_NUM_1",
+    "adc_range":        "RANGE_0",
+    "vbat":             "1927",
+    "vbat_ena":         "False",
+    "capture_dir":      "",
+    "capture_codec":    "",
+    "report_size":      "63",
+    "persistence_frame":   "1000",
+    "persistence_trigger": "",
+    "rolling_windows":     "0.01,1,10,60",
+    "filter":              "",
+    "filter_target":       "display",
+    "vbat_profile_speed":  "1",
+    "usb_id":              "0815:2024",
+    "reconnect_timeout":   "30",
+    "channels":            "voltage,current",
+    "plot_channel":        "voltage",
+    "stream_mode":         "scaled",
+    "event_threshold":     ""
+}
+
+def _is_int_string(value):
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _is_float_string(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _is_windows_string(value):
+    try:
+        parse_windows(value)
+        return True
+    except (AttributeError, ValueError):
+        return False
+
+def _is_filter_string(value):
+    try:
+        parse_filters(value)
+        return True
+    except (AttributeError, ValueError):
+        return False
+
+def _is_channels_string(value):
+    try:
+        return channel_mask(value) != 0
+    except (AttributeError, ValueError):
+        return False
+
+def _is_usb_id_string(value):
+    try:
+        parse_usb_id(value)
+        return True
+    except (AttributeError, ValueError):
+        return False
+
+# Accepted values per key, keys without a schema are stored as given
+schema = {
+    "conversion_times": lambda value: value in conversion_times,
+    "average_num":      lambda value: value in average_num,
+    "adc_range":        lambda value: value in adc_range,
+    "baudrate":         _is_int_string,
+    "vbat":             _is_int_string,
+    "vbat_ena":         lambda value: value in ("True", "False"),
+    "capture_codec":    lambda value: value in ("", "zlib", "lzma"),
+    "report_size":      lambda value: _is_int_string(value) and MIN_SAMPLE_SIZE <= int(value) <= MAX_SAMPLE_SIZE,
+    "persistence_frame":   lambda value: _is_int_string(value) and int(value) >= 2,
+    "persistence_trigger": lambda value: value == "" or _is_float_string(value),
+    "rolling_windows":     _is_windows_string,
+    "filter":              _is_filter_string,
+    "filter_target":       lambda value: value in ("display", "capture"),
+    "vbat_profile_speed":  lambda value: _is_float_string(value) and float(value) > 0,
+    "usb_id":              lambda value: value == "" or _is_usb_id_string(value),
+    "reconnect_timeout":   lambda value: _is_float_string(value) and float(value) >= 0,
+    "channels":            _is_channels_string,
+    "plot_channel":        lambda value: value in channels and value != "current",
+    # Voltage + current only, other channel selections stream channel reports
+    "stream_mode":         lambda value: value in ("scaled", "packed"),
+    # [mA], events of opened captures (capture_overview), "" for none
+    "event_threshold":     lambda value: value == "" or _is_float_string(value)
+}
+
+def validate(key, value):
+    if key in schema and not schema[key](value):
+        raise ValueError(f"Invalid setting {key}: {value!r}")
+
+# API to read and write specific key values
+class SettingsManager:
+    def __init__(self, file_path, profile=None):
+        self.file_path = file_path
+        self.profile = profile
+        self.dirty = False
+        self.settings = self.load()
+        if profile:
+            self.settings.setdefault("profiles", {}).setdefault(profile, {})
+
+    def load(self):
+        # A missing or corrupt file falls back to the defaults
+        if not os.path.exists(self.file_path):
+            self.dirty = True
+            return dict(default_settings)
+        try:
+            with open(self.file_path, "r") as file:
+                settings = json.load(file)
+        except ValueError as e:
+            sys.stderr.write(f"{self.file_path}: {e}, using default settings\n")
+            self.dirty = True
+            return dict(default_settings)
+
+        # Drop invalid values so they fall back to the defaults
+        for values in [settings] + list(settings.get("profiles", {}).values()):
+            for key in list(values):
+                try:
+                    validate(key, values[key])
+                except ValueError as e:
+                    sys.stderr.write(f"{self.file_path}: {e}, using default\n")
+                    del values[key]
+                    self.dirty = True
+        return settings
+
+    def profiles(self):
+        return sorted(self.settings.get("profiles", {}))
+
+    def read_value(self, key):
+        if self.profile:
+            values = self.settings["profiles"][self.profile]
+            if key in values:
+                return values[key]
+        return self.settings.get(key, default_settings.get(key))
+
+    def write_value(self, key, value):
+        validate(key, value)
+        values = self.settings["profiles"][self.profile] if self.profile else self.settings
+        if values.get(key) != value:
+            values[key] = value
+            self.dirty = True
+
+    def update(self, values):
+        # Validate everything first so a bad value doesn't leave a half update
+        for key, value in values.items():
+            validate(key, value)
+        for key, value in values.items():
+            self.write_value(key, value)
+
+    def save(self):
+        if not self.dirty:
+            return
+        # Write a temporary file in the same directory then rename it over
+        # settings.ini, a crash leaves either the old or the new file
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self.settings, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
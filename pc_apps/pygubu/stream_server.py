@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Live stream broker: one process owns the device, decodes the data port once
+# and fans the reports out to any number of local TCP / Unix socket
+# subscribers (GUI, logger, automation).
+#
+#   python stream_server.py --cmd-port COM13 --data-port COM14 --tcp 127.0.0.1:5025
+#
+# Each message is a block header followed by the raw report records
+# (protocol.layout_dtype(stream_mode, sample_size, channels), package_id included):
+#
+#   magic "PMSB", seq, num_reports, sample_size, stream_mode, channels, dropped, timestamp
+#
+# "dropped" counts the blocks this subscriber lost so far because it was too
+# slow, "timestamp" is the host time the block was read from the device.
+
+import os
+import sys
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import numpy as np
+
+import protocol
+from protocol import layout_dtype, records_layout
+
+BLOCK_MAGIC = b"PMSB"
+BLOCK_HEADER = struct.Struct("<4sIIIHHId")
+QUEUE_BLOCKS = 256         # Blocks buffered per subscriber
+METRICS_INTERVAL = 5.0     # Seconds between metrics prints in the CLI
+
+# What to do when a subscriber queue is full
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICY_DISCONNECT  = "disconnect"
+policies = (POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_DISCONNECT)
+
+class Subscriber:
+    def __init__(self, broker, conn, name, queue_blocks, policy):
+        self.broker = broker
+        self.conn = conn
+        self.name = name
+        self.policy = policy
+        self.queue = queue.Queue(queue_blocks)
+        self.is_connected = True
+        self.sent_blocks = 0
+        self.sent_bytes = 0
+        self.dropped_blocks = 0
+        self.lag = 0.0            # Age of the last block when it was sent [s]
+        self.close_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.send_data, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def offer(self, block):
+        # Called from the publisher thread, never blocks
+        try:
+            self.queue.put_nowait(block)
+            return
+        except queue.Full:
+            pass
+        self.dropped_blocks += 1
+        if self.policy == POLICY_DISCONNECT:
+            self.close()
+        elif self.policy == POLICY_DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(block)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def send_data(self):
+        try:
+            while self.is_connected:
+                try:
+                    seq, num_reports, layout, data, timestamp = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                stream_mode, sample_size, channels = layout
+                header = BLOCK_HEADER.pack(BLOCK_MAGIC, seq, num_reports, sample_size,
+                                           stream_mode, channels, self.dropped_blocks, timestamp)
+                self.conn.sendall(header + data)
+                self.sent_blocks += 1
+                self.sent_bytes += len(header) + len(data)
+                self.lag = time.time() - timestamp
+        except OSError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        # Called by the publisher (disconnect policy) or the sender thread
+        with self.close_lock:
+            if not self.is_connected:
+                return
+            self.is_connected = False
+        # shutdown() wakes a sender blocked in sendall() on a stalled
+        # client, close() alone doesn't
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        self.broker.remove(self)
+
+    def metrics(self):
+        return {
+            "name": self.name,
+            "queued": self.queue.qsize(),
+            "sent_blocks": self.sent_blocks,
+            "sent_bytes": self.sent_bytes,
+            "dropped_blocks": self.dropped_blocks,
+            "lag": self.lag
+        }
+
+class StreamBroker:
+    def __init__(self, queue_blocks=QUEUE_BLOCKS, policy=POLICY_DROP_OLDEST):
+        if policy not in policies:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.queue_blocks = queue_blocks
+        self.policy = policy
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.seq = 0
+        self.is_running = True
+
+    def listen_tcp(self, host="127.0.0.1", port=5025):
+        sock = socket.create_server((host, port))
+        self.start_listener(sock)
+        return sock.getsockname()
+
+    def listen_unix(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen()
+        self.start_listener(sock)
+        return path
+
+    def start_listener(self, sock):
+        self.listeners.append(sock)
+        threading.Thread(target=self.accept, args=(sock,), daemon=True).start()
+
+    def accept(self, sock):
+        while self.is_running:
+            try:
+                conn, address = sock.accept()
+            except OSError:
+                break
+            if conn.family != getattr(socket, "AF_UNIX", None):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = Subscriber(self, conn, str(address or sock.getsockname()),
+                                    self.queue_blocks, self.policy)
+            # Listed before its thread runs, so a quick close() can remove it
+            with self.lock:
+                self.subscribers.append(subscriber)
+            subscriber.start()
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, records, timestamp=None):
+        # records: report records decoded once by the owner of the device.
+        # The block is serialized once and shared by every subscriber.
+        if len(records) == 0:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        block = (self.seq, len(records), records_layout(records.dtype), records.tobytes(), timestamp)
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(block)
+
+    def metrics(self):
+        with self.lock:
+            return [subscriber.metrics() for subscriber in self.subscribers]
+
+    def close(self):
+        self.is_running = False
+        for sock in self.listeners:
+            sock.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+class StreamClient:
+    # Subscriber side: iterate to get (header, records) per block
+    def __init__(self, tcp=None, unix=None, timeout=None):
+        if unix:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix)
+        else:
+            self.sock = socket.create_connection(tcp)
+        self.sock.settimeout(timeout)
+        self.file = self.sock.makefile("rb")
+
+    def __iter__(self):
+        while True:
+            data = self.file.read(BLOCK_HEADER.size)
+            if len(data) < BLOCK_HEADER.size:
+                return
+            (magic, seq, num_reports, sample_size, stream_mode,
+             channels, dropped, timestamp) = BLOCK_HEADER.unpack(data)
+            if magic != BLOCK_MAGIC:
+                raise ValueError("Stream out of sync")
+            dtype = layout_dtype(stream_mode, sample_size, channels)
+            payload = self.file.read(num_reports * dtype.itemsize)
+            if len(payload) != num_reports * dtype.itemsize:
+                return      # Disconnected within the block
+            header = {"seq": seq, "dropped": dropped, "timestamp": timestamp,
+                      "stream_mode": stream_mode, "channels": channels}
+            yield header, np.frombuffer(payload, dtype=dtype)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def main(argv=None):
+    from device import Device
+
+    parser = argparse.ArgumentParser(description="Fan out the power monitor stream to local subscribers")
+    parser.add_argument("--cmd-port", default="COM13")
+    parser.add_argument("--data-port", default="COM14")
+    parser.add_argument("--baudrate", type=int, default=10000000)
+    parser.add_argument("--conv-time", default="280uS")
+    parser.add_argument("--avg-num", default="AVG_NUM_1")
+    parser.add_argument("--adc-range", default="RANGE_0")
+    parser.add_argument("--stream-mode", choices=protocol.stream_modes, default="scaled")
+    parser.add_argument("--channels", default=None,
+                        help="channels for --stream-mode channels, e.g. voltage,current,dietemp")
+    parser.add_argument("--tcp", default="127.0.0.1:5025", help="host:port, empty to disable")
+    parser.add_argument("--unix", default=None, help="Unix socket path")
+    parser.add_argument("--queue", type=int, default=QUEUE_BLOCKS, help="blocks buffered per subscriber")
+    parser.add_argument("--policy", choices=policies, default=POLICY_DROP_OLDEST)
+    args = parser.parse_args(argv)
+
+    broker = StreamBroker(args.queue, args.policy)
+    if args.tcp:
+        address = broker.listen_tcp(*parse_address(args.tcp))
+        print(f"TCP: {address[0]}:{address[1]}")
+    if args.unix:
+        print(f"Unix: {broker.listen_unix(args.unix)}")
+
+    try:
+        with Device.open(args.cmd_port, args.data_port, args.baudrate) as dev:
+            dev.configure(args.conv_time, args.avg_num, args.adc_range)
+            if args.channels:
+                dev.set_channels(args.channels)
+            with dev.capture(stream_mode=protocol.stream_modes[args.stream_mode]) as acq:
+                next_metrics = time.time() + METRICS_INTERVAL
+                for records in acq:
+                    broker.publish(records)
+                    if time.time() >= next_metrics:
+                        next_metrics += METRICS_INTERVAL
+                        for m in broker.metrics():
+                            sys.stderr.write(f"{m['name']}: queued {m['queued']}, sent {m['sent_blocks']}, "
+                                             f"dropped {m['dropped_blocks']}, lag {m['lag']:.3f} s\n")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Battery discharge playback on the VBAT simulator. A profile is a CSV of
+# voltage versus time or versus charge drawn:
+#
+#   time_s,voltage            charge_mAh,voltage
+#   0,4.20                    0,4.20
+#   600,4.05                  50,4.02
+#   ...                       ...
+#
+# A ProfilePlayer thread sends CMD_SET_BAT_SIM_VOLT whenever the DAC code
+# changes, off the GUI thread:
+#
+# - time profiles: each step is due at start + time / speed, deadlines are
+#   taken from the start time and not from the previous command, so the
+#   command latency doesn't accumulate. Steps overdue after a stall collapse
+#   into the latest one.
+# - charge profiles (closed loop): the voltage is interpolated at the charge
+#   measured from the current stream (ChargeCounter) x speed, checked every
+#   POLL_INTERVAL.
+#
+# Every command is logged with its scheduled and actual apply time.
+#
+#   python vbat_profile.py discharge.csv --cmd COM13 --data COM14 --speed 60 --log applied.csv
+
+import csv
+import time
+import argparse
+import threading
+import numpy as np
+
+from protocol import DATA_MAX_4P2, report_units, vbat_code, vbat_voltage
+
+POLL_INTERVAL = 0.1        # Charge profile update period [s]
+LOG_COLUMNS = ("scheduled_s", "applied_s", "position", "code", "voltage")
+
+# First CSV column -> profile axis
+profile_axes = {
+    "time_s":     "time",
+    "charge_mAh": "charge"
+}
+
+class Profile:
+    def __init__(self, axis, positions, voltages):
+        # axis: "time" (positions in s) or "charge" (positions in mAh)
+        self.axis = axis
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.voltages = np.asarray(voltages, dtype=np.float64)
+        if len(self.positions) == 0 or len(self.positions) != len(self.voltages):
+            raise ValueError("Empty profile")
+        if np.any(np.diff(self.positions) < 0):
+            raise ValueError(f"Profile {axis} must be increasing")
+        if np.any(self.voltages < 0) or np.any(self.voltages > vbat_voltage(DATA_MAX_4P2)):
+            raise ValueError(f"Profile voltages must be 0..{vbat_voltage(DATA_MAX_4P2):.2f} V")
+
+    def code_at(self, position):
+        return vbat_code(float(np.interp(position, self.positions, self.voltages)))
+
+def load_profile(path):
+    with open(path, "r", newline="") as file:
+        rows = [row for row in csv.reader(file) if row and not row[0].startswith("#")]
+    if not rows or len(rows[0]) < 2 or rows[0][0].strip() not in profile_axes:
+        raise ValueError(f"Profile header must be one of {', '.join(c + ',voltage' for c in profile_axes)}")
+    try:
+        data = np.array([[float(row[0]), float(row[1])] for row in rows[1:]]).reshape(-1, 2)
+    except (IndexError, ValueError):
+        raise ValueError(f"Invalid profile row in {path}")
+    return Profile(profile_axes[rows[0][0].strip()], data[:, 0], data[:, 1])
+
+class ChargeCounter:
+    # Charge drawn [mAh] from the current batches, fed by one thread and read
+    # by the player
+    def __init__(self, period):
+        self.period = period
+        self.total = 0.0           # [mA.s]
+
+    def append(self, current):
+        # current: stored values (see protocol.report_units)
+        self.total += float(np.sum(current, dtype=np.float64)) * report_units["current"][0] * self.period
+
+    @property
+    def charge(self):
+        return self.total / 3600
+
+class ProfilePlayer:
+    def __init__(self, profile, send, speed=1.0, charge=None, log_path=None, poll=POLL_INTERVAL):
+        # send(code): issues CMD_SET_BAT_SIM_VOLT, called from the player
+        # thread, raises on error. charge(): charge drawn [mAh], needed by
+        # charge profiles.
+        if speed <= 0:
+            raise ValueError(f"Invalid playback speed: {speed}")
+        if profile.axis == "charge" and charge is None:
+            raise ValueError("A charge profile needs the measured charge")
+        self.profile = profile
+        self.send = send
+        self.speed = speed
+        self.charge = charge
+        self.poll = poll
+        self.log = []              # LOG_COLUMNS tuples
+        self.log_file = open(log_path, "w", newline="") if log_path else None
+        self.log_writer = None
+        if self.log_file:
+            self.log_writer = csv.writer(self.log_file)
+            self.log_writer.writerow(LOG_COLUMNS)
+        self.code = None
+        self.error = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def run(self):
+        try:
+            if self.profile.axis == "time":
+                self.play_time()
+            else:
+                self.play_charge()
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.log_file:
+                self.log_file.close()
+
+    def apply(self, code, scheduled, position):
+        if code == self.code:
+            return
+        self.send(code)
+        self.code = code
+        entry = (scheduled, self.elapsed(), position, code, vbat_voltage(code))
+        self.log.append(entry)
+        if self.log_writer:
+            self.log_writer.writerow(entry)
+            self.log_file.flush()
+
+    def play_time(self):
+        deadlines = self.profile.positions / self.speed
+        i = 0
+        while i < len(deadlines):
+            if self.stop_event.wait(max(deadlines[i] - self.elapsed(), 0)):
+                return
+            # Latest step due, after a stall the missed ones are skipped
+            i = int(np.searchsorted(deadlines, self.elapsed(), side="right")) - 1
+            i = max(i, 0)
+            self.apply(vbat_code(self.profile.voltages[i]), float(deadlines[i]),
+                       float(self.profile.positions[i]))
+            i += 1
+
+    def play_charge(self):
+        end = self.profile.positions[-1]
+        while True:
+            position = self.charge() * self.speed
+            self.apply(self.profile.code_at(position), self.elapsed(), position)
+            if position >= end or self.stop_event.wait(self.poll):
+                return
+
+def main(argv=None):
+    from device import Device
+    from protocol import sample_period
+
+    parser = argparse.ArgumentParser(description="Play a battery discharge profile on the VBAT simulator")
+    parser.add_argument("profile", help="CSV with time_s,voltage or charge_mAh,voltage")
+    parser.add_argument("--cmd", required=True, help="command serial port")
+    parser.add_argument("--data", required=True, help="data serial port")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed (time or charge x speed)")
+    parser.add_argument("--log", default=None, help="CSV of the applied commands")
+    parser.add_argument("--conv-time", default="280uS")
+    parser.add_argument("--avg-num", default="AVG_NUM_1")
+    parser.add_argument("--adc-range", default="RANGE_0")
+    args = parser.parse_args(argv)
+
+    profile = load_profile(args.profile)
+    with Device.open(args.cmd, args.data) as dev:
+        dev.set_vbat(profile.code_at(profile.positions[0]))
+        dev.enable_vbat(True)
+        if profile.axis == "time":
+            player = ProfilePlayer(profile, dev.set_vbat, args.speed, log_path=args.log)
+            player.start()
+            try:
+                player.thread.join()
+            except KeyboardInterrupt:
+                pass
+            player.stop()
+        else:
+            # The current stream gives the charge, the player runs beside it
+            dev.configure(args.conv_time, args.avg_num, args.adc_range)
+            counter = ChargeCounter(sample_period(args.conv_time, args.avg_num))
+            player = ProfilePlayer(profile, dev.set_vbat, args.speed, lambda: counter.charge, args.log)
+            with dev.capture() as acq:
+                player.start()
+                try:
+                    for batch in acq:
+                        counter.append(batch["current"])
+                        if not player.is_running():
+                            break
+                except KeyboardInterrupt:
+                    pass
+                player.stop()
+            print(f"Charge drawn: {counter.charge:.3f} mAh")
+        for scheduled, applied, position, code, voltage in player.log:
+            print(f"{scheduled:10.3f} s  {applied:10.3f} s  {position:10.3f}  {voltage:.3f} V")
+        if player.error:
+            raise SystemExit(f"Playback stopped: {player.error}")
+
+if __name__ == "__main__":
+    main()
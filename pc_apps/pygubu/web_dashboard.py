@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2024 Hery Dang (henrydang@mijoconnected.com)
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+
+# Browser view of a rig, stdlib only. The dashboard is one more subscriber of
+# stream_server.py (so it never touches the acquisition path) and pushes
+# min/max decimated frames sized to the browser canvas with Server-Sent Events,
+# at most FRAME_RATE times per second, one plot per streamed channel. Marker
+# statistics are computed here on the full resolution current samples.
+#
+#   python stream_server.py --tcp 127.0.0.1:5025
+#   python web_dashboard.py --stream 127.0.0.1:5025 --http 0.0.0.0:8080
+
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from protocol import sample_period, channel_arrays, channels
+from ring_buffer import ChannelBuffers, minmax_decimate
+from stream_server import StreamClient, parse_address
+
+HISTORY_SAMPLES = 1 << 20  # Samples kept per channel
+FRAME_RATE = 10            # Max frames per second per browser
+MAX_WIDTH = 4096           # Max decimated bins per frame
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Power Monitor</title>
+<style>
+body { font-family: sans-serif; background: #222; color: #ddd; margin: 10px; }
+canvas { background: #6c9159; width: 100%; display: block; margin-bottom: 8px; }
+#stats span { margin-right: 20px; }
+</style></head>
+<body>
+<div>Window <select id="window">
+<option value="0.5">0.5 s</option><option value="2" selected>2 s</option>
+<option value="10">10 s</option><option value="60">60 s</option></select>
+Markers <input id="m1" type="range" min="0" max="1000" value="200">
+<input id="m2" type="range" min="0" max="1000" value="400"></div>
+<div id="plots"></div>
+<div id="stats"></div>
+<script>
+let source = null;
+function connect() {
+  if (source) source.close();
+  const q = new URLSearchParams({
+    width: document.getElementById("plots").clientWidth,
+    window: document.getElementById("window").value,
+    m1: document.getElementById("m1").value / 1000,
+    m2: document.getElementById("m2").value / 1000
+  });
+  source = new EventSource("/stream?" + q);
+  source.onmessage = (e) => draw(JSON.parse(e.data));
+}
+const colors = {voltage: "orange", current: "green"};
+function canvas(name) {
+  let c = document.getElementById("plot_" + name);
+  if (!c) {
+    c = document.createElement("canvas");
+    c.id = "plot_" + name;
+    c.height = name == "current" ? 300 : 150;
+    document.getElementById("plots").appendChild(c);
+  }
+  return c;
+}
+function plot(ch, m) {
+  const c = canvas(ch.name), g = c.getContext("2d");
+  c.width = c.clientWidth;
+  g.clearRect(0, 0, c.width, c.height);
+  const n = ch.min.length;
+  if (!n) return;
+  let lo = Math.min(...ch.min), hi = Math.max(...ch.max);
+  if (hi == lo) { hi += 1; lo -= 1; }
+  const y = (v) => c.height - 5 - (v - lo) / (hi - lo) * (c.height - 10);
+  g.strokeStyle = colors[ch.name] || "cyan";
+  g.beginPath();
+  for (let i = 0; i < n; i++) {
+    const x = i * c.width / n;
+    g.moveTo(x, y(ch.min[i])); g.lineTo(x, y(ch.max[i]) - 1);
+  }
+  g.stroke();
+  g.fillStyle = "#fff";
+  g.fillText(ch.name + " [" + ch.unit + "]  " + hi + " / " + lo, 5, 12);
+  if (m) {
+    [[m[0], "red"], [m[1], "blue"]].forEach(([p, col]) => {
+      g.strokeStyle = col; g.beginPath();
+      g.moveTo(p * c.width, 0); g.lineTo(p * c.width, c.height); g.stroke();
+    });
+  }
+}
+function draw(f) {
+  f.channels.forEach((ch) => plot(ch, ch.name == "current" ? f.markers : null));
+  const s = f.stats;
+  document.getElementById("stats").innerHTML =
+    `<span>Avg ${s.mean.toFixed(2)} mA</span><span>Min ${s.min.toFixed(2)} mA</span>` +
+    `<span>Max ${s.max.toFixed(2)} mA</span><span>Charge ${s.charge.toExponential(3)} C</span>` +
+    `<span>Samples ${f.samples}</span><span>Lost blocks ${f.dropped}</span>`;
+}
+["window", "m1", "m2"].forEach((id) => document.getElementById(id).onchange = connect);
+window.onresize = connect;
+connect();
+</script></body></html>
+"""
+
+class Dashboard:
+    def __init__(self, stream_address, period, history=HISTORY_SAMPLES):
+        self.stream_address = stream_address
+        self.sample_period = period
+        self.buffers = ChannelBuffers(history)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.is_running = True
+        threading.Thread(target=self.receive_data, daemon=True).start()
+
+    def receive_data(self):
+        while self.is_running:
+            client = None
+            try:
+                client = StreamClient(tcp=self.stream_address)
+                for header, records in client:
+                    arrays = channel_arrays(records)
+                    with self.lock:
+                        self.buffers.append(arrays)
+                        self.dropped = header["dropped"]
+            except (OSError, ValueError):
+                # Refused, dropped or out of sync, reconnect on a new socket
+                pass
+            finally:
+                if client:
+                    client.close()
+            time.sleep(1.0)
+
+    def frame(self, width, window, m1, m2):
+        n = max(int(window / self.sample_period), 1)
+        with self.lock:
+            arrays = {name: values.copy() for name, values in self.buffers.latest(n).items()}
+            total = max((buffer.total for buffer in self.buffers.buffers.values()), default=0)
+            dropped = self.dropped
+
+        plots = []
+        for name, values in arrays.items():
+            v_min, v_max = minmax_decimate(values, width)
+            plots.append({"name": name, "unit": channels.get(name, (0, ""))[1],
+                          "min": v_min.tolist(), "max": v_max.tolist()})
+
+        # Marker statistics over the full resolution samples
+        current = arrays.get("current", np.zeros(0))
+        lo, hi = sorted((m1, m2))
+        selected = current[int(lo * len(current)):int(hi * len(current))]
+        if len(selected):
+            stats = {"mean": float(selected.mean()), "min": float(selected.min()),
+                     "max": float(selected.max()),
+                     "charge": float(selected.sum(dtype=np.float64)) * self.sample_period / 1000}
+        else:
+            stats = {"mean": 0.0, "min": 0, "max": 0, "charge": 0.0}
+
+        return {
+            "samples": total,
+            "dropped": dropped,
+            "channels": plots,
+            "markers": [m1, m2],
+            "stats": stats
+        }
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    dashboard = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/":
+            body = PAGE.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif url.path == "/stream":
+            self.stream(parse_qs(url.query))
+        else:
+            self.send_error(404)
+
+    def stream(self, query):
+        def param(name, default):
+            try:
+                return float(query.get(name, [default])[0])
+            except ValueError:
+                return default
+
+        width = int(min(max(param("width", 1000), 1), MAX_WIDTH))
+        window = max(param("window", 2.0), self.dashboard.sample_period)
+        m1 = min(max(param("m1", 0.2), 0.0), 1.0)
+        m2 = min(max(param("m2", 0.4), 0.0), 1.0)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            next_frame = time.monotonic()
+            while True:
+                frame = self.dashboard.frame(width, window, m1, m2)
+                self.wfile.write(b"data: " + json.dumps(frame).encode() + b"\n\n")
+                self.wfile.flush()
+                next_frame += 1.0 / FRAME_RATE
+                time.sleep(max(next_frame - time.monotonic(), 0))
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Web dashboard for the power monitor stream")
+    parser.add_argument("--stream", default="127.0.0.1:5025", help="stream_server.py TCP address")
+    parser.add_argument("--http", default="127.0.0.1:8080", help="host:port to serve on")
+    parser.add_argument("--conv-time", default="280uS")
+    parser.add_argument("--avg-num", default="AVG_NUM_1")
+    parser.add_argument("--dietemp", action="store_true",
+                        help="the stream includes the die temperature channel")
+    args = parser.parse_args(argv)
+
+    DashboardHandler.dashboard = Dashboard(parse_address(args.stream),
+                                           sample_period(args.conv_time, args.avg_num, args.dietemp))
+    server = ThreadingHTTPServer(parse_address(args.http), DashboardHandler)
+    server.daemon_threads = True
+    print("Dashboard: http://%s:%d/" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()